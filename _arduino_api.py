@@ -1,5 +1,516 @@
-import numpy as _n
+import numpy     as _n
+import os        as _os
 import serial
+import binascii  as _binascii
+import struct    as _struct
+import threading as _threading
+import time      as _time
+
+from collections        import deque as _deque
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+
+from _instrumentation import instrumentation
+from _channel_schema  import default_schema
+from _clock_sync      import clock_sync
+
+# Number of Serial.println() fields in one telemetry packet of the original
+# board. Other boards are described by a channel_schema.
+_packet_length = default_schema.length
+
+# Binary telemetry frame: sync word, sequence number, the fields as
+# float32, and a CRC-16/CCITT of the sequence number and fields.
+_binary_sync    = b'\xa5\x5a'
+_binary_request = 'B' # Sent by the host to ask for binary telemetry
+_binary_frame_sync = _n.frombuffer(_binary_sync, '<u2')[0]
+
+def _get_binary_dtype(length):
+    """
+    Returns the numpy dtype of a binary frame with length fields.
+    """
+    return _n.dtype([('sync', '<u2'), ('seq', '<u2'), ('data', '<f4', length), ('crc', '<u2')])
+
+_binary_dtype = _get_binary_dtype(_packet_length)
+_binary_size  = _binary_dtype.itemsize
+
+# CRC-16/CCITT (binascii.crc_hqx) of any 16-bit word shifted through the
+# register, so the CRC of a run of frames can be taken two bytes at a time,
+# for every frame at once: crc = _crc_table[crc ^ word].
+_crc_table = _n.arange(65536, dtype=_n.uint32)
+for _bit in range(16): _crc_table = _n.where(_crc_table & 0x8000, (_crc_table << 1) ^ 0x1021, _crc_table << 1) & 0xFFFF
+_crc_table = _crc_table.astype(_n.uint16)
+
+# Below this many frames, binascii one frame at a time is quicker
+_crc_bulk = 128
+
+def _get_binary_body_dtype(length):
+    """
+    Returns a dtype picking out the words the CRC of a binary frame with
+    length fields covers (sequence number and fields), big-endian as the
+    CRC reads them.
+    """
+    size = _get_binary_dtype(length).itemsize
+    return _n.dtype(dict(names=['body'], formats=[('>u2', (size-4)//2)], offsets=[2], itemsize=size))
+
+class receive_buffer():
+    """
+    Preallocated buffer that the serial port reads straight into, and that
+    the decoders parse in place. Parsed bytes are released with consume();
+    what is left (at most a partial packet) is only moved to the front when
+    a read needs the room, and the buffer only grows if a read needs more
+    room than it has.
+    
+    Parameters
+    ----------
+    size=65536 : int
+        Initial size (bytes).
+    """
+    def __init__(self, size=65536):
+        
+        self.data  = bytearray(size)
+        self.view  = memoryview(self.data)
+        self.start = 0 # First unparsed byte
+        self.end   = 0 # End of the bytes received
+    
+    def __len__(self): return self.end - self.start
+    
+    def get_view(self):
+        """
+        Returns a memoryview of the unparsed bytes.
+        """
+        return self.view[self.start:self.end]
+    
+    def reserve(self, n):
+        """
+        Returns a memoryview of n bytes of free space after the unparsed
+        bytes, making room if needed.
+        """
+        if self.end + n > len(self.data):
+            length = self.end - self.start
+            
+            # Too small even when compacted, so grow
+            if length + n > len(self.data):
+                data = bytearray(max(2*len(self.data), length+n))
+                data[:length] = self.view[self.start:self.end]
+                self.data, self.view = data, memoryview(data)
+            
+            # Move the partial packet to the front
+            else: self.data[:length] = self.view[self.start:self.end]
+            self.start, self.end = 0, length
+        
+        return self.view[self.end:self.end+n]
+    
+    def write(self, data):
+        """
+        Appends bytes we already have, e.g. from tests or a boot banner.
+        """
+        n = len(data)
+        self.reserve(n)[:] = data
+        self.end += n
+    
+    def readinto(self, port, n):
+        """
+        Reads n bytes waiting on the port straight into the buffer, or blocks
+        for one (up to the port's timeout) if n is 0. Real serial ports are
+        read with os.readv() on their file descriptor, since pyserial's own
+        readinto() reads into a new bytes object and copies it.
+        
+        Returns
+        -------
+        Number of bytes read.
+        """
+        if not n:
+            data = port.read(1)
+            self.write(data)
+            return len(data)
+        
+        view = self.reserve(n)
+        fd   = getattr(port, 'fd', None)
+        if fd is not None and hasattr(_os, 'readv'):
+            try:                    got = _os.readv(fd, [view])
+            except BlockingIOError: got = 0
+        else: got = port.readinto(view) or 0
+        
+        self.end += got
+        return got
+    
+    def consume(self, n):
+        """
+        Releases the first n unparsed bytes.
+        """
+        self.start += n
+        if self.start == self.end: self.start = self.end = 0
+    
+    def clear(self):
+        """
+        Releases everything.
+        """
+        self.start = self.end = 0
+
+
+class packet_decoder():
+    """
+    Incremental decoder for the Serial.println() telemetry stream. Partial
+    lines are carried over between calls to feed(), so reads that split or
+    concatenate packets lose nothing.
+    
+    The ASCII stream has no explicit framing, so packet boundaries are found
+    by counting fields. A line that doesn't parse still counts as the field
+    it replaced (or the fields, if it swallowed line ends), and the packet it
+    falls in is dropped whole, so the packets after it stay aligned even in
+    a continuous stream. Whole lines lost in transit can only be caught by
+    frame_gap: the count is also re-synchronized whenever the line goes quiet
+    for longer than that with a packet only partially received (the firmware
+    pauses between packets, never within one).
+    
+    The port reads straight into self.buffer (see receive_buffer), and
+    parse() converts every complete line in one numpy call, into a field
+    array that is reused from call to call, falling back to line by line
+    only when something doesn't parse.
+    
+    Parameters
+    ----------
+    length=9 : int
+        Number of fields (lines) in one packet.
+        
+    frame_gap=0.1 : float or None
+        Silence (s) between reads that marks the start of a new packet. None
+        disables re-synchronization.
+    """
+    def __init__(self, length=_packet_length, frame_gap=0.1):
+        
+        self.length    = length
+        self.frame_gap = frame_gap
+        
+        # Decoder state. Fields are parsed into one preallocated array, after
+        # those of the packet being assembled, which sit at its front.
+        self.buffer    = receive_buffer()
+        self._unparsed = 0                 # Bytes after the last newline
+        self._values   = _n.zeros(4096)    # Fields being parsed
+        self._carry    = 0                 # Fields of the packet being assembled
+        self._skip     = 0                 # Lines left of a packet spoiled by junk
+        self._t_last   = None              # Arrival time of the previous read
+        
+        # Counters
+        self.frames    = 0  # Complete packets returned
+        self.dropped   = 0  # Packets cut short by a gap or spoiled by junk
+        self.malformed = 0  # Lines that could not be parsed
+    
+    def feed(self, data, t=None):
+        """
+        Decodes the supplied bytes (see parse()).
+        
+        Parameters
+        ----------
+        data : bytes
+            Raw bytes from the serial port.
+        
+        t=None : float
+            Arrival time of the bytes (s, from time.monotonic()).
+        """
+        self.buffer.write(data)
+        return self.parse(t)
+    
+    def parse(self, t=None):
+        """
+        Decodes the bytes received into self.buffer since the last call.
+        
+        Parameters
+        ----------
+        t=None : float
+            Arrival time of the bytes (s, from time.monotonic()). Used to stamp
+            the packets and to detect gaps in the stream.
+        
+        Returns
+        -------
+        t : array
+            Time of each packet completed.
+        
+        data : array
+            One row of fields per packet.
+        """
+        buffer = self.buffer
+        
+        # A gap in the middle of a packet means we lost the rest of it.
+        if  self.frame_gap is not None and self._t_last is not None and t is not None \
+        and t - self._t_last > self.frame_gap and (self._carry or self._unparsed):
+            self.dropped += 1
+            self._carry   = 0
+            self._skip    = 0
+            buffer.consume(self._unparsed)
+        self._t_last = t
+        
+        # Complete lines only, leaving the remainder for next time
+        end = buffer.data.rfind(b'\n', buffer.start, buffer.end) + 1
+        if not end:
+            self._unparsed = len(buffer)
+            return _n.zeros(0), _n.zeros((0, self.length))
+        
+        # Split the lines out of one copy of the buffer (bytes can't be split
+        # in place), leaving off the last line end.
+        lines = bytes(buffer.view[buffer.start:end-1]).split(b'\n')
+        buffer.consume(end - buffer.start)
+        self._unparsed = len(buffer)
+        
+        # Finish skipping a spoiled packet
+        if self._skip:
+            skip        = min(self._skip, len(lines))
+            lines       = lines[skip:]
+            self._skip -= skip
+        
+        # numpy converts the lines straight into the field array; if any of
+        # them doesn't parse, go line by line.
+        fields = self._reserve(self._carry + len(lines))
+        try:    fields[self._carry:] = lines
+        except ValueError: fields = self._parse_lines(lines)
+        
+        # Whole packets out, the rest carried over to the front
+        count = len(fields) // self.length
+        n     = count*self.length
+        data  = fields[:n].reshape(count, self.length).copy()
+        self._carry = len(fields) - n
+        self._values[:self._carry] = fields[n:]
+        self.frames += count
+        
+        return _n.full(count, _n.nan if t is None else t), data
+    
+    def _reserve(self, n):
+        """
+        Returns a view of the first n values of the field array, growing it
+        (and keeping the fields carried over) if needed.
+        """
+        if n > len(self._values):
+            values = _n.zeros(max(2*len(self._values), n))
+            values[:self._carry] = self._values[:self._carry]
+            self._values = values
+        
+        return self._values[:n]
+    
+    def _parse_lines(self, lines):
+        """
+        Parses lines one by one onto the packet being assembled, and returns
+        all the fields. Junk spoils the whole packet it falls in: the fields
+        before it are dropped, and as many lines after it as the packet had
+        left are skipped.
+        """
+        fields = self._values[:self._carry].tolist()
+        for line in lines:
+            
+            # Rest of a spoiled packet
+            if self._skip:
+                self._skip -= 1
+                continue
+            
+            # float() strips the trailing '\r' for us
+            try: fields.append(float(line))
+            
+            except ValueError:
+                self.malformed += 1
+                partial = len(fields) % self.length
+                del fields[len(fields)-partial:]
+                
+                # Every println() ends in '\r\n', so a line that swallowed
+                # line ends stands for that many fields
+                slots = partial + max(1, line.count(b'\r'))
+                self.dropped += -(-slots // self.length)
+                self._skip    = -slots % self.length
+        
+        values    = self._reserve(len(fields))
+        values[:] = fields
+        return values
+    
+    def reset(self):
+        """
+        Forgets any partially received packet. Counters are kept.
+        """
+        self.buffer.clear()
+        self._unparsed = 0
+        self._carry    = 0
+        self._skip     = 0
+        self._t_last   = None
+
+
+def encode_binary_frame(seq, fields):
+    """
+    Packs one sample into a binary telemetry frame, exactly as the firmware
+    sends it in binary mode.
+    
+    Parameters
+    ----------
+    seq : int
+        Sequence number (wraps at 65536).
+    
+    fields : list
+        The telemetry values.
+    
+    Returns
+    -------
+    bytes
+    """
+    body = _struct.pack('<H%df' % len(fields), seq & 0xFFFF, *fields)
+    return _binary_sync + body + _struct.pack('<H', _binascii.crc_hqx(body, 0xFFFF))
+
+
+class binary_decoder():
+    """
+    Incremental decoder for the binary telemetry stream (see
+    encode_binary_frame()). The port reads straight into self.buffer (see
+    receive_buffer), runs of aligned frames are decoded in place in bulk
+    with numpy, and the decoder re-synchronizes on the sync word after
+    corruption. Has the same interface as packet_decoder.
+    
+    Parameters
+    ----------
+    length=9 : int
+        Number of fields in each frame.
+    
+    clock=None : clock_sync
+        Drift model of the frames' sequence numbers, used to give every frame
+        the time the firmware sent it rather than the arrival time of the
+        read. None stamps frames with the arrival time.
+    """
+    def __init__(self, length=_packet_length, clock=None):
+        
+        self.length = length
+        self.clock  = clock
+        self._dtype = _get_binary_dtype(length)
+        self._body  = _get_binary_body_dtype(length)
+        self._size  = self._dtype.itemsize
+        
+        # Decoder state
+        self.buffer    = receive_buffer()
+        self._last_seq = None
+        
+        # Counters
+        self.frames    = 0  # Frames returned
+        self.dropped   = 0  # Frames missing from the sequence
+        self.malformed = 0  # Frames that failed the CRC, or runs of junk bytes
+    
+    def feed(self, data, t=None):
+        """
+        Decodes the supplied bytes (see parse()).
+        
+        Parameters
+        ----------
+        data : bytes
+            Raw bytes from the serial port.
+        
+        t=None : float
+            Arrival time of the bytes (s, from time.monotonic()).
+        """
+        self.buffer.write(data)
+        return self.parse(t)
+    
+    def parse(self, t=None):
+        """
+        Decodes the bytes received into self.buffer since the last call.
+        
+        Parameters
+        ----------
+        t=None : float
+            Arrival time of the bytes (s, from time.monotonic()), used to
+            stamp the frames.
+        
+        Returns
+        -------
+        t : array
+            Time of each frame completed.
+        
+        data : array
+            One row of fields per frame.
+        """
+        buffer = self.buffer
+        data   = buffer.data
+        size   = self._size
+        end    = buffer.end
+        
+        times  = []
+        blocks = []
+        i = buffer.start
+        while end - i >= size:
+            
+            # Skip to the next sync word if we are not on one
+            if not data.startswith(_binary_sync, i):
+                self.malformed += 1
+                j = data.find(_binary_sync, i+1, end)
+                if j < 0: i = end-1; break
+                i = j
+                continue
+            
+            # Look at every whole frame left, and keep the run still in sync
+            frames = _n.frombuffer(data, self._dtype, (end-i)//size, i)
+            synced = frames['sync'] == _binary_frame_sync
+            count  = len(frames) if _n.count_nonzero(synced) == len(frames) else int(_n.argmin(synced))
+            frames = frames[:count]
+            
+            # The CRC covers everything between the sync word and the CRC
+            ok   = self._check_crcs(data, i, frames)
+            good = count
+            if ok is not None:
+                good = _n.count_nonzero(ok)
+                self.malformed += count - good
+                frames = frames[ok]
+            
+            # Time of each frame, from its sequence number if we can
+            seqs = frames['seq'].astype(_n.int64)
+            if self.clock is None or t is None: 
+                stamps = _n.empty(good)
+                stamps.fill(_n.nan if t is None else t)
+                times.append(stamps)
+            else: times.append(self.clock.update(seqs, t))
+            
+            # Count the frames the sequence numbers say we missed. The steps
+            # wrap around like the 16-bit sequence numbers.
+            if good:
+                if self._last_seq is not None: self.dropped += (int(seqs[0]) - self._last_seq - 1) % 65536
+                steps = frames['seq'][1:] - frames['seq'][:-1]
+                if _n.count_nonzero(steps != 1): self.dropped += int((steps - _n.uint16(1)).sum(dtype=_n.int64))
+                self._last_seq = int(seqs[-1])
+            
+            # Copy out before the buffer is reused
+            blocks.append(frames['data'].astype(float))
+            self.frames += good
+            i += count*size
+            del frames
+        
+        # Keep only the unprocessed tail
+        buffer.consume(i - buffer.start)
+        
+        if not blocks: return _n.zeros(0), _n.zeros((0, self.length))
+        if len(blocks) == 1: return times[0], blocks[0]
+        return _n.concatenate(times), _n.concatenate(blocks)
+    
+    def _check_crcs(self, data, offset, frames):
+        """
+        Checks the CRCs of the frames found at offset in data, computing them
+        as the firmware does (see encode_binary_frame()). Long runs are done
+        for every frame at once, a word position at a time.
+        
+        Returns
+        -------
+        None if every CRC is right, otherwise a boolean array marking the
+        frames whose CRC is.
+        """
+        size, count = self._size, len(frames)
+        if count < _crc_bulk: 
+            view = memoryview(data)
+            crcs = [_binascii.crc_hqx(view[k+2:k+size-2], 0xFFFF) for k in range(offset, offset+count*size, size)]
+            if frames['crc'].tolist() == crcs: return None
+        
+        else:
+            words = _n.frombuffer(data, self._body, count, offset)['body'].T.astype(_n.uint16, order='C')
+            crcs  = _n.full(count, 0xFFFF, _n.uint16)
+            for word in words: crcs = _crc_table[crcs ^ word]
+        
+        ok = frames['crc'] == crcs
+        return None if _n.count_nonzero(ok) == count else ok
+    
+    def reset(self):
+        """
+        Forgets any partially received frame. Counters are kept.
+        """
+        self.buffer.clear()
+        self._last_seq = None
+
 
 class arduino_api():
     """
@@ -9,7 +520,8 @@ class arduino_api():
     Parameters
     ----------
     port='COM3' : str
-        Name of the port to connect to.
+        Name of the port to connect to, or a pyserial URL such as 'loop://'.
+        'Simulation' connects to an arduino_simulator.
         
     address=1 : int
         Address of the instrument. Can be 0-255, and must match the instrument
@@ -23,48 +535,364 @@ class arduino_api():
         
     temperature_limit=450 : float
         Upper limit on the temperature setpoint (C).
+        
+    buffer_size=10000 : int
+        Number of reads' worth of parsed samples the background reader will
+        hold before the oldest ones are discarded.
+    
+    simulator=None : arduino_simulator
+        Simulated device to talk to in simulation mode. None means a default
+        arduino_simulator with the channels of the schema.
+    
+    schema=None : channel_schema
+        Channels of the board, which set the telemetry layout. None means
+        the original board (see _channel_schema).
     """
-    def __init__(self, port='COM3', address=0, baudrate=9600, timeout=50, temperature_limit=500):
+    def __init__(self, port='COM3', address=0, baudrate=9600, timeout=50, temperature_limit=500, buffer_size=10000, simulator=None, schema=None):
 
         self._temperature_limit = temperature_limit        
+        self.schema = default_schema if schema is None else schema
 
-        # Check for installed libraries
-        if  not serial:
-            _s._warn('You need to install pyserial and to use the Arduino.')
-            self.simulation_mode = True
-
-        # Assume everything will work for now
-        else: self.simulation_mode = False
-
-        # If the port is "Simulation"
-        if port=='Simulation': self.simulation_mode = True
+        # Background reader state. The deque is a bounded ring buffer of
+        # (t, data) blocks, one per read; append() and popleft() are atomic,
+        # so the reader and the GUI never share a lock.
+        self._samples = _deque(maxlen=buffer_size)
+        self._reader  = None
+        self._reading = False
+        
+        # Turns the raw byte stream into packets. Starts as ASCII, and may be
+        # switched to binary by negotiate_protocol(), whose sequence numbers
+        # then set the sample times through the clock's drift model.
+        self.protocol = 'ascii'
+        self.decoder  = packet_decoder(self.schema.length)
+        self.clock    = clock_sync()
         
+        # Link state, for reconnecting after the port drops out
+        self._port       = port
+        self._baudrate   = baudrate
+        self._timeout    = timeout*0.001 # pyserial wants seconds
+        self._closing    = _threading.Event()
+        self._wake       = _threading.Event() # Set by disconnect() and stop_reader()
+        self.link_up     = True
+        self.reconnects  = 0
+        
+        # Timing of the read and decode stages. Disabled (and nearly free)
+        # unless someone hands us an enabled one.
+        self.perf = instrumentation()
+        
+        # Objects shown every decoded block on the reader thread, before it
+        # is queued, and checked between reads (see _watchdog).
+        self.watchers = []
+
+        # Only the "Simulation" port is simulated. A real port that can't be
+        # opened is an error, so nobody mistakes simulated data for real.
+        self.simulation_mode     = port == 'Simulation'
         self.simulation_setpoint = 24.5
 
-        # If we have all the libraries, try connecting.
         if not self.simulation_mode:
-            try:
-                # Create the instrument and ensure the settings are correct.
-                self.serial = serial.Serial(port=port,baudrate=baudrate, timeout=timeout)
-
-                # Simulation mode flag
-                self.simulation_mode = False
-
-            # Something went wrong. Go into simulation mode.
-            except Exception as e:
-                print('Could not open connection to "'+port+':'+str(address)+'" at baudrate '+str(baudrate)+'. Entering simulation mode.')
-                print(e)
-                self.modbus = None
-                self.simulation_mode = True
-    
-    def read_all(self):
-        return self.serial.read_all().decode()
+            
+            # Check for installed libraries
+            if not serial: raise Exception('You need to install pyserial to use the Arduino.')
+            
+            # Create the instrument and ensure the settings are correct.
+            # serial_for_url() also accepts pyserial URLs like 'loop://'.
+            try: self.serial = serial.serial_for_url(port, baudrate=baudrate, timeout=self._timeout)
+            except Exception as e: raise Exception('Could not open "'+port+'" at baudrate '+str(baudrate)+': '+str(e))
+        
+        # In simulation mode, talk to a simulated device through the same interface.
+        if self.simulation_mode:
+            if simulator is None:
+                from _arduino_simulator import arduino_simulator
+                simulator = arduino_simulator(timeout=self._timeout, controls=self.schema.controls, samples=self.schema.samples)
+            self.serial = simulator
     
     def write(self, msg):
         return self.serial.write(msg.encode())
 
+    def wait_ready(self, timeout=2):
+        """
+        Waits for the Arduino to finish booting after the port opens (opening
+        the port resets it). Returns as soon as it sends anything, e.g. a boot
+        banner, or after the timeout for firmware that stays silent until it
+        receives parameters. Anything received goes to the decoder.
+        
+        Parameters
+        ----------
+        timeout=2 : float
+            Longest time to wait (s).
+        
+        Returns
+        -------
+        True if the Arduino announced itself, False if we timed out.
+        """
+        if self.simulation_mode: return True
+        
+        t_give_up = _time.monotonic() + timeout
+        while _time.monotonic() < t_give_up:
+            data = self.serial.read(max(1, self.serial.in_waiting))
+            if data:
+                self._enqueue(*self.decoder.feed(data, _time.monotonic_ns()*1e-9))
+                return True
+        
+        return False
+    
+    def negotiate_protocol(self, timeout=0.5):
+        """
+        Asks the firmware to switch to binary telemetry. Firmware that supports
+        it answers with the sync word; anything else leaves us in ASCII mode.
+        Call this after the Arduino has booted and before starting the reader.
+        
+        Parameters
+        ----------
+        timeout=0.5 : float
+            How long to wait for the answer (s).
+        
+        Returns
+        -------
+        The protocol in use, 'binary' or 'ascii'.
+        """
+        self.protocol = 'ascii'
+        self.decoder  = packet_decoder(self.schema.length)
+        self.write(_binary_request)
+        
+        # Collect the answer
+        reply    = b''
+        t_give_up = _time.monotonic() + timeout
+        while _time.monotonic() < t_give_up and _binary_sync not in reply:
+            reply += self.serial.read(max(1, self.serial.in_waiting))
+        t = _time.monotonic_ns()*1e-9
+        
+        # Switch to binary, keeping anything after the sync word
+        if _binary_sync in reply:
+            self.protocol = 'binary'
+            self.clock.reset()
+            self.decoder  = binary_decoder(self.schema.length, clock=self.clock)
+            self._enqueue(*self.decoder.feed(reply[reply.index(_binary_sync)+len(_binary_sync):], t))
+        
+        # Don't lose anything an ASCII-only firmware sent meanwhile
+        elif reply: self._enqueue(*self.decoder.feed(reply, t))
+        
+        return self.protocol
+    
+    def start_reader(self):
+        """
+        Starts the background thread that reads and parses the serial stream
+        into the sample buffer.
+        """
+        if self._reading: return
+        
+        self._reading = True
+        self._wake.clear()
+        self._reader  = _threading.Thread(target=self._reader_loop, daemon=True)
+        self._reader.start()
+    
+    def stop_reader(self):
+        """
+        Stops the background reader thread and waits for it to finish, even
+        if it is waiting to reconnect.
+        """
+        self._reading = False
+        if self._reader is not None: self._wake.set()
+        if self._reader is not None: self._reader.join()
+        self._reader = None
+    
+    def get_samples(self):
+        """
+        Removes and returns all samples collected by the background reader.
+        
+        Returns
+        -------
+        t : numpy array
+            Time of each sample (s, from time.monotonic()): when its bytes
+            arrived, or for binary telemetry when the firmware sent it (see
+            clock_sync).
+        
+        data : numpy array
+            One row per sample with the telemetry fields (see schema.fields).
+            A row of NaN marks where the link dropped out.
+        """
+        # Drain only what is there now; the reader may keep appending.
+        blocks = [self._samples.popleft() for n in range(len(self._samples))]
+        
+        if not blocks:        return _n.zeros(0), _n.zeros((0, self.schema.length))
+        if len(blocks) == 1:  return blocks[0]
+        
+        t, data = zip(*blocks)
+        return _n.concatenate(t), _n.concatenate(data)
+    
+    def service(self):
+        """
+        Decodes whatever is waiting on the port, without blocking. Use this
+        instead of start_reader() to drive the api from an external event loop.
+        
+        Returns
+        -------
+        Number of bytes read.
+        """
+        n = self.serial.in_waiting
+        if n:
+            self._receive(n)
+            self._decode(_time.monotonic_ns()*1e-9)
+        
+        return n
+    
+    def _reader_loop(self):
+        """
+        Runs in the reader thread. Blocks on the serial port (up to the timeout)
+        and hands whatever arrives to the decoder.
+        """
+        while self._reading:
+            
+            # Block until at least one byte arrives, then take everything
+            # waiting, and note when it arrived. The integer clock doesn't lose
+            # resolution however long we run.
+            try:
+                n = self._receive(self.serial.in_waiting)
+                t = _time.monotonic_ns()*1e-9
+            
+            # Lost the port; get it back before carrying on.
+            except (serial.SerialException, OSError): 
+                self.handle_link_loss()
+                continue
+            
+            if n: self._decode(t)
+            
+            # Give the watchers a look even when nothing arrived
+            for w in self.watchers: w.check()
+    
+    def _receive(self, n):
+        """
+        Reads n bytes straight into the decoder's buffer, or blocks for at
+        least one (up to the timeout) if n is 0. Only reads of bytes already
+        waiting are timed, so the histogram shows the cost of reading rather
+        than the wait for data.
+        
+        Returns
+        -------
+        Number of bytes read.
+        """
+        if not n: return self.decoder.buffer.readinto(self.serial, 0)
+        
+        t = self.perf.start()
+        n = self.decoder.buffer.readinto(self.serial, n)
+        self.perf.stop('read', t, n)
+        
+        return n
+    
+    def _decode(self, t_arrival):
+        """
+        Decodes (and parses) the bytes that arrived at t_arrival (s, from
+        time.monotonic()) and queues the resulting samples.
+        """
+        t_start = self.perf.start()
+        t, data = self.decoder.parse(t_arrival)
+        self.perf.stop('decode', t_start, len(t))
+        self._enqueue(t, data)
+    
+    def _enqueue(self, t, data):
+        """
+        Shows freshly decoded samples to the watchers and queues them for
+        get_samples().
+        """
+        if not len(t): return
+        
+        # Safety checks come first, on this thread
+        for w in self.watchers: w.feed(t, data)
+        
+        self._samples.append((t, data))
+
+    def handle_link_loss(self, backoff=0.5, max_backoff=10, boot_timeout=2):
+        """
+        Deals with the port dropping out: marks the gap in the samples with a
+        row of NaN, then tries to reopen the port, waiting twice as long after
+        each failure, until it works or disconnect() is called (or, from the
+        reader thread, stop_reader()). Blocks, so run it from the reader thread
+        or a thread of its own.
+        
+        Parameters
+        ----------
+        backoff=0.5 : float
+            Wait before the first retry (s).
+        
+        max_backoff=10 : float
+            Longest wait between retries (s).
+        
+        boot_timeout=2 : float
+            Longest time to wait for the Arduino to boot after reopening (s).
+        
+        Returns
+        -------
+        True if the link is back, False if we gave up because of disconnect()
+        or stop_reader().
+        """
+        self.link_up = False
+        self._samples.append((_n.array([_time.monotonic_ns()*1e-9]), _n.full((1, self.schema.length), _n.nan)))
+        try:    self.serial.close()
+        except Exception: pass
+        
+        # Give up on disconnect(), or on stop_reader() if we're the reader
+        reader = _threading.current_thread() is self._reader
+        delay  = backoff
+        while True:
+            self._wake.wait(delay)
+            if self._closing.is_set() or reader and not self._reading: return False
+
+            # Reopen, and start the protocol over, as the Arduino has rebooted.
+            # A flapping device can fail again at any point of this, so any
+            # failure closes the port and we keep trying.
+            try:
+                self.serial = serial.serial_for_url(self._port, baudrate=self._baudrate, timeout=self._timeout)
+                self.decoder.reset()
+                self.wait_ready(boot_timeout)
+                if self.protocol == 'binary': self.negotiate_protocol()
+
+            except Exception:
+                try:    self.serial.close()
+                except Exception: pass
+                delay = min(2*delay, max_backoff)
+                continue
+
+            self.link_up     = True
+            self.reconnects += 1
+            return True
+
     def disconnect(self):
         """
         Disconnects.
         """
-        if not self.simulation_mode: self.serial.close()
+        self._closing.set()
+        self._wake.set()
+        self.stop_reader()
+        self.serial.close()
+
+
+def open_ports(ports, timeout=2, **kwargs):
+    """
+    Opens many ports in parallel, waiting for each Arduino to boot (see
+    arduino_api.wait_ready()) with its own timeout, so connecting N devices
+    takes about as long as connecting one.
+    
+    Parameters
+    ----------
+    ports : list
+        Names of the ports to open.
+    
+    timeout=2 : float
+        Longest time to wait for each Arduino to boot (s).
+    
+    **kwargs are sent to arduino_api().
+    
+    Returns
+    -------
+    Dictionary of port names and their arduino_api instances (or the
+    exception raised while opening them).
+    """
+    def open_one(port):
+        try:
+            api = arduino_api(port=port, **kwargs)
+            api.wait_ready(timeout)
+            return api
+        except Exception as e: return e
+    
+    if not ports: return dict()
+    with _ThreadPoolExecutor(len(ports)) as pool: return dict(zip(ports, pool.map(open_one, ports)))
@@ -0,0 +1,236 @@
+import numpy as _n
+import time  as _time
+
+from _arduino_api    import encode_binary_frame, _binary_request, _binary_sync
+from _channel_schema import channel_schema
+
+class arduino_simulator():
+    """
+    Simulated Arduino temperature controller with the same interface as the
+    pyserial Serial object arduino_api talks to. It parses parameter frames
+    exactly as the firmware encodes them (setpoint x4, band x4, integral time
+    x1000x4, ramp rate x100), waits for the 'a' that starts the loop, and
+    then emits the line-per-field telemetry (or binary frames, if requested)
+    at a configurable rate.
+    
+    Each control channel is a heater with thermal mass and losses to
+    ambient, driven by a PI controller with a ramped setpoint, as in the
+    firmware. Each sample sits between the heaters and follows them.
+    
+    Parameters
+    ----------
+    rate=2 : float
+        Samples emitted per second of real time.
+    
+    noise=0.05 : float
+        Standard deviation of the noise added to the temperatures (C).
+    
+    speed=1 : float
+        Simulated seconds per real second, to fast-forward the thermal model.
+    
+    ambient=22 : float
+        Ambient (and starting) temperature (C).
+    
+    timeout=0.05 : float
+        Longest time read() blocks waiting for data (s), like pyserial.
+    
+    binary=True : bool
+        Whether to honour requests for binary telemetry.
+    
+    seed=None : int
+        Seed for the noise, for reproducible runs.
+    
+    controls=2, samples=1 : int
+        Number of control and sample channels (see channel_schema). The
+        default is the original board.
+    """
+    def __init__(self, rate=2, noise=0.05, speed=1, ambient=22, timeout=0.05, binary=True, seed=None, controls=2, samples=1):
+        
+        self.rate     = rate
+        self.noise    = noise
+        self.speed    = speed
+        self.ambient  = ambient
+        self.timeout  = timeout
+        self.binary   = binary
+        self.controls = controls
+        
+        # Field index of every temperature, for the noise
+        self._temperature_fields = channel_schema(controls, samples).temperature_fields
+        
+        # Thermal model: heat capacity (J/C), loss to ambient (W/C), full
+        # heater power (W), and the sample's coupling to each heater (W/C).
+        self.heat_capacity   = 200.0
+        self.loss            = 0.5
+        self.power           = 150.0
+        self.sample_capacity = 50.0
+        self.sample_coupling = 0.3
+        
+        # Controller parameters, as decoded from the last frame
+        self.setpoint = [ambient]*controls
+        self.band     = [5.0]*controls
+        self.integral = [30.0]*controls
+        self.ramp     = [0.1]*controls
+        
+        # Controller and plant state
+        self.T          = [float(ambient)]*controls
+        self.T_sample   = [float(ambient)]*samples
+        self._ramped    = [float(ambient)]*controls
+        self._integral  = [0.0]*controls
+        
+        self.is_open    = True
+        self.running    = False # Set by the 'a' that starts the loop
+        self.protocol   = 'ascii'
+        self._random    = _n.random.default_rng(seed)
+        self._received  = b''
+        self._out       = bytearray()
+        self._seq       = 0
+        self._t_next    = None
+    
+    # pyserial interface
+    
+    @property
+    def in_waiting(self):
+        self._generate()
+        return len(self._out)
+    
+    def read(self, size=1):
+        """
+        Returns up to size bytes, blocking up to the timeout until some are available.
+        """
+        t_give_up = _time.time() + (self.timeout or 0)
+        while True:
+            self._generate()
+            if self._out or _time.time() >= t_give_up: break
+            
+            # Sleep until the next sample is due, or we give up
+            t_wake = t_give_up if self._t_next is None else min(t_give_up, self._t_next)
+            _time.sleep(max(t_wake-_time.time(), 0))
+        
+        data = bytes(self._out[:size])
+        del self._out[:size]
+        return data
+    
+    def readinto(self, buffer):
+        """
+        Reads up to len(buffer) bytes into buffer, blocking like read().
+        Returns the number of bytes read.
+        """
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    
+    def read_all(self):
+        """
+        Returns everything waiting, without blocking.
+        """
+        self._generate()
+        data = bytes(self._out)
+        self._out.clear()
+        return data
+    
+    def write(self, data):
+        """
+        Receives data from the host.
+        """
+        self._received += data
+        
+        # Binary telemetry request, answered with the sync word
+        if self.binary and self._received.endswith(_binary_request.encode()):
+            self._received = self._received[:-1]
+            self.protocol  = 'binary'
+            self._out     += _binary_sync
+        
+        # Everything up to an 'a' is a parameter frame
+        while b'a' in self._received:
+            frame, self._received = self._received.split(b'a', 1)
+            self._set_parameters(frame)
+            if not self.running:
+                self.running = True
+                self._t_next = _time.time()
+        
+        return len(data)
+    
+    def close(self):
+        self.is_open = False
+    
+    # Firmware
+    
+    def _set_parameters(self, frame):
+        """
+        Decodes a parameter frame the way the firmware does. Malformed frames
+        are ignored.
+        """
+        try: values = [int(x) for x in frame.decode().split(',')]
+        except ValueError: return
+        if len(values) != 4*self.controls: return
+        
+        for n in range(self.controls):
+            sp, band, integral, rate = values[4*n:4*n+4]
+            self.setpoint[n] = sp/4.0
+            self.band    [n] = band/4.0
+            self.integral[n] = integral/4000.0
+            self.ramp    [n] = rate/100.0
+    
+    def _generate(self):
+        """
+        Emits every sample that has come due since the last call.
+        """
+        if not self.running or not self.is_open: return
+        
+        now = _time.time()
+        if now < self._t_next: return
+        
+        # Don't try to catch up on more than a second's worth
+        n = min(int((now-self._t_next)*self.rate)+1, max(int(self.rate), 1))
+        for i in range(n): self._emit(self.step(self.speed/self.rate))
+        self._t_next = max(self._t_next + n/self.rate, now - 1)
+    
+    def _emit(self, fields):
+        """
+        Sends one sample in the current protocol.
+        """
+        if self.protocol == 'binary':
+            self._out += encode_binary_frame(self._seq, fields)
+            self._seq += 1
+        else:
+            for x in fields: self._out += b'%.2f\r\n' % x
+    
+    def step(self, dt):
+        """
+        Advances the controllers and the thermal model by dt (simulated s).
+        
+        Returns
+        -------
+        The telemetry fields (temperature, output, proportional and integral
+        of each control channel, then each sample's temperature; see
+        channel_schema), with noise.
+        """
+        fields = []
+        for n in range(self.controls):
+            
+            # Ramp the working setpoint toward the target
+            error = self.setpoint[n] - self._ramped[n]
+            self._ramped[n] += _n.clip(error, -self.ramp[n]*dt, self.ramp[n]*dt)
+            
+            # PI control, with the integral clamped to avoid windup
+            proportional = 100*(self._ramped[n] - self.T[n])/self.band[n] if self.band[n] else 0
+            if self.integral[n]: self._integral[n] = _n.clip(self._integral[n] + proportional*dt/self.integral[n], 0, 100)
+            output = _n.clip(proportional + self._integral[n], 0, 100)
+            
+            # Heat in, heat out to ambient and to the samples
+            flow = self.power*output/100 - self.loss*(self.T[n]-self.ambient) - self.sample_coupling*sum(self.T[n]-T for T in self.T_sample)
+            self.T[n] += flow*dt/self.heat_capacity
+            
+            fields += [self.T[n], output, proportional, self._integral[n]]
+        
+        # The samples only exchange heat with the heaters
+        for m in range(len(self.T_sample)):
+            flow = self.sample_coupling*sum(T-self.T_sample[m] for T in self.T)
+            self.T_sample[m] += flow*dt/self.sample_capacity
+        fields += self.T_sample
+        
+        # Noise on the temperatures only
+        if self.noise:
+            for i in self._temperature_fields: fields[i] += self._random.normal(0, self.noise)
+        
+        return [float(x) for x in fields]
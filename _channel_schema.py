@@ -0,0 +1,112 @@
+# Telemetry fields of each control channel, in packet order, and the
+# control parameters it takes with the scale factor the firmware applies.
+_control_fields   = ['T', 'Output', 'Proportional', 'Integral']
+_parameter_kinds  = ['setpoint', 'band', 'integral', 'rate']
+parameter_scales  = dict(setpoint=4, band=4, integral=1000*4, rate=100)
+_parameter_defaults = dict(setpoint=25.4, band=5, integral=30, rate=0.1)
+
+# Allowed range of each control parameter. None means no limit here; the
+# setpoint is capped by the engine's temperature_limit.
+parameter_bounds  = dict(setpoint=(0, None), band=(0, 1000), integral=(0, 1000), rate=(0, 1000))
+
+# Columns of each channel's plot and CSV file
+_control_plot_ckeys = ['Time (s)', 'Temperature (C)', 'Output (%)', 'Proportional', 'Integral']
+_sample_plot_ckeys  = ['Time (s)', 'Temperature (C)']
+
+
+class channel_schema():
+    """
+    Describes the channels of a board, and with them the layout of its
+    telemetry packets, sample history, logs and parameter frames. Every
+    control channel (heater) sends its temperature, output, proportional
+    and integral terms, and takes a setpoint, band, integral time and ramp
+    rate. Every sample channel (thermocouple) sends only its temperature.
+    Packets hold all control channels' fields, then the samples'.
+    
+    The default (two control channels, one sample) is the original board.
+    
+    Parameters
+    ----------
+    controls=2 : int
+        Number of control channels.
+    
+    samples=1 : int
+        Number of sample channels.
+    """
+    def __init__(self, controls=2, samples=1):
+        
+        self.controls = controls
+        self.samples  = samples
+        
+        # Telemetry field names in packet order. A lone sample is 'Tsample',
+        # as on the original board.
+        self.fields = []
+        for n in range(controls): self.fields += [name+str(n) for name in _control_fields]
+        self.sample_names = ['Tsample'] if samples == 1 else ['Tsample%d' % n for n in range(samples)]
+        self.fields += self.sample_names
+        
+        # History columns (time first)
+        self.ckeys  = ['Time (s)'] + self.fields
+        self.length = len(self.fields)
+        
+        # Field index of each channel's temperature and output
+        self.temperature_fields = [4*n for n in range(controls)] + [4*controls+n for n in range(samples)]
+        self.output_fields      = [4*n+1 for n in range(controls)]
+        
+        # Control parameters in the order the firmware expects them
+        self.parameter_keys     = ['%s_%d' % (kind, n) for n in range(controls) for kind in _parameter_kinds]
+        self.default_parameters = {key: _parameter_defaults[key.split('_')[0]] for key in self.parameter_keys}
+    
+    def __repr__(self): return 'channel_schema(controls=%d, samples=%d)' % (self.controls, self.samples)
+    
+    def __eq__(self, other): return isinstance(other, channel_schema) and (self.controls, self.samples) == (other.controls, other.samples)
+    
+    def encode_parameters(self, parameters):
+        """
+        Encodes the control parameters into the message the firmware expects:
+        comma-separated integers, scaled by parameter_scales. Setpoints are
+        truncated, everything else is rounded.
+        
+        Parameters
+        ----------
+        parameters : dict
+            Values for every key in self.parameter_keys.
+        
+        Returns
+        -------
+        str
+        """
+        values = []
+        for key in self.parameter_keys:
+            kind  = key.split('_')[0]
+            value = parameters[key]*parameter_scales[kind]
+            values.append(str(int(value if kind == 'setpoint' else round(value))))
+        
+        return ','.join(values)
+    
+    def get_channel_columns(self):
+        """
+        Returns the columns of each channel's plot and CSV file, control
+        channels first, then samples, as (ckeys, history columns) with the
+        time first: temperature, output, proportional and integral for a
+        control channel, and the temperature alone for a sample.
+        """
+        layout = [(_control_plot_ckeys, [0]+[self.fields.index(name+str(n))+1 for name in _control_fields]) for n in range(self.controls)]
+        for n in range(self.samples): layout.append((_sample_plot_ckeys, [0, self.temperature_fields[self.controls+n]+1]))
+        return layout
+    
+    @staticmethod
+    def from_ckeys(ckeys):
+        """
+        Returns the schema whose history columns are ckeys (e.g. read back
+        from a log).
+        """
+        controls = sum(1 for key in ckeys if key.startswith('Output'))
+        samples  = sum(1 for key in ckeys if key.startswith('Tsample'))
+        schema   = channel_schema(controls, samples)
+        if schema.ckeys != list(ckeys): raise Exception('Columns '+repr(ckeys)+' do not match any channel schema.')
+        return schema
+
+
+# The original board
+default_schema = channel_schema()
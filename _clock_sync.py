@@ -0,0 +1,118 @@
+import numpy as _n
+
+
+class clock_sync():
+    """
+    Maps a counter kept by the device (the sequence number of binary
+    frames, or a millis() field) onto the host's monotonic clock, so each
+    sample gets the time the device took it rather than the time the read
+    that delivered it happened to return.
+
+    The host only sees arrival times, which are late by a varying amount
+    (USB polling, the OS, batching), never early. The drift model is
+    therefore
+
+        t = offset + period*count
+
+    with period fitted by least squares over the last window reads (the
+    latency averages out), and offset the smallest t - period*count seen in
+    that window (the read that was least late). Only the last frame of each
+    read is used as a point, as the others arrived before the read returned.
+    Until there are min_points points, samples get their arrival time.
+
+    Parameters
+    ----------
+    wrap=65536 : int
+        Modulus of the counter. None means it never wraps.
+
+    window=1024 : int
+        Number of recent reads the model is fitted to.
+
+    min_points=16 : int
+        Reads needed before the model is used.
+
+    tolerance=1 : float
+        Disagreement between the model and an arrival (s) beyond which the
+        device is taken to have restarted, and the fit starts over.
+    """
+    def __init__(self, wrap=65536, window=1024, min_points=16, tolerance=1):
+
+        self.wrap       = wrap
+        self.window     = window
+        self.min_points = min_points
+        self.tolerance  = tolerance
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the model, e.g. when the device restarts.
+        """
+        self._counts  = _n.zeros(self.window) # Ring of unwrapped counts
+        self._times   = _n.zeros(self.window) # and their arrival times
+        self._points  = 0                     # Points written to the ring
+        self._raw     = None                  # Last raw count
+        self._count   = None                  # and its unwrapped value
+        self._t_last  = -_n.inf               # Last time handed out
+
+        self.period  = None # Fitted seconds per count
+        self.offset  = None # Fitted time of count 0
+        self.resets  = 0    # Restarts detected
+
+    def update(self, counts, t):
+        """
+        Adds the counts of the frames delivered by one read, and returns
+        their times.
+
+        Parameters
+        ----------
+        counts : array
+            Raw counter values, in order.
+
+        t : float
+            Arrival time of the read (s, from time.monotonic()).
+
+        Returns
+        -------
+        Array of times (s, on the same clock as t), never decreasing.
+        """
+        counts = _n.asarray(counts, dtype=_n.int64)
+        if not len(counts): return _n.zeros(0)
+
+        # Unwrap, continuing from the last read
+        steps    = _n.diff(counts, prepend=counts[0] if self._raw is None else self._raw)
+        if self.wrap: steps %= self.wrap
+        unwrapped = (counts[0] if self._count is None else self._count) + _n.cumsum(steps)
+        self._raw, self._count = int(counts[-1]), int(unwrapped[-1])
+
+        # A device that restarted no longer fits; start over from here
+        if self.period is not None and abs(t - (self.offset + self.period*unwrapped[-1])) > self.tolerance:
+            resets, t_last = self.resets, self._t_last
+            self.reset()
+            self.resets, self._t_last = resets+1, t_last
+            self._raw, self._count = int(counts[-1]), int(counts[-1])
+            unwrapped = counts
+
+        # The last frame of the read is the new point
+        i = self._points % self.window
+        self._counts[i] = unwrapped[-1]
+        self._times [i] = t
+        self._points   += 1
+
+        # Refit, centred for precision, once there are enough points
+        n = min(self._points, self.window)
+        if n >= self.min_points:
+            c, s = self._counts[:n], self._times[:n]
+            dc   = c - c.mean()
+            var  = (dc*dc).sum()
+            if var > 0:
+                self.period = (dc*(s - s.mean())).sum()/var
+                self.offset = (s - self.period*c).min()
+
+        times = _n.full(len(counts), float(t)) if self.period is None else self.offset + self.period*unwrapped
+
+        # Never hand out a time earlier than the last one
+        times = _n.maximum.accumulate(_n.maximum(times, self._t_last))
+        self._t_last = times[-1]
+
+        return times
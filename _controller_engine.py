@@ -0,0 +1,446 @@
+import numbers   as _numbers
+import numpy     as _n
+import threading as _threading
+import time      as _time
+
+from _arduino_api   import arduino_api
+from _sample_buffer import sample_buffer
+from _envelope      import minmax_envelope
+from _history       import chunk_store
+from _data_logger   import data_logger
+from _instrumentation import instrumentation
+from _metrics         import channel_metrics
+from _channel_schema  import default_schema, parameter_bounds
+
+# Columns of the sample history, control parameters in the order the
+# firmware expects them, and their power-on defaults (matching the GUI), for
+# the original board. Other boards are described by a channel_schema.
+sample_ckeys       = default_schema.ckeys
+parameter_keys     = default_schema.parameter_keys
+default_parameters = default_schema.default_parameters
+
+def encode_parameters(parameters):
+    """
+    Encodes the control parameters of the original board into the message
+    the firmware expects (see channel_schema.encode_parameters()).
+    """
+    return default_schema.encode_parameters(parameters)
+
+
+class parameter_sync():
+    """
+    Coalesces parameter changes so parameter traffic stays bounded no matter
+    how fast they are edited. A change is held until no other change has
+    arrived for delay, or until max_delay after the first held change, and
+    then only the latest frame is sent. Frames identical to the last one
+    acknowledged (or still awaiting acknowledgement) are not sent at all.
+    
+    The firmware has no explicit acknowledgement, but it restarts its loop
+    after every frame, so a telemetry packet arriving after a frame was sent
+    acknowledges it. Frames not acknowledged within ack_timeout are re-sent,
+    at most retries times.
+    
+    Parameters
+    ----------
+    delay=0.2 : float
+        Quiet time after the last change before sending (s).
+    
+    max_delay=1 : float
+        Longest a change is held while changes keep arriving (s).
+    
+    ack_timeout=3 : float
+        How long to wait for acknowledgement before re-sending (s).
+    
+    retries=2 : int
+        Number of times to re-send an unacknowledged frame.
+    """
+    def __init__(self, delay=0.2, max_delay=1, ack_timeout=3, retries=2):
+        
+        self.delay       = delay
+        self.max_delay   = max_delay
+        self.ack_timeout = ack_timeout
+        self.retries     = retries
+        
+        self.reset()
+        
+        # Statistics
+        self.requests = 0 # Changes requested
+        self.frames   = 0 # Frames actually sent
+    
+    def reset(self):
+        """
+        Forgets the device state, e.g. after reconnecting.
+        """
+        self.pending  = None # Frame waiting to be sent
+        self.sent     = None # Last frame sent
+        self.acked    = None # Last frame acknowledged
+        self._t_first = None # When the pending frame was first requested
+        self._t_last  = None # When the pending frame was last updated
+        self._t_sent  = None
+        self._tries   = 0
+    
+    def request(self, msg, now):
+        """
+        Queues a frame to send.
+        """
+        self.requests += 1
+        
+        # Nothing new to say
+        if msg == self.sent:
+            self.pending = None
+            return
+        
+        if self.pending is None: self._t_first = now
+        self.pending = msg
+        self._t_last = now
+    
+    def mark_sent(self, msg, now):
+        """
+        Records that msg was sent.
+        """
+        if msg != self.sent: self._tries = 0
+        self.sent    = msg
+        self.pending = None
+        self._t_sent = now
+        self._tries += 1
+        self.frames += 1
+    
+    def acknowledge(self, t_arrival):
+        """
+        Records telemetry that arrived at t_arrival, acknowledging the last
+        frame if it was sent before then.
+        """
+        if self.sent is not None and self._t_sent is not None and t_arrival > self._t_sent: 
+            self.acked = self.sent
+    
+    def get_due(self, now):
+        """
+        Returns the frame that should be sent now, or None.
+        """
+        # Coalesced change ready to go
+        if self.pending is not None and (now-self._t_last >= self.delay or now-self._t_first >= self.max_delay):
+            return self.pending
+        
+        # Unacknowledged frame to retry
+        if  self.pending is None and self.sent is not None and self.sent != self.acked \
+        and self._tries <= self.retries and now-self._t_sent > self.ack_timeout:
+            return self.sent
+        
+        return None
+
+
+class controller_engine():
+    """
+    GUI-free core of the temperature controller. Owns the connection, the
+    parameter encoding, the decoded sample history and the continuous log,
+    and imports neither spinmob nor Qt, so it can run headless.
+    
+    Parameters
+    ----------
+    retention=21600 : float
+        How much history to keep in memory at full resolution (s). Older
+        samples are moved to disk. None keeps everything.
+    
+    history_path=None : str
+        Directory for the on-disk history. None means a temporary directory.
+    
+    log_path='logs' : str
+        Directory in which every connection logs its samples continuously.
+        None disables logging.
+    
+    api_class=arduino_api : class
+        Class to use when connecting.
+    
+    schema=None : channel_schema
+        Channels of the board, which set the telemetry, history, log and
+        parameter layouts. None means the original board.
+    
+    temperature_limit=None : float or list
+        Highest setpoint accepted (C), for every channel or one per
+        temperature field (see schema.temperature_fields), as for
+        _watchdog.watchdog. None means no limit.
+    """
+    def __init__(self, retention=21600, history_path=None, log_path='logs', api_class=arduino_api, schema=None, temperature_limit=None):
+        
+        self.api        = None
+        self._api_class = api_class
+        self.schema     = default_schema if schema is None else schema
+        ckeys           = self.schema.ckeys
+        
+        # Reference for the time column, set on the first connect. Sample times
+        # are monotonic (see arduino_api.get_samples()), so wall-clock jumps
+        # can't corrupt the history.
+        self.t0 = None
+        
+        # Current control parameters, and what has been sent
+        self.parameters = dict(self.schema.default_parameters)
+        self.temperature_limit = _n.broadcast_to(_n.inf if temperature_limit is None else _n.array(temperature_limit, float), 
+                                                 len(self.schema.temperature_fields)).copy()
+        self.sync       = parameter_sync()
+        
+        # Parameters may be sent from other threads (see apply_parameters())
+        self._write_lock = _threading.RLock()
+        
+        # Sample history, its envelope for drawing, and the log
+        self.samples  = sample_buffer(ckeys, retention=retention, spill=chunk_store(history_path, ckeys))
+        self.envelope = minmax_envelope(len(ckeys)-1)
+        self.logger   = data_logger(log_path, ckeys) if log_path else None
+        
+        # Running statistics of each control channel
+        self.metrics = [channel_metrics() for n in range(self.schema.controls)]
+        
+        # Functions called with (t, data) for every block appended, e.g.
+        # _telemetry_server.telemetry_server.publish()
+        self.listeners = []
+        
+        # Objects shown every decoded block on the api's reader thread, before
+        # it is queued, e.g. _watchdog.watchdog. Each has feed(t, data),
+        # check(now) and reset(). Shared with the api.
+        self.watchers = []
+        
+        # Stage timings and buffer depths, shared with the api. Set
+        # self.perf.enabled = True to start recording.
+        self.perf = instrumentation()
+    
+    def connect(self, port, address=0, baudrate=9600, timeout=50, binary=False, boot_timeout=2, reader=True, **kwargs):
+        """
+        Opens the connection, sends the current parameters, and starts logging
+        and acquiring.
+        
+        Parameters
+        ----------
+        port : str
+            Name of the port to connect to, or 'Simulation'.
+        
+        address=0, baudrate=9600, timeout=50
+            Sent to the api (see arduino_api).
+        
+        binary=False : bool
+            Whether to ask the firmware for binary telemetry.
+        
+        boot_timeout=2 : float
+            Longest time to wait for the Arduino to run setup after the port
+            opens (s). See arduino_api.wait_ready().
+        
+        reader=True : bool
+            Whether to start the api's reader thread. If False, the caller
+            must call self.api.service() whenever the port has data.
+        
+        **kwargs are sent to the api, e.g. simulator=arduino_simulator(rate=1000).
+        
+        Returns
+        -------
+        The api instance.
+        """
+        self.api = self._api_class(port=port, address=address, baudrate=baudrate, timeout=timeout, schema=self.schema, **kwargs)
+        self.api.perf     = self.perf
+        self.api.watchers = self.watchers
+        for w in self.watchers: w.reset()
+        
+        # Record the time if it's not already there, before anything arrives.
+        if self.t0 is None: self.t0 = _time.monotonic()
+        
+        # If the port fails while the Arduino is starting up, let it go
+        # rather than leave it open with no reader.
+        try:
+            # Give the Arduino time to run setup
+            self.api.wait_ready(boot_timeout)
+            
+            if binary: self.api.negotiate_protocol()
+            self.sync.reset()
+            self.send_parameters()
+            self._reconnects = 0
+        
+        except Exception:
+            try:    self.api.disconnect()
+            except Exception: pass
+            self.api = None
+            raise
+        
+        if self.logger: self.logger.start(t0=self.t0)
+        if reader: self.api.start_reader()
+        
+        return self.api
+    
+    def disconnect(self):
+        """
+        Stops acquiring, finishes the log and closes the connection.
+        """
+        if self.logger: self.logger.stop()
+        if self.api is not None: self.api.disconnect()
+        self.api = None
+    
+    def check_parameters(self, parameters):
+        """
+        Checks control parameters before they are stored: every key must be
+        known, and every value a finite real number within
+        _channel_schema.parameter_bounds, with setpoints no higher than
+        temperature_limit. Raises an exception describing the first problem.
+        
+        Parameters
+        ----------
+        parameters : dict
+            Any of the control parameters (see schema.parameter_keys).
+        
+        Returns
+        -------
+        The parameters as floats.
+        """
+        checked = dict()
+        for key, value in parameters.items():
+            if key not in self.parameters: raise KeyError('Unknown parameter "'+key+'".')
+            if isinstance(value, bool) or not isinstance(value, _numbers.Real) or not _n.isfinite(value):
+                raise ValueError('Parameter "'+key+'" must be a finite number, not '+repr(value)+'.')
+            
+            kind, n = key.split('_')
+            low, high = parameter_bounds[kind]
+            if kind == 'setpoint': high = self.temperature_limit[int(n)]
+            if value < low or high is not None and value > high:
+                raise ValueError('Parameter "%s" must be between %g and %g, not %g.' % (key, low, _n.inf if high is None else high, value))
+            
+            checked[key] = float(value)
+        
+        return checked
+    
+    def set_parameters(self, **kwargs):
+        """
+        Updates any of the control parameters (see schema.parameter_keys). The full
+        set is sent by poll() once the changes settle (see parameter_sync).
+        Invalid values (see check_parameters()) raise an exception and
+        change nothing.
+        """
+        kwargs = self.check_parameters(kwargs)
+        
+        with self._write_lock:
+            self.parameters.update(kwargs)
+            self.sync.request(self.schema.encode_parameters(self.parameters), _time.monotonic())
+    
+    def apply_parameters(self, **kwargs):
+        """
+        Updates any of the control parameters and sends them right away,
+        skipping the coalescing done for set_parameters(). Meant for code
+        that times its own changes (see _profile.profile_scheduler), and
+        safe to call from any thread. While disconnected, or while the link
+        is down, the parameters are only stored and go out on (re)connect.
+        Invalid values (see check_parameters()) raise an exception and
+        change nothing.
+        """
+        kwargs = self.check_parameters(kwargs)
+        
+        with self._write_lock:
+            self.parameters.update(kwargs)
+            if self.api is not None and self.api.link_up: self.send_parameters()
+    
+    def send_parameters(self, msg=None):
+        """
+        Sends the parameters right away, followed by the 'a' that starts the
+        Arduino's loop.
+        
+        Parameters
+        ----------
+        msg=None : str
+            Encoded parameters to send. None means the current parameters.
+        
+        Returns
+        -------
+        The message sent.
+        """
+        with self._write_lock:
+            if msg is None: msg = self.schema.encode_parameters(self.parameters)
+            self.api.write(msg)
+            self.api.write('a')
+            self.sync.mark_sent(msg, _time.monotonic())
+        
+        return msg
+    
+    def poll(self):
+        """
+        Moves everything the reader thread has collected into the history and
+        the log, and sends any parameter change that is due. Call this
+        periodically.
+        
+        Returns
+        -------
+        t : array
+            Time of each new sample (s, relative to t0, from time.monotonic()).
+        
+        data : array
+            N x fields array of the new telemetry (see schema.fields). Rows
+            of NaN mark where the link dropped out.
+        """
+        self.perf.gauge('reader queue', len(self.api._samples))
+        t, data = self.api.get_samples()
+        
+        # Stale data, even while the reader thread is busy reconnecting
+        for w in self.watchers: w.check()
+        
+        # The link dropped out and came back, rebooting the Arduino, so it
+        # needs the parameters again.
+        if self.api.reconnects != self._reconnects:
+            self._reconnects = self.api.reconnects
+            self.sync.reset()
+            self.send_parameters()
+        
+        # Real telemetry (not gap markers) acknowledges the last parameters
+        arrived = t[_n.isfinite(data[:,0])]
+        if len(arrived): self.sync.acknowledge(arrived[-1])
+        
+        # Parameter changes that have settled
+        with self._write_lock:
+            msg = self.sync.get_due(_time.monotonic())
+            if msg is not None and self.api.link_up: self.send_parameters(msg)
+        
+        t = t - self.t0
+        if len(data): self.append_samples(t, data)
+        
+        # Accepted and rejected packets, and how full everything is
+        if self.perf.enabled:
+            decoder = self.api.decoder
+            self.perf.gauge('accepted',         decoder.frames)
+            self.perf.gauge('rejected',         decoder.malformed)
+            self.perf.gauge('dropped',          decoder.dropped)
+            self.perf.gauge('history rows',     len(self.samples))
+            self.perf.gauge('envelope buckets', len(self.envelope))
+            if self.logger:
+                self.perf.gauge('log pending', len(self.logger._pending))
+                self.perf.gauge('log queue',   self.logger._queue.qsize())
+        
+        return t, data
+    
+    def append_samples(self, t, data):
+        """
+        Appends a block of samples to the history, the envelope and the log.
+        
+        Parameters
+        ----------
+        t : array
+            Time of each of the N samples (s).
+        
+        data : array
+            N x fields array of telemetry (see schema.fields).
+        """
+        t_start = self.perf.start()
+        
+        self.samples .append(t, data)
+        self.envelope.append(t, data)
+        if self.logger: self.logger.append(t, data)
+        
+        self.perf.stop('append', t_start, len(t))
+        t_start = self.perf.start()
+        
+        # Temperature and output of each channel, against the current setpoint
+        for n, m in enumerate(self.metrics):
+            m.append(t, data[:,self.schema.temperature_fields[n]], data[:,self.schema.output_fields[n]], self.parameters['setpoint_%d' % n])
+        
+        self.perf.stop('metrics', t_start, len(t))
+        
+        for listener in self.listeners: listener(t, data)
+    
+    def clear(self):
+        """
+        Clears the sample history, its envelope and the channel metrics. The
+        log is kept.
+        """
+        self.samples .clear()
+        self.envelope.clear()
+        for m in self.metrics: m.clear()
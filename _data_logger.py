@@ -0,0 +1,205 @@
+import numpy     as _n
+import os        as _os
+import queue     as _queue
+import threading as _threading
+import time      as _time
+
+from _history       import chunk_store
+from _run_store     import summary_pyramid
+from _sample_buffer  import sample_buffer
+from _channel_schema import channel_schema
+
+def _get_csv_layout(schema):
+    """
+    Returns the layout of the CSV files written by the DataboxPlot loggers
+    for the supplied channel_schema: (file suffix, ckeys, logged columns
+    that feed them), one per plot (see channel_schema.get_channel_columns()).
+    """
+    suffixes  = ['_channel_%d' % n for n in range(schema.controls)]
+    suffixes += ['_sample'] if schema.samples == 1 else ['_sample_%d' % n for n in range(schema.samples)]
+    return [(suffix, ckeys, columns) for suffix, (ckeys, columns) in zip(suffixes, schema.get_channel_columns())]
+
+class data_logger():
+    """
+    Continuous, crash-safe logger for the sample stream. Samples are
+    buffered in memory and written as fsynced .npy chunks whenever
+    chunk_rows of them have built up or flush_interval has passed, so a
+    crash or power cut loses at most flush_interval of data. Each run gets
+    its own directory, along with min/max/mean summaries at several
+    resolutions for browsing it later (see _run_store).
+    
+    The writing (and fsyncing) is done by a thread of its own, so a slow
+    disk never holds up append(), which runs on the GUI thread.
+    
+    Parameters
+    ----------
+    path='logs' : str
+        Directory in which to create the run directories.
+    
+    ckeys : list
+        Column names. The first column is the time.
+    
+    chunk_rows=4096 : int
+        Samples to buffer before writing a chunk.
+    
+    flush_interval=5 : float
+        Maximum time to hold samples before writing them (s).
+    """
+    def __init__(self, path='logs', ckeys=None, chunk_rows=4096, flush_interval=5):
+        
+        self.path           = path
+        self.ckeys          = list(ckeys)
+        self.chunk_rows     = chunk_rows
+        self.flush_interval = flush_interval
+        
+        self.store    = None # Chunk store of the current run
+        self.pyramid  = None # Its summaries
+        self._pending = sample_buffer(self.ckeys, capacity=chunk_rows)
+        self._t_flush = 0
+        
+        # Blocks handed to the writer thread, which is started for each run
+        # and finishes it when it gets None.
+        self._queue  = _queue.Queue()
+        self._writer = None
+    
+    def start(self, name=None, t0=None):
+        """
+        Starts a new run in its own directory, finishing the previous one.
+        
+        Parameters
+        ----------
+        name=None : str
+            Name of the run directory. None means 'run_' plus the date and time.
+            If the directory exists (e.g. a reconnect within the same second),
+            '_2', '_3', ... is appended, so runs are never merged.
+        
+        t0=None : float
+            time.monotonic() at which the logged times are zero (see
+            controller_engine.t0). None means now. Its wall-clock time goes in
+            the run's start.txt, so runs can be compared in absolute time
+            (see run_store.t_zero).
+        
+        Returns
+        -------
+        Path to the run directory.
+        """
+        self.stop()
+        
+        if name is None: name = _time.strftime('run_%Y-%m-%d_%H.%M.%S')
+        path, n = _os.path.join(self.path, name), 1
+        while True:
+            try:
+                _os.makedirs(path)
+                break
+            except FileExistsError:
+                n   += 1
+                path = _os.path.join(self.path, '%s_%d' % (name, n))
+        
+        # Wall-clock time of the logged times' zero, as a Unix time and for people
+        if t0 is None: t0 = _time.monotonic()
+        t_zero = _time.time() - (_time.monotonic() - t0)
+        with open(_os.path.join(path, 'start.txt'), 'w') as f: 
+            f.write('%r %s\n' % (t_zero, _time.strftime('%Y-%m-%d %H:%M:%S', _time.localtime(t_zero))))
+        
+        self.store    = chunk_store(path, self.ckeys, fsync=True)
+        self.pyramid  = summary_pyramid(self.store.path, len(self.ckeys)-1, fsync=True)
+        self._t_flush = _time.monotonic()
+        
+        self._writer = _threading.Thread(target=self._writer_loop, args=(self.store, self.pyramid), daemon=True)
+        self._writer.start()
+        
+        return self.store.path
+    
+    def append(self, t, data):
+        """
+        Logs a block of samples (see sample_buffer.append()). Does nothing if
+        no run is started.
+        """
+        if self.store is None: return self
+        
+        self._pending.append(t, data)
+        if len(self._pending) >= self.chunk_rows or _time.monotonic()-self._t_flush > self.flush_interval: self.flush()
+        
+        return self
+    
+    def flush(self):
+        """
+        Hands any buffered samples to the writer thread, without waiting for
+        them to reach the disk (see stop()).
+        """
+        if self.store is not None and len(self._pending): 
+            self._queue.put(_n.array(self._pending.get_block()))
+            self._pending.clear()
+        self._t_flush = _time.monotonic()
+        
+        return self
+    
+    def _writer_loop(self, store, pyramid):
+        """
+        Runs in the writer thread. Writes the blocks handed over by flush()
+        to the run's chunks and summaries until it gets None, then finishes
+        the summaries.
+        """
+        while True:
+            block = self._queue.get()
+            if block is None: break
+            
+            try:
+                store  .append(block)
+                pyramid.append(block)
+            except Exception as e: print('Could not log '+str(len(block))+' samples to '+store.path+': '+str(e))
+        
+        pyramid.close()
+    
+    def stop(self):
+        """
+        Flushes and finishes the current run, waiting for everything to reach
+        the disk.
+        """
+        self.flush()
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+        self._writer = None
+        self.store   = None
+        self.pyramid = None
+        
+        return self
+
+
+def export_csv(run_path, csv_path=None, delimiter=','):
+    """
+    Exports a logged run to CSV files in the same layout as the DataboxPlot
+    loggers: one file per plot (each channel, then each sample), each with a
+    ckeys line followed by the data. The run is converted chunk by chunk, so
+    memory use does not depend on its length.
+    
+    Parameters
+    ----------
+    run_path : str
+        Run directory written by data_logger.
+    
+    csv_path=None : str
+        Path prefix for the CSV files, to which '_channel_0.csv' etc are
+        appended. None means the run directory itself.
+    
+    delimiter=',' : str
+        Column delimiter.
+    
+    Returns
+    -------
+    List of the paths written.
+    """
+    if csv_path is None: csv_path = run_path.rstrip('/\\')
+    
+    store = chunk_store(run_path)
+    paths = []
+    for suffix, ckeys, columns in _get_csv_layout(channel_schema.from_ckeys(store.ckeys)):
+        
+        path = csv_path+suffix+'.csv'
+        with open(path, 'w') as f:
+            f.write(delimiter.join(ckeys)+'\n')
+            for chunk in store.iter_chunks(): _n.savetxt(f, chunk[:, columns], fmt='%.10g', delimiter=delimiter)
+        paths.append(path)
+    
+    return paths
@@ -0,0 +1,180 @@
+import numpy as _n
+
+class minmax_envelope():
+    """
+    Min/max-per-bucket summary of a growing time series, maintained
+    incrementally. Every bucket covers the same number of samples; when there
+    are more than 2*width buckets, neighbouring buckets are merged and the
+    bucket size doubles. Drawing the envelope therefore costs O(width) no
+    matter how long the run is, while every spike stays visible.
+    
+    Parameters
+    ----------
+    columns : int
+        Number of data columns (not counting the time).
+    
+    width=4096 : int
+        Minimum resolution to keep (buckets).
+    """
+    def __init__(self, columns, width=4096):
+        
+        self.width = width
+        
+        # Bucket storage, with room for 2*width buckets
+        self._t0  = _n.empty(2*width)            # Time of the first sample
+        self._t1  = _n.empty(2*width)            # Time of the last sample
+        self._min = _n.empty((2*width, columns))
+        self._max = _n.empty((2*width, columns))
+        
+        self.clear()
+    
+    def __len__(self): return self._count
+    
+    def clear(self):
+        """
+        Forgets all samples.
+        """
+        self._bucket = 1 # Samples per bucket
+        self._count  = 0 # Buckets in use
+        self._n      = 0 # Samples in the last bucket
+        return self
+    
+    def append(self, t, data):
+        """
+        Adds a block of samples.
+        
+        Parameters
+        ----------
+        t : array
+            Time of each of the N samples.
+        
+        data : array
+            N x columns array of data.
+        """
+        N = len(t)
+        i = 0
+        while i < N:
+            
+            b = self._bucket
+            c = self._count
+            
+            # Top up the last bucket if it is not full
+            if c and self._n < b:
+                k = min(b-self._n, N-i)
+                self._min[c-1] = _n.fmin(self._min[c-1], _n.fmin.reduce(data[i:i+k], 0))
+                self._max[c-1] = _n.fmax(self._max[c-1], _n.fmax.reduce(data[i:i+k], 0))
+                self._t1 [c-1] = t[i+k-1]
+                self._n += k
+                i       += k
+                continue
+            
+            # Make room if we are out of buckets
+            room = len(self._t0) - c
+            if not room:
+                self._merge()
+                continue
+            
+            # Fill as many whole buckets as we can in one go
+            k    = min(N-i, room*b)
+            full = k // b
+            if full:
+                block = data[i:i+full*b].reshape(full, b, -1)
+                self._min[c:c+full] = _n.fmin.reduce(block, 1)
+                self._max[c:c+full] = _n.fmax.reduce(block, 1)
+                self._t0 [c:c+full] = t[i    :i+full*b:b]
+                self._t1 [c:c+full] = t[i+b-1:i+full*b:b]
+                self._count += full
+                self._n      = b
+                i           += full*b
+            
+            # Start a new bucket with the rest
+            elif k:
+                self._min[c] = _n.fmin.reduce(data[i:i+k], 0)
+                self._max[c] = _n.fmax.reduce(data[i:i+k], 0)
+                self._t0 [c] = t[i]
+                self._t1 [c] = t[i+k-1]
+                self._count += 1
+                self._n      = k
+                i           += k
+        
+        return self
+    
+    def _merge(self):
+        """
+        Merges neighbouring buckets, halving their number.
+        """
+        c     = self._count
+        pairs = c//2
+        
+        self._min[:pairs] = _n.fmin(self._min[0:2*pairs:2], self._min[1:2*pairs:2])
+        self._max[:pairs] = _n.fmax(self._max[0:2*pairs:2], self._max[1:2*pairs:2])
+        self._t0 [:pairs] = self._t0[0:2*pairs:2]
+        self._t1 [:pairs] = self._t1[1:2*pairs:2]
+        
+        # An odd bucket out becomes the (partially filled) last bucket
+        if c % 2:
+            self._min[pairs] = self._min[c-1]
+            self._max[pairs] = self._max[c-1]
+            self._t0 [pairs] = self._t0 [c-1]
+            self._t1 [pairs] = self._t1 [c-1]
+            self._count = pairs+1
+        
+        # Otherwise the last pair holds a full bucket plus the last one
+        else:
+            self._count = pairs
+            self._n    += self._bucket
+        
+        self._bucket *= 2
+    
+    def get(self, points=None, columns=None):
+        """
+        Returns the envelope, ready to plot.
+        
+        Parameters
+        ----------
+        points=None : int
+            Maximum number of buckets to return, e.g. the width of the plot in
+            pixels. Buckets are merged further to fit. None means no limit.
+        
+        columns=None : list
+            Indices of the data columns to return. None means all.
+        
+        Returns
+        -------
+        t : array
+            Times, two per bucket (first and last sample).
+        
+        y : array
+            Data, two rows per bucket (min then max). While each bucket is a
+            single sample, the samples are returned as they are.
+        """
+        c = self._count
+        if columns is None: columns = slice(None)
+        
+        # Still at full resolution
+        if self._bucket == 1 and (points is None or c <= points):
+            return self._t0[:c].copy(), self._min[:c, columns]
+        
+        t0 = self._t0[:c]
+        t1 = self._t1[:c]
+        y0 = self._min[:c, columns]
+        y1 = self._max[:c, columns]
+        
+        # Merge groups of k buckets to fit in the requested width
+        if points is not None and c > points:
+            k = -(-c//points)
+            i = _n.arange(0, c, k)
+            t0 = t0[i]
+            t1 = t1[_n.minimum(i+k, c)-1]
+            y0 = _n.fmin.reduceat(y0, i, 0)
+            y1 = _n.fmax.reduceat(y1, i, 0)
+        
+        # Interleave min and max
+        t = _n.empty(2*len(t0))
+        y = _n.empty((2*len(t0), y0.shape[1]))
+        t[0::2] = t0
+        t[1::2] = t1
+        y[0::2] = y0
+        y[1::2] = y1
+        
+        return t, y
@@ -0,0 +1,149 @@
+import numpy    as _n
+import os       as _os
+import shutil   as _shutil
+import tempfile as _tempfile
+import weakref  as _weakref
+
+class chunk_store():
+    """
+    Append-only on-disk store of sample rows, kept as a directory of .npy
+    chunks. Chunks are memory-mapped when read back, so only the rows that
+    are asked for are ever loaded.
+    
+    Each chunk is written to a temporary file and renamed into place, so a
+    crash can lose at most the chunk being written, never corrupt the store.
+    The time span of every chunk is also appended to index.txt, so opening
+    a store with many chunks does not mean opening every chunk.
+    
+    Parameters
+    ----------
+    path=None : str
+        Directory to write the chunks to. Created on the first append. None
+        means a new temporary directory, which is deleted along with the store
+        (when it is garbage collected, or at the latest when Python exits).
+        If it already holds chunks, they are indexed and new chunks are added
+        after them.
+    
+    ckeys=None : list
+        Optional column names, saved alongside the chunks. The first column
+        must be the time.
+    
+    fsync=False : bool
+        Whether to force each chunk to disk before returning from append().
+    """
+    def __init__(self, path=None, ckeys=None, fsync=False):
+        
+        self.path  = path
+        self.ckeys = ckeys
+        self.fsync = fsync
+        
+        # One entry per chunk: (first time, last time, rows, file name)
+        self.index = []
+        
+        # Pick up an existing store
+        if path is not None and _os.path.isdir(path): self._scan()
+    
+    def __len__(self): return sum(chunk[2] for chunk in self.index)
+    
+    def _scan(self):
+        """
+        Indexes the chunks already in self.path, from index.txt where
+        possible. Chunks missing from it (e.g. written before a crash) are
+        opened to index them.
+        """
+        ckeys_path = _os.path.join(self.path, 'ckeys.txt')
+        if self.ckeys is None and _os.path.exists(ckeys_path):
+            with open(ckeys_path) as f: self.ckeys = f.read().split('\n')
+        
+        # Chunks already indexed
+        indexed    = dict()
+        index_path = _os.path.join(self.path, 'index.txt')
+        if _os.path.exists(index_path):
+            with open(index_path) as f:
+                for line in f:
+                    try: 
+                        first, last, rows, name = line.split()
+                        indexed[name] = (float(first), float(last), int(rows), name)
+                    except ValueError: pass # Torn last line
+        
+        for name in sorted(_os.listdir(self.path)):
+            if not (name.startswith('chunk_') and name.endswith('.npy')): continue
+            if name in indexed: 
+                self.index.append(indexed[name])
+                continue
+            
+            chunk = _n.load(_os.path.join(self.path, name), mmap_mode='r')
+            if len(chunk): self.index.append((chunk[0,0], chunk[-1,0], len(chunk), name))
+    
+    def append(self, block):
+        """
+        Writes a block of rows (N x columns, time first) as a new chunk.
+        """
+        if not len(block): return self
+        
+        # Make the directory on first use, and delete it when we're done if
+        # it's temporary
+        if self.path is None: 
+            self.path = _tempfile.mkdtemp(prefix='oven_history_')
+            _weakref.finalize(self, _shutil.rmtree, self.path, True)
+        if not self.index:
+            _os.makedirs(self.path, exist_ok=True)
+            if self.ckeys is not None: 
+                with open(_os.path.join(self.path, 'ckeys.txt'), 'w') as f: f.write('\n'.join(self.ckeys))
+        
+        # Chunks are numbered past the last one, so names never collide
+        if self.index: name = 'chunk_%06d.npy' % (int(self.index[-1][3][6:12])+1)
+        else:          name = 'chunk_000000.npy'
+        path = _os.path.join(self.path, name)
+        
+        # Write, then move into place
+        with open(path+'.tmp', 'wb') as f:
+            _n.save(f, _n.ascontiguousarray(block))
+            if self.fsync:
+                f.flush()
+                _os.fsync(f.fileno())
+        _os.replace(path+'.tmp', path)
+        
+        self.index.append((block[0,0], block[-1,0], len(block), name))
+        
+        # Record it in the index file
+        with open(_os.path.join(self.path, 'index.txt'), 'a') as f:
+            f.write('%r %r %d %s\n' % (float(block[0,0]), float(block[-1,0]), len(block), name))
+            if self.fsync:
+                f.flush()
+                _os.fsync(f.fileno())
+        
+        return self
+    
+    def read(self, t_start=None, t_stop=None):
+        """
+        Returns the rows with t_start <= time <= t_stop (None means no limit).
+        Only the chunks that overlap the range are opened.
+        """
+        blocks = []
+        for first, last, rows, name in self.index:
+            if t_start is not None and last  < t_start: continue
+            if t_stop  is not None and first > t_stop : continue
+            
+            chunk = _n.load(_os.path.join(self.path, name), mmap_mode='r')
+            i0 = 0    if t_start is None else _n.searchsorted(chunk[:,0], t_start, 'left')
+            i1 = rows if t_stop  is None else _n.searchsorted(chunk[:,0], t_stop,  'right')
+            blocks.append(_n.array(chunk[i0:i1]))
+        
+        if not blocks: return _n.zeros((0, len(self.ckeys) if self.ckeys else 0))
+        return _n.concatenate(blocks)
+    
+    def iter_chunks(self):
+        """
+        Yields each chunk in order, memory-mapped.
+        """
+        for chunk in self.index: yield _n.load(_os.path.join(self.path, chunk[3]), mmap_mode='r')
+    
+    def clear(self):
+        """
+        Deletes all chunks written by this store.
+        """
+        for chunk in self.index: _os.remove(_os.path.join(self.path, chunk[3]))
+        if self.index and _os.path.exists(_os.path.join(self.path, 'index.txt')): _os.remove(_os.path.join(self.path, 'index.txt'))
+        self.index = []
+        return self
@@ -0,0 +1,129 @@
+import time as _time
+
+# Timing histogram buckets are powers of two of microseconds, up to ~1 hour
+_buckets = 32
+
+class stage_timer():
+    """
+    Timing histogram for one stage of the pipeline, with power-of-two
+    microsecond buckets so recording is O(1) and memory is fixed.
+    """
+    def __init__(self):
+        self.clear()
+    
+    def clear(self):
+        self.counts  = [0]*_buckets
+        self.calls   = 0
+        self.items   = 0
+        self.total   = 0.0
+        self.maximum = 0.0
+    
+    def record(self, dt, items=1):
+        """
+        Records one call that took dt (s) and handled items items.
+        """
+        us = int(dt*1e6)
+        self.counts[min(us.bit_length(), _buckets-1)] += 1
+        self.calls += 1
+        self.items += items
+        self.total += dt
+        if dt > self.maximum: self.maximum = dt
+    
+    def get_percentile(self, p):
+        """
+        Returns the upper edge of the bucket holding the p'th percentile (s),
+        or the maximum if that is smaller.
+        """
+        if not self.calls: return 0.0
+        
+        target = p/100.0*self.calls
+        total  = 0
+        for n, count in enumerate(self.counts):
+            total += count
+            if total >= target: return min((1 << n)*1e-6, self.maximum)
+        return self.maximum
+
+
+class instrumentation():
+    """
+    Per-stage timing histograms, counters and gauges for the acquisition
+    pipeline. When disabled, start() returns None and everything else
+    returns straight away, so leaving the calls in the hot path costs
+    next to nothing.
+    
+    Typical use:
+        
+        t = perf.start()
+        ...work...
+        perf.stop('decode', t, items)
+    
+    Parameters
+    ----------
+    enabled=False : bool
+        Whether to record anything.
+    """
+    def __init__(self, enabled=False):
+        
+        self.enabled  = enabled
+        self.stages   = {} # name: stage_timer
+        self.counters = {} # name: count
+        self.gauges   = {} # name: latest value
+        self._t_clear = _time.time()
+    
+    def start(self):
+        """
+        Returns a start time for stop(), or None if disabled.
+        """
+        if self.enabled: return _time.perf_counter()
+    
+    def stop(self, stage, t_start, items=1):
+        """
+        Records the time since t_start (from start()) for the named stage.
+        """
+        if t_start is None: return
+        
+        dt = _time.perf_counter() - t_start
+        if stage not in self.stages: self.stages[stage] = stage_timer()
+        self.stages[stage].record(dt, items)
+    
+    def count(self, name, n=1):
+        """
+        Adds n to the named counter.
+        """
+        if self.enabled: self.counters[name] = self.counters.get(name, 0) + n
+    
+    def gauge(self, name, value):
+        """
+        Records the latest value of the named gauge (e.g. a buffer depth).
+        """
+        if self.enabled: self.gauges[name] = value
+    
+    def clear(self):
+        """
+        Forgets everything recorded so far.
+        """
+        self.stages   = {}
+        self.counters = {}
+        self.gauges   = {}
+        self._t_clear = _time.time()
+    
+    def get_report(self):
+        """
+        Returns a text table of everything recorded since the last clear().
+        """
+        dt    = max(_time.time() - self._t_clear, 1e-9)
+        lines = ['%-10s %8s %10s %10s %10s %10s %10s' % ('Stage', 'Calls/s', 'Items/s', 'Mean (us)', 'p50 (us)', 'p99 (us)', 'Max (us)')]
+        for name, s in self.stages.items():
+            lines.append('%-10s %8.1f %10.1f %10.1f %10.0f %10.0f %10.0f' % (
+                name, s.calls/dt, s.items/dt, 1e6*s.total/max(s.calls, 1),
+                1e6*s.get_percentile(50), 1e6*s.get_percentile(99), 1e6*s.maximum))
+        
+        if self.counters:
+            lines.append('')
+            for name in sorted(self.counters): lines.append('%-24s %12d' % (name, self.counters[name]))
+        
+        if self.gauges:
+            lines.append('')
+            for name in sorted(self.gauges): lines.append('%-24s %12g' % (name, self.gauges[name]))
+        
+        return '\n'.join(lines)
@@ -0,0 +1,195 @@
+import numpy as _n
+import math  as _math
+
+
+class channel_metrics():
+    """
+    Running statistics of one control channel, updated a block at a time
+    with numpy, so they cost the same at any history length. Everything except the step
+    response is exponentially weighted with time constant window, which
+    copes with uneven sample spacing and needs no buffer.
+    
+    After every setpoint change, the overshoot past the new setpoint is
+    tracked, along with the settling time: how long until the temperature
+    entered the band around the setpoint for good (i.e. stayed there for
+    settle_hold).
+    
+    Parameters
+    ----------
+    window=60 : float
+        Time constant of the mean, variance, heating rate and duty cycle (s).
+    
+    band=0.5 : float
+        Distance from the setpoint that counts as settled (C).
+    
+    settle_hold=30 : float
+        How long the temperature must stay in the band to be settled (s).
+    
+    saturation=99.5 : float
+        Output (%) at or above which the heater counts as saturated.
+    """
+    def __init__(self, window=60, band=0.5, settle_hold=30, saturation=99.5):
+        
+        self.window      = window
+        self.band        = band
+        self.settle_hold = settle_hold
+        self.saturation  = saturation
+        
+        self.clear()
+    
+    def clear(self):
+        """
+        Forgets everything.
+        """
+        self.t        = None     # Time of the last sample
+        self.mean     = _n.nan   # Temperature (C)
+        self.variance = _n.nan   # Temperature (C^2)
+        self.error    = _n.nan   # Temperature minus setpoint (C)
+        self.rate     = _n.nan   # Heating rate (C/s)
+        self.output   = _n.nan   # Mean output (%)
+        self.saturated = _n.nan  # Fraction of time at full output
+        
+        # Weighted sums for the least-squares heating rate, with times
+        # relative to the last sample
+        self._s  = 0.0 # Weights
+        self._st = 0.0 # Weighted times
+        self._sx = 0.0 # Weighted temperatures
+        self._stt = 0.0
+        self._stx = 0.0
+        
+        # Step response since the last setpoint change
+        self.setpoint      = None
+        self.t_step        = None
+        self.overshoot     = _n.nan # Worst excursion past the setpoint (C)
+        self.settling_time = _n.nan # Time from the change to settling (s)
+        self._direction    = 0      # +1 heating, -1 cooling toward the setpoint
+        self._t_band       = None   # When the temperature last entered the band
+    
+    def append(self, t, temperature, output, setpoint):
+        """
+        Adds a block of samples. Samples whose temperature is NaN (gaps in
+        the telemetry) are skipped.
+        
+        Every exponentially weighted quantity y follows
+        
+            y_k = d_k*y_(k-1) + input_k,   d_k = exp(-dt_k/window)
+        
+        so its value after the block is the old value times the product of
+        the d_k, plus each input decayed by the d that follow it. These
+        weights are exp(-(time to the end of the block)/window), which never
+        overflow, so the whole block is done with a few array operations.
+        
+        Parameters
+        ----------
+        t, temperature, output : array
+            Time (s), temperature (C) and output (%) of each sample.
+        
+        setpoint : float
+            Setpoint (C) in effect for these samples.
+        """
+        t, x, u = _n.asarray(t, float), _n.asarray(temperature, float), _n.asarray(output, float)
+        good = x == x
+        if not good.all(): t, x, u = t[good], x[good], u[good]
+        if not len(t): return
+        
+        # A new setpoint starts a new step
+        if setpoint != self.setpoint:
+            self.setpoint      = setpoint
+            self.t_step        = t[0]
+            self.overshoot     = 0.0
+            self.settling_time = _n.nan
+            self._direction    = 1 if setpoint >= x[0] else -1
+            self._t_band       = None
+        
+        self.error = x[-1] - setpoint
+        sat = (u >= self.saturation).astype(float)
+        
+        # The first sample starts everything off
+        if self.t is None:
+            self.t, self.mean, self.variance, self.output, self.saturated = t[0], x[0], 0.0, u[0], sat[0]
+            self._s, self._sx = 1.0, x[0]
+            t, x, u, sat = t[1:], x[1:], u[1:], sat[1:]
+            if not len(t): return
+        
+        # Decay of each sample's input to the end of the block, and of the
+        # state before the block. Time going backwards doesn't decay.
+        dt = _n.empty(len(t))
+        dt[0]  = t[0] - self.t
+        dt[1:] = t[1:] - t[:-1]
+        _n.maximum(dt, 0, out=dt)
+        T      = _n.cumsum(dt)
+        weight = _n.exp((T - T[-1])/self.window)
+        decay  = _math.exp(-T[-1]/self.window)
+        alpha  = -_n.expm1(-dt/self.window)*weight
+        
+        # Mean and variance, about the old mean for precision. The variance
+        # recursion is the weighted second moment minus the squared mean.
+        y   = x - self.mean
+        ay  = alpha*y
+        m   = float(ay.sum())
+        m2  = decay*self.variance + float(_n.dot(ay, y))
+        self.mean    += m
+        self.variance = max(m2 - m*m, 0.0)
+        self.output    = decay*self.output    + float(_n.dot(alpha, u))
+        self.saturated = decay*self.saturated + float(_n.dot(alpha, sat))
+        
+        # Weighted least-squares slope, with the sums' time origin moved from
+        # the last sample before the block to the last one in it
+        h   = t[-1] - self.t
+        st  = self._st  - h*self._s
+        stt = self._stt - 2*h*self._st + h*h*self._s
+        stx = self._stx - h*self._sx
+        v   = t - t[-1]
+        wv  = weight*v
+        self._s   = decay*self._s  + float(weight.sum())
+        self._st  = decay*st       + float(wv.sum())
+        self._sx  = decay*self._sx + float(_n.dot(weight, x))
+        self._stt = decay*stt      + float(_n.dot(wv, v))
+        self._stx = decay*stx      + float(_n.dot(wv, x))
+        self.t    = float(t[-1])
+        
+        d = self._s*self._stt - self._st*self._st
+        if d > 0: self.rate = (self._s*self._stx - self._st*self._sx)/d
+        
+        self._update_step(t, x, setpoint)
+    
+    def _update_step(self, t, x, setpoint):
+        """
+        Updates the overshoot and settling time with a block of samples.
+        """
+        # Overshoot past the setpoint in the direction of travel
+        self.overshoot = max(self.overshoot, float(_n.max(self._direction*(x - setpoint))))
+        
+        # Settling: in the band, and has been for settle_hold. Only the run of
+        # samples in the band at the end of the block matters.
+        out = _n.flatnonzero(_n.abs(x - setpoint) > self.band)
+        if len(out):
+            self.settling_time = _n.nan
+            if out[-1] == len(x)-1: 
+                self._t_band = None
+                return
+            self._t_band = t[out[-1]+1]
+        elif self._t_band is None: self._t_band = t[0]
+        
+        if self.settling_time != self.settling_time and t[-1] - self._t_band >= self.settle_hold:
+            self.settling_time = self._t_band - self.t_step
+    
+    def get_std(self):
+        """
+        Returns the standard deviation of the temperature (C).
+        """
+        return _math.sqrt(self.variance) if self.variance == self.variance else _n.nan
+    
+    def is_settled(self):
+        """
+        Returns True if the temperature has settled since the last setpoint change.
+        """
+        return self.settling_time == self.settling_time
+    
+    def get(self):
+        """
+        Returns a dictionary of the current values.
+        """
+        return dict(mean=self.mean, std=self.get_std(), error=self.error, rate=self.rate,
+                    overshoot=self.overshoot, settling_time=self.settling_time,
+                    output=self.output, saturated=self.saturated)
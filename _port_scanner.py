@@ -0,0 +1,97 @@
+import json      as _json
+import os        as _os
+import threading as _threading
+
+
+class port_scanner():
+    """
+    Finds the serial ports in a background thread, so slow USB enumeration
+    never holds anything up. The last list found (and the last port used) is
+    kept in a JSON file, so it can be shown straight away next time.
+    
+    Parameters
+    ----------
+    path=None : str
+        JSON file for the last-known ports. None means nothing is remembered.
+    """
+    def __init__(self, path=None):
+        
+        self.path      = path
+        self.ports     = [] # (device, description) pairs
+        self.preferred = None # Last port connected to
+        self.scanning  = False
+        self._thread   = None
+        
+        self.load()
+    
+    def load(self):
+        """
+        Reads the last-known ports from the file, if there is one.
+        """
+        if not self.path or not _os.path.exists(self.path): return
+        
+        try:
+            with open(self.path) as f: d = _json.load(f)
+            self.ports     = [tuple(p) for p in d.get('ports', [])]
+            self.preferred = d.get('preferred')
+        
+        # A damaged cache is only a slower start
+        except (ValueError, OSError, TypeError): pass
+    
+    def save(self):
+        """
+        Writes the ports and the preferred port to the file.
+        """
+        if not self.path: return
+        
+        try:
+            _os.makedirs(_os.path.dirname(_os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'w') as f: _json.dump(dict(ports=self.ports, preferred=self.preferred), f, indent=1)
+        except OSError as e: print('Could not save the port list:', e)
+    
+    def scan(self):
+        """
+        Starts enumerating the ports in the background, unless that is
+        already happening. self.scanning is False again once self.ports is
+        up to date.
+        """
+        if self.scanning: return
+        
+        self.scanning = True
+        self._thread  = _threading.Thread(target=self._scan, daemon=True)
+        self._thread.start()
+    
+    def _scan(self):
+        """
+        Runs in the scan thread. pyserial's port listing is only imported
+        here, since on some machines even that is slow.
+        """
+        try:
+            from serial.tools.list_ports import comports
+            self.ports = [(p.device, p.description) for p in comports()]
+            self.save()
+        
+        except Exception as e: print('Could not list the serial ports:', e)
+        
+        self.scanning = False
+    
+    def set_preferred(self, device):
+        """
+        Remembers the port to select by default from now on.
+        """
+        if device == self.preferred: return
+        self.preferred = device
+        self.save()
+    
+    def get_default(self):
+        """
+        Returns the index in self.ports of the port to select by default: the
+        last one used if it is still there, then the first Arduino, then 0.
+        """
+        devices = [p[0] for p in self.ports]
+        if self.preferred in devices: return devices.index(self.preferred)
+        
+        for n, (device, description) in enumerate(self.ports):
+            if 'Arduino' in description: return n
+        
+        return 0
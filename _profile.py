@@ -0,0 +1,278 @@
+import heapq     as _heapq
+import itertools as _itertools
+import threading as _threading
+import time      as _time
+
+
+def load_recipe(path):
+    """
+    Reads a ramp/soak recipe from a text file. Each line is one segment,
+    
+        channel, setpoint, rate, hold
+    
+    meaning: ramp channel to setpoint (C) at rate (C/s), then hold there for
+    hold (s). Segments run in file order for each channel. Blank lines and
+    anything after a '#' are ignored.
+    
+    Parameters
+    ----------
+    path : str
+        Recipe file.
+    
+    Returns
+    -------
+    Dictionary of channel numbers and their lists of (setpoint, rate, hold)
+    segments, suitable for profile_scheduler.start_recipe().
+    """
+    recipe = dict()
+    with open(path) as f:
+        for n, line in enumerate(f):
+            line = line.split('#')[0].strip()
+            if not line: continue
+            
+            try: channel, setpoint, rate, hold = [float(x) for x in line.split(',')]
+            except ValueError: raise Exception('Line %d of %s should be "channel, setpoint, rate, hold".' % (n+1, path))
+            
+            recipe.setdefault(int(channel), []).append((setpoint, rate, hold))
+    
+    return recipe
+
+
+class profile():
+    """
+    Ramp/soak profile for one channel of one controller_engine. The firmware
+    does the ramping itself, so the only thing sent is the new setpoint and
+    ramp rate at the start of each segment. The segment lasts as long as
+    the ramp should take, plus its hold.
+    
+    Created by profile_scheduler.start_profile().
+    
+    Parameters
+    ----------
+    engine : controller_engine
+        Controller to send the parameters to.
+    
+    segments : list
+        (setpoint, rate, hold) of each segment; see load_recipe(). Every
+        segment must pass engine.check_parameters() (e.g. setpoints within
+        the engine's temperature_limit), or an exception is raised.
+    
+    channel=0 : int
+        Channel to control.
+    """
+    def __init__(self, engine, segments, channel=0):
+        
+        self.engine   = engine
+        self.segments = list(segments)
+        self.channel  = channel
+        
+        # Check every segment against the engine's limits before anything
+        # runs, so a bad recipe fails up front rather than part way through
+        for target, rate, hold in self.segments:
+            engine.check_parameters({'setpoint_%d' % channel : target, 'rate_%d' % channel : rate})
+        
+        # Offset of each segment boundary from the start (s), the last being the end
+        self.boundaries = [0.0]
+        setpoint = engine.parameters['setpoint_%d' % channel]
+        for target, rate, hold in self.segments:
+            ramp = abs(target-setpoint)/rate if rate > 0 else 0
+            self.boundaries.append(self.boundaries[-1] + ramp + hold)
+            setpoint = target
+        
+        self.t_start  = None  # time.monotonic() of the start
+        self.index    = -1    # Current segment
+        self.done     = False
+        self.stopped  = False
+        self.lateness = 0.0   # Worst delay of a boundary past its deadline (s)
+    
+    def get_remaining(self):
+        """
+        Returns the time left in the profile (s).
+        """
+        if self.t_start is None: return self.boundaries[-1]
+        return max(0.0, self.t_start + self.boundaries[-1] - _time.monotonic())
+    
+    def _enter(self, n):
+        """
+        Starts segment n, or finishes if n is past the last one.
+        
+        Returns
+        -------
+        Dictionary of the parameters to send (empty at the end).
+        """
+        self.index = n
+        if n >= len(self.segments):
+            self.done = True
+            return dict()
+        
+        setpoint, rate, hold = self.segments[n]
+        return {'setpoint_%d' % self.channel : setpoint,
+                'rate_%d'     % self.channel : rate}
+
+
+class profile_scheduler():
+    """
+    Runs any number of profiles, on any number of engines, from one thread.
+    Every segment boundary is a deadline on time.monotonic() fixed when the
+    profile starts, so timing errors never accumulate, and the only work done
+    at a boundary is sending the new parameters. Nothing runs in between.
+    """
+    def __init__(self):
+        
+        self.profiles   = []
+        self._heap      = [] # (deadline, order, profile, segment)
+        self._order     = _itertools.count()
+        self._condition = _threading.Condition()
+        self._thread    = None
+        self._running   = False
+    
+    def start_profile(self, engine, segments, channel=0, delay=0, t_start=None):
+        """
+        Starts running a profile.
+        
+        Parameters
+        ----------
+        engine : controller_engine
+            Controller to send the parameters to.
+        
+        segments : list
+            (setpoint, rate, hold) of each segment; see load_recipe().
+        
+        channel=0 : int
+            Channel to control.
+        
+        delay=0 : float
+            Time to wait before the first segment (s).
+        
+        t_start=None : float
+            time.monotonic() at which to start, overriding delay.
+        
+        Returns
+        -------
+        The profile, for checking on or stopping.
+        """
+        p = profile(engine, segments, channel)
+        p.t_start = _time.monotonic() + delay if t_start is None else t_start
+        
+        self._start([p])
+        return p
+    
+    def start_recipe(self, engines, recipe, delay=0):
+        """
+        Starts a profile for every channel of a recipe (see load_recipe()) on
+        one or more engines, all with the same start time.
+        
+        Parameters
+        ----------
+        engines : controller_engine or list
+            Controller(s) to run the recipe on.
+        
+        recipe : dict
+            Channel numbers and their lists of segments.
+        
+        delay=0 : float
+            Time to wait before the first segments (s).
+        
+        Returns
+        -------
+        List of the profiles.
+        """
+        if not isinstance(engines, (list, tuple)): engines = [engines]
+        
+        t_start  = _time.monotonic() + delay
+        profiles = []
+        for engine in engines:
+            for channel in sorted(recipe):
+                p = profile(engine, recipe[channel], channel)
+                p.t_start = t_start
+                profiles.append(p)
+        
+        self._start(profiles)
+        return profiles
+    
+    def _start(self, profiles):
+        """
+        Schedules the first segments of the profiles, all at once so that
+        those starting together are sent together.
+        """
+        with self._condition:
+            for p in profiles:
+                self.profiles.append(p)
+                _heapq.heappush(self._heap, (p.t_start, next(self._order), p, 0))
+            self._condition.notify()
+        
+            if not self._running: 
+                self._running = True
+                self._thread  = _threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+    
+    def stop_profile(self, p):
+        """
+        Stops a profile where it is. The parameters are left as they are. Once
+        this returns, the profile sends nothing more, even if its next segment
+        was already due.
+        """
+        p.stopped = True
+        with self._condition: 
+            if p in self.profiles: self.profiles.remove(p)
+    
+    def stop(self):
+        """
+        Stops every profile and the scheduler thread.
+        """
+        for p in list(self.profiles): self.stop_profile(p)
+        with self._condition:
+            self._heap    = []
+            self._running = False
+            self._condition.notify()
+        if self._thread: self._thread.join()
+        self._thread = None
+    
+    def _run(self):
+        """
+        Runs in the scheduler thread. Sleeps until the next deadline, then
+        starts every segment that is due and schedules their next boundaries.
+        Segments due together on one engine (e.g. both channels of a recipe)
+        go out as a single frame.
+        """
+        while True:
+            
+            # Wait for the earliest deadline (or a new, earlier one)
+            with self._condition:
+                if not self._running: return
+                
+                if not self._heap: 
+                    self._condition.wait()
+                    continue
+                
+                now  = _time.monotonic()
+                wait = self._heap[0][0] - now
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                
+                # Everything due, with the profiles and parameters for each engine
+                changes = dict() # engine: [(profile, parameters)]
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, order, p, n = _heapq.heappop(self._heap)
+                    if p.stopped: continue
+                    
+                    p.lateness = max(p.lateness, now - deadline)
+                    changes.setdefault(p.engine, []).append((p, p._enter(n)))
+                    
+                    if p.done: 
+                        if p in self.profiles: self.profiles.remove(p)
+                    else: 
+                        _heapq.heappush(self._heap, (p.t_start + p.boundaries[n+1], next(self._order), p, n+1))
+            
+            # Send outside the lock, so a slow port never holds up the scheduling.
+            # Profiles stopped since (e.g. by a watchdog trip, which stops them
+            # under the engine's write lock) send nothing.
+            for engine, segments in changes.items():
+                with engine._write_lock:
+                    parameters = dict()
+                    for p, x in segments: 
+                        if not p.stopped: parameters.update(x)
+                    if not parameters: continue
+                    try: engine.apply_parameters(**parameters)
+                    except Exception as e: print('Profile could not send', parameters, ':', e)
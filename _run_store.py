@@ -0,0 +1,252 @@
+import numpy as _n
+import os    as _os
+
+from _history import chunk_store
+
+# Each summary level covers _summary_factor times as many samples as the
+# one below it: 16, 256, 4096, ... samples per row.
+_summary_factor = 16
+_summary_levels = 5
+
+
+def _summarize(rows, columns):
+    """
+    Turns sample rows (time then columns) into level-0 summary rows:
+    first time, last time, then the min, max, sum and count of each column.
+    """
+    x     = rows[:,1:]
+    valid = _n.isfinite(x)
+    return _n.hstack([rows[:,:1], rows[:,:1], x, x, _n.where(valid, x, 0), valid.astype(float)])
+
+def _combine(rows, columns, factor):
+    """
+    Combines every factor summary rows into one. len(rows) must be a
+    multiple of factor.
+    """
+    C = columns
+    r = rows.reshape(-1, factor, rows.shape[1])
+    return _n.hstack([r[:,0,:1], r[:,-1,1:2],
+                      _n.fmin.reduce(r[:,:,2    :2+C  ], axis=1),
+                      _n.fmax.reduce(r[:,:,2+C  :2+2*C], axis=1),
+                      r[:,:,2+2*C:].sum(axis=1)])
+
+
+class summary_pyramid():
+    """
+    Writes multi-resolution summaries of a sample stream alongside its
+    chunks: level n has one row per factor**n samples, holding the time
+    span and the min, max, sum and count of every column. Rows are appended
+    to summary_<n>.f8 as raw float64, so they can be memory-mapped back by
+    run_store without loading anything else.
+    
+    Parameters
+    ----------
+    path : str
+        Directory to write to (normally a chunk_store's).
+    
+    columns : int
+        Number of data columns (excluding the time).
+    
+    factor=16 : int
+        Samples per row of level 1, and rows per row of each next level.
+    
+    levels=5 : int
+        Number of levels.
+    
+    fsync=False : bool
+        Whether to force each write to disk.
+    """
+    def __init__(self, path, columns, factor=_summary_factor, levels=_summary_levels, fsync=False):
+        
+        self.path    = path
+        self.columns = columns
+        self.factor  = factor
+        self.levels  = levels
+        self.fsync   = fsync
+        
+        # Rows of each level waiting for enough company to be combined
+        self._pending = [_n.zeros((0, 2+4*columns)) for n in range(levels)]
+        
+        # Record the layout for run_store
+        _os.makedirs(path, exist_ok=True)
+        with open(_os.path.join(path, 'summary.txt'), 'w') as f: f.write('%d %d %d\n' % (factor, levels, columns))
+    
+    def append(self, block):
+        """
+        Adds a block of sample rows (N x columns+1, time first).
+        """
+        self._add(0, _summarize(_n.asarray(block), self.columns))
+        return self
+    
+    def _add(self, n, rows, final=False):
+        """
+        Adds summary rows of level n, writing and passing up every full
+        group. If final, a partial group is written too.
+        """
+        rows = _n.concatenate([self._pending[n], rows])
+        full = len(rows) - len(rows) % self.factor
+        
+        combined = _combine(rows[:full], self.columns, self.factor)
+        if final and full < len(rows): 
+            combined = _n.concatenate([combined, _combine(rows[full:], self.columns, len(rows)-full)])
+            full     = len(rows)
+        self._pending[n] = rows[full:]
+        
+        if not len(combined): 
+            if final and n+1 < self.levels: self._add(n+1, combined, final)
+            return
+        
+        with open(_os.path.join(self.path, 'summary_%d.f8' % (n+1)), 'ab') as f:
+            f.write(combined.tobytes())
+            if self.fsync:
+                f.flush()
+                _os.fsync(f.fileno())
+        
+        if n+1 < self.levels: self._add(n+1, combined, final)
+    
+    def close(self):
+        """
+        Writes the partial groups, so the end of the stream is summarized.
+        Nothing can be appended afterwards.
+        """
+        self._add(0, _n.zeros((0, 2+4*self.columns)), final=True)
+
+
+def _close_groups(rows, columns, factor):
+    """
+    Combines summary rows into rows of the next level, every factor rows
+    into one, and any left over into a last, partial one (as
+    summary_pyramid.close() does).
+    """
+    full = len(rows) - len(rows) % factor
+    if full == len(rows): return _combine(rows, columns, factor)
+    return _n.concatenate([_combine(rows[:full], columns, factor), _combine(rows[full:], columns, len(rows)-full)])
+
+
+def build_summaries(path):
+    """
+    Writes the summaries (see summary_pyramid) of a run that doesn't have
+    them, chunk by chunk.
+    
+    Parameters
+    ----------
+    path : str
+        Run (chunk_store) directory.
+    """
+    chunks = chunk_store(path)
+    for n in range(1, _summary_levels+1):
+        p = _os.path.join(path, 'summary_%d.f8' % n)
+        if _os.path.exists(p): _os.remove(p)
+    
+    pyramid = summary_pyramid(path, len(chunks.ckeys)-1)
+    for chunk in chunks.iter_chunks(): pyramid.append(chunk)
+    pyramid.close()
+
+
+class run_store():
+    """
+    Read-only access to a logged run (see _data_logger) for browsing. The
+    chunks' time index and the summary pyramid are memory-mapped, so
+    opening a run costs the same at any length, and get() loads only the
+    rows of the level that fits the requested range.
+    
+    Runs without summaries get them built on first open. Runs still being
+    written, or that never closed, have summary rows only for complete
+    groups; the rest (see self.tails) is summarized on open.
+    
+    Parameters
+    ----------
+    path : str
+        Run directory.
+    """
+    def __init__(self, path):
+        
+        self.path   = path
+        self.chunks = chunk_store(path)
+        self.ckeys  = self.chunks.ckeys
+        
+        # Unix time at which the run's times are zero, if it was recorded
+        self.t_zero = None
+        if _os.path.exists(_os.path.join(path, 'start.txt')):
+            with open(_os.path.join(path, 'start.txt')) as f: self.t_zero = float(f.read().split()[0])
+        
+        if not _os.path.exists(_os.path.join(path, 'summary.txt')) and len(self.chunks): build_summaries(path)
+        
+        # Memory-map each level, ignoring any torn last row
+        self.factor, self.levels, self.tails = _summary_factor, [], []
+        if _os.path.exists(_os.path.join(path, 'summary.txt')):
+            with open(_os.path.join(path, 'summary.txt')) as f: self.factor, levels, columns = [int(x) for x in f.read().split()]
+            
+            width = 2+4*columns
+            for n in range(1, levels+1):
+                p    = _os.path.join(path, 'summary_%d.f8' % n)
+                rows = _os.path.getsize(p)//(8*width) if _os.path.exists(p) else 0
+                self.levels.append(_n.memmap(p, float, 'r', shape=(rows, width)) if rows else _n.zeros((0, width)))
+            
+            # Rows the pyramid hasn't written yet, each level from the tail of
+            # the one below, the first from the samples past its last row. Each
+            # is less than a group of the level below, so this is quick.
+            for n, level in enumerate(self.levels):
+                t_end = level[-1,1] if len(level) else -_n.inf
+                if n == 0:
+                    block = self.chunks.read(t_end if len(level) else None)
+                    rows  = _summarize(block[block[:,0] > t_end], columns) if len(block) else _n.zeros((0, width))
+                else:
+                    below = self.levels[n-1]
+                    rows  = _n.concatenate([below[_n.searchsorted(below[:,0], t_end, 'right'):], self.tails[n-1]])
+                self.tails.append(_close_groups(rows, columns, self.factor))
+    
+    def get_span(self):
+        """
+        Returns the times of the first and last samples.
+        """
+        if not self.chunks.index: return _n.nan, _n.nan
+        return self.chunks.index[0][0], self.chunks.index[-1][1]
+    
+    def get(self, column, t_start=None, t_stop=None, points=2000):
+        """
+        Returns a column between t_start and t_stop (None means no limit), at
+        the finest resolution that needs no more than points rows.
+        
+        Parameters
+        ----------
+        column : int or str
+            Column number (1 is the first after the time) or ckey.
+        
+        t_start=None, t_stop=None : float
+            Time range (s).
+        
+        points=2000 : int
+            Most rows to return.
+        
+        Returns
+        -------
+        t, lo, hi, mean : arrays
+            Time, min, max and mean of each row. At full resolution they
+            are all the samples themselves.
+        
+        level : int
+            Level the rows came from (0 for raw samples).
+        """
+        if isinstance(column, str): column = self.ckeys.index(column)
+        
+        # Raw samples, if few enough are in range
+        rows = sum(c[2] for c in self.chunks.index if (t_start is None or c[1] >= t_start) and (t_stop is None or c[0] <= t_stop))
+        if rows <= points or not self.levels:
+            block = self.chunks.read(t_start, t_stop)
+            x     = block[:,column] if len(block) else _n.zeros(0)
+            return (block[:,0] if len(block) else _n.zeros(0)), x, x, x, 0
+        
+        # Finest level with few enough rows in range, including its tail
+        C = (self.levels[0].shape[1]-2)//4
+        for n, (level, tail) in enumerate(zip(self.levels, self.tails)):
+            i0 = 0          if t_start is None else _n.searchsorted(level[:,1], t_start, 'left')
+            i1 = len(level) if t_stop  is None else _n.searchsorted(level[:,0], t_stop,  'right')
+            j0 = 0          if t_start is None else _n.searchsorted(tail [:,1], t_start, 'left')
+            j1 = len(tail)  if t_stop  is None else _n.searchsorted(tail [:,0], t_stop,  'right')
+            if i1-i0 + j1-j0 <= points or n == len(self.levels)-1: break
+        
+        r = _n.concatenate([level[i0:i1], tail[j0:j1]])
+        j = column-1
+        with _n.errstate(invalid='ignore', divide='ignore'): mean = r[:,2+2*C+j]/r[:,2+3*C+j]
+        return 0.5*(r[:,0]+r[:,1]), r[:,2+j], r[:,2+C+j], mean, n+1
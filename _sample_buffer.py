@@ -0,0 +1,149 @@
+import numpy as _n
+
+class sample_buffer():
+    """
+    Preallocated, growable block of samples. Each column is stored
+    contiguously, so column views can be handed straight to plots and
+    loggers without copying. Capacity doubles whenever it runs out, so
+    appending is amortized O(1) per sample.
+    
+    Optionally only the most recent samples are kept in memory; older ones
+    are moved to an on-disk store in chunks, and read back on request.
+    
+    Parameters
+    ----------
+    ckeys : list
+        Column names. The first column is the time.
+        
+    capacity=1024 : int
+        Initial number of rows to allocate.
+    
+    retention=None : float
+        How much history to keep in memory (same units as the time column).
+        None keeps everything.
+    
+    spill=None : chunk_store
+        Where samples older than the retention go. None discards them.
+    
+    chunk_rows=65536 : int
+        Expired samples are only moved out once there are at least this many,
+        so the store gets a few large chunks rather than many small ones.
+    """
+    def __init__(self, ckeys, capacity=1024, retention=None, spill=None, chunk_rows=65536):
+        
+        self.ckeys      = list(ckeys)
+        self.retention  = retention
+        self.spill      = spill
+        self.chunk_rows = chunk_rows
+        
+        self._data   = _n.empty((capacity, len(self.ckeys)), order='F')
+        self._head   = 0 # First row in use
+        self._length = 0
+    
+    def __len__(self): return self._length
+    
+    def __getitem__(self, n):
+        """
+        Returns a view of the filled part of column n (index or ckey).
+        """
+        if type(n) is str: n = self.ckeys.index(n)
+        return self._data[self._head:self._head+self._length, n]
+    
+    def append(self, t, data):
+        """
+        Appends a block of samples.
+        
+        Parameters
+        ----------
+        t : array
+            Time of each of the N samples.
+        
+        data : array
+            N x (number of columns - 1) array of the other columns.
+        """
+        N = len(t)
+        if not N: return self
+        
+        # Out of room at the end
+        if self._head + self._length + N > len(self._data):
+            
+            # Grow geometrically only if sliding back to the start won't do
+            capacity = len(self._data)
+            while capacity < self._length + N: capacity *= 2
+            
+            if capacity > len(self._data): bigger = _n.empty((capacity, len(self.ckeys)), order='F')
+            else:                          bigger = self._data
+            bigger[:self._length] = self._data[self._head:self._head+self._length]
+            self._data = bigger
+            self._head = 0
+        
+        # Copy the block in place
+        i = self._head + self._length
+        self._data[i:i+N, 0 ] = t
+        self._data[i:i+N, 1:] = data
+        self._length += N
+        
+        # Move out anything too old
+        if self.retention is not None: self._expire()
+        
+        return self
+    
+    def _expire(self):
+        """
+        Moves samples older than the retention to the spill store, once there
+        are at least chunk_rows of them.
+        """
+        t = self[0]
+        n = _n.searchsorted(t, t[-1]-self.retention)
+        if n < self.chunk_rows: return
+        
+        if self.spill is not None: self.spill.append(self.get_block()[:n])
+        self._head   += n
+        self._length -= n
+    
+    def get_block(self):
+        """
+        Returns a view of the filled rows as an N x columns array.
+        """
+        return self._data[self._head:self._head+self._length]
+    
+    def get_columns(self, ns):
+        """
+        Returns a list of views of the filled part of the specified columns
+        (indices or ckeys).
+        """
+        return [self[n] for n in ns]
+    
+    def get_range(self, t_start=None, t_stop=None):
+        """
+        Returns all samples with t_start <= time <= t_stop (None means no
+        limit) as an N x columns array, reading back from the spill store
+        only if the range reaches past what is in memory.
+        """
+        t  = self[0]
+        i0 = 0            if t_start is None else _n.searchsorted(t, t_start, 'left')
+        i1 = self._length if t_stop  is None else _n.searchsorted(t, t_stop,  'right')
+        recent = self.get_block()[i0:i1]
+        
+        # Everything asked for is in memory
+        if self.spill is None or not len(self.spill) or (self._length and t_start is not None and t_start >= t[0]):
+            return _n.array(recent)
+        
+        # Stop short of what is in memory to avoid duplicates
+        if self._length: 
+            t_spill_stop = t[0] if t_stop is None else min(t_stop, t[0])
+            older = self.spill.read(t_start, t_spill_stop)
+            older = older[older[:,0] < t[0]]
+        else: older = self.spill.read(t_start, t_stop)
+        
+        return _n.concatenate([older, recent])
+    
+    def clear(self):
+        """
+        Forgets all samples, keeping the allocated memory. Also clears the
+        spill store.
+        """
+        self._head   = 0
+        self._length = 0
+        if self.spill is not None: self.spill.clear()
+        return self
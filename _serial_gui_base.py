@@ -1,9 +1,16 @@
 import spinmob.egg   as _egg
+import os            as _os
+import threading     as _threading
 import time          as _time
 
-from serial.tools.list_ports import comports as _comports
+from _port_scanner   import port_scanner
+from _settings_cache import settings_cache
 _g            = _egg.gui
 
+# Extra entries at the end of the port list
+_simulation_port = 'Simulation'
+_refresh_port    = 'Refresh - Update Ports List'
+
 class serial_gui_base(_g.BaseObject):
     """
     Base class for creating a serial connection gui. Handles common controls.
@@ -34,6 +41,10 @@ class serial_gui_base(_g.BaseObject):
 
         # Remebmer the name.
         self.name = name
+        
+        # Settings of every control named after this window are loaded once
+        # and saved in batches (see _settings_cache)
+        self.settings_cache = settings_cache(name)
 
         # Checks periodically for the last exception
         self.timer_exceptions = _g.TimerExceptions()
@@ -43,127 +54,120 @@ class serial_gui_base(_g.BaseObject):
         self.api = None
         self._api_class = api_class
 
-        # GUI stuff
-        self.window   = _g.Window(
-            self.name, size=window_size, autosettings_path=name+'.window',
-            event_close = self._window_close)
-        
-        # Top of GUI (Serial Communications)
-        self.grid_top = self.window.place_object(_g.GridLayout(margins=False), alignment=0)
-        self.window.new_autorow()
-        self.grid_bot = self.window.place_object(_g.GridLayout(margins=False), alignment=0)
-
-        # Get all the available ports
-        self._label_port = self.grid_top.add(_g.Label('Port:'))
-        self._ports = [] # Actual port names for connecting
-        ports       = [] # Pretty port names for combo box
-        if _comports:
-            for p in _comports():
-                self._ports.append(p.device)
-                ports      .append(p.description)
-        
-        # Append simulation port
-        ports      .append('Simulation')
-        self._ports.append('Simulation')
-        
-        # Append refresh port
-        ports      .append('Refresh - Update Ports List')
-        self._ports.append('Refresh - Update Ports List')
-        
-        self.combo_ports = self.grid_top.add(_g.ComboBox(ports, autosettings_path=name+'.combo_ports'))
-        self.combo_ports.signal_changed.connect(self._ports_changed)
+        # GUI stuff. Controls created in the settings cache's scope have their
+        # settings loaded and saved by it.
+        with self.settings_cache:
+            self.window   = _g.Window(
+                self.name, size=window_size, autosettings_path=name+'.window',
+                event_close = self._window_close)
+            
+            # Top of GUI (Serial Communications)
+            self.grid_top = self.window.place_object(_g.GridLayout(margins=False), alignment=0)
+            self.window.new_autorow()
+            self.grid_bot = self.window.place_object(_g.GridLayout(margins=False), alignment=0)
+
+            # Start with the ports found last time; the real list is filled in
+            # by a background scan (see _ports_tick()), since enumerating USB
+            # devices can take seconds.
+            self._label_port = self.grid_top.add(_g.Label('Port:'))
+            self.port_scanner = port_scanner(_os.path.join(_g.get_egg_settings_path(), 'serial_ports.json'))
+            self._ports = [p[0] for p in self.port_scanner.ports] + [_simulation_port, _refresh_port] # Actual port names for connecting
+            ports       = [p[1] for p in self.port_scanner.ports] + [_simulation_port, _refresh_port] # Pretty port names for combo box
+            
+            self.combo_ports = self.grid_top.add(_g.ComboBox(ports, autosettings_path=name+'.combo_ports'))
+            self.combo_ports.set_index(self.port_scanner.get_default())
+            self.combo_ports.signal_changed.connect(self._ports_changed)
 
-        self.grid_top.add(_g.Label('Address:')).show(hide_address)
-        self.number_address = self.grid_top.add(_g.NumberBox(
-            1, 1, int=True,
-            autosettings_path=name+'.number_address',
-            tip='Address (not used for every instrument)')).set_width(40).show(hide_address)
+            self.grid_top.add(_g.Label('Address:')).show(hide_address)
+            self.number_address = self.grid_top.add(_g.NumberBox(
+                1, 1, int=True,
+                autosettings_path=name+'.number_address',
+                tip='Address (not used for every instrument)')).set_width(40).show(hide_address)
 
-        self.grid_top.add(_g.Label('Baud:'))
-        self.combo_baudrates = self.grid_top.add(_g.ComboBox(
-            ['1200', '2400', '4800', '9600', '19200', '115200'],
-            default_index=5,
-            autosettings_path=name+'.combo_baudrates'))
+            self.grid_top.add(_g.Label('Baud:'))
+            self.combo_baudrates = self.grid_top.add(_g.ComboBox(
+                ['1200', '2400', '4800', '9600', '19200', '115200'],
+                default_index=5,
+                autosettings_path=name+'.combo_baudrates'))
 
-        self.grid_top.add(_g.Label('Timeout:'))
-        self.number_timeout = self.grid_top.add(_g.NumberBox(50, dec=True, bounds=(1, None), suffix=' ms', tip='How long to wait for an answer before giving up (ms).', autosettings_path=name+'.number_timeout')).set_width(100)
+            self.grid_top.add(_g.Label('Timeout:'))
+            self.number_timeout = self.grid_top.add(_g.NumberBox(50, dec=True, bounds=(1, None), suffix=' ms', tip='How long to wait for an answer before giving up (ms).', autosettings_path=name+'.number_timeout')).set_width(100)
 
-        # Button to connect
-        self.button_connect  = self.grid_top.add(_g.Button('Connect', checkable=True))
+            # Button to connect
+            self.button_connect  = self.grid_top.add(_g.Button('Connect', checkable=True))
 
-        # Stretch remaining space
-        self.grid_top.set_column_stretch(self.grid_top._auto_column)
+            # Stretch remaining space
+            self.grid_top.set_column_stretch(self.grid_top._auto_column)
 
-        # Connect signals
-        self.button_connect.signal_toggled.connect(self._button_connect_toggled)
-        
-        # Status
-        self.label_status = self.grid_top.add(_g.Label(''))
+            # Connect signals
+            self.button_connect.signal_toggled.connect(self._button_connect_toggled)
+            
+            # Status
+            self.label_status = self.grid_top.add(_g.Label(''))
 
-        # Expand the bottom grid
-        self.window.set_row_stretch(1)
-        
-        # Error
-        self.grid_top.new_autorow()
-        self.label_message = self.grid_top.add(_g.Label(''), column_span=10).set_colors('pink')
-        
+            # Expand the bottom grid
+            self.window.set_row_stretch(1)
+            
+            # Error
+            self.grid_top.new_autorow()
+            self.label_message = self.grid_top.add(_g.Label(''), column_span=10).set_colors('pink')
+            
         # By default the bottom grid is disabled
         self.grid_bot.disable()
 
         # Other data
         self.t0 = None
+        
+        # Connecting happens in a worker thread; this timer watches for it to
+        # finish without blocking the GUI.
+        self._connect_thread = None
+        self._connect_result = None
+        self._timer_connect  = _g.Timer(interval_ms=50, single_shot=False, signal_tick=self._connect_tick)
+
+        # Watches for the port scan to finish
+        self._timer_ports = _g.Timer(interval_ms=100, single_shot=False, signal_tick=self._ports_tick)
 
         # Run the base object stuff and autoload settings
         _g.BaseObject.__init__(self, autosettings_path=name)
+        
+        # Look for the real ports
+        self.port_scanner.scan()
+        self._timer_ports.start()
 
         # Show the window.
         if show: self.window.show(block)
     
     def _ports_changed(self):
         """
-        Refreshes the list of availible serial ports in the GUI.
+        Starts a new port scan when Refresh is selected.
+        """
+        if self.get_selected_port() == _refresh_port:
+            self.port_scanner.scan()
+            self._timer_ports.start()
+    
+    def _ports_tick(self):
+        """
+        Called by the port timer until the scan finishes, then refreshes the
+        list of available serial ports in the GUI. The selected port is kept
+        if it is still there; otherwise the last port used (or an Arduino)
+        is selected.
         """
+        if self.port_scanner.scanning: return
+        self._timer_ports.stop()
         
-        if self.get_selected_port() == 'Refresh - Update Ports List':
-            
-            len_ports = len(self.combo_ports.get_all_items())
-            
-            # Clear existing ports
-            if(len_ports > 1): # Stop recursion!
-                for n in range(len_ports):
-                    self.combo_ports.remove_item(0)
-            else:
-                return
-                self.combo_ports.remove_item(0)
-                 
-            self._ports = [] # Actual port names for connecting
-            ports       = [] # Pretty port names for combo box
-                
-            default_port = 0
-             
-            # Get all the available ports
-            if _comports:
-                for inx, p in enumerate(_comports()):
-                    self._ports.append(p.device)
-                    ports      .append(p.description)
-                    
-                    if 'Arduino' in p.description:
-                        default_port = inx
-                        
-            # Append simulation port
-            ports      .append('Simulation')
-            self._ports.append('Simulation')
-            
-            # Append refresh port
-            ports      .append('Refresh - Update Ports List')
-            self._ports.append('Refresh - Update Ports List')
-             
-            # Add the new list of ports
-            for item in ports:
-                self.combo_ports.add_item(item)
-             
-            # Set the new default port
-            self.combo_ports.set_index(default_port)
+        selected = self.get_selected_port()
+        
+        self._ports = [p[0] for p in self.port_scanner.ports] + [_simulation_port, _refresh_port] # Actual port names for connecting
+        ports       = [p[1] for p in self.port_scanner.ports] + [_simulation_port, _refresh_port] # Pretty port names for combo box
+        
+        # Replace the list without triggering _ports_changed()
+        self.combo_ports.block_signals()
+        self.combo_ports.clear()
+        for item in ports: self.combo_ports.add_item(item)
+        
+        if selected in self._ports[:-1]: self.combo_ports.set_index(self._ports.index(selected))
+        else:                            self.combo_ports.set_index(self.port_scanner.get_default())
+        self.combo_ports.unblock_signals()
     
     def _button_connect_toggled(self, *a):
         """
@@ -172,40 +176,32 @@ class serial_gui_base(_g.BaseObject):
         if self._api_class is None:
             raise Exception('You need to specify an api_class when creating a serial GUI object.')
 
-        # If we checked it, open the connection and start the timer.
+        # If we checked it, open the connection in the background.
         if self.button_connect.is_checked():
-            port = self.get_selected_port()
-            self.api = self._api_class(
-                    port=port,
+            
+            # Read the settings here, in the GUI thread.
+            kwargs = dict(
+                    port=self.get_selected_port(),
                     address=self.number_address.get_value(),
                     baudrate=int(self.combo_baudrates.get_text()),
                     timeout=self.number_timeout.get_value())
+            self._before_open_api()
             
-            # Delay to give the Arduino time to run setup
-            _time.sleep(2)
-
-            # Record the time if it's not already there.
-            if self.t0 is None: self.t0 = _time.time()
-
-            # Enable the grid
-            self.grid_bot.enable()
-
-            # Disable serial controls
+            # Disable serial controls while we wait
             self.combo_baudrates.disable()
             self.combo_ports    .disable()
             self.number_timeout .disable()
+            self.button_connect .disable()
+            self.button_connect.set_text('Connecting...').set_colors(background='')
             
-            if self.api.simulation_mode:
-                #self.label_status.set_text('*** Simulation Mode ***')
-                #self.label_status.set_colors('pink' if _s.settings['dark_theme_qt'] else 'red')
-                self.combo_ports.set_value(len(self._ports)-2)
-                self.button_connect.set_text("Simulation").set_colors(background='pink')
-            else:
-                self.button_connect.set_text('Disconnect').set_colors(background = 'blue')
+            self._connect_result = None
+            self._connect_thread = _threading.Thread(target=self._connect_worker, kwargs=kwargs, daemon=True)
+            self._connect_thread.start()
+            self._timer_connect.start()
 
         # Otherwise, shut it down
         else:
-            self.api.disconnect()
+            self._close_api()
             #self.label_status.set_text('')
             self.button_connect.set_colors()
             self.grid_bot.disable()
@@ -217,10 +213,86 @@ class serial_gui_base(_g.BaseObject):
             
             self.button_connect.set_text('Connect').set_colors(background = '')
 
+            # User function
+            self._after_button_connect_toggled()
+
+    def _connect_worker(self, **kwargs):
+        """
+        Runs in the connect thread. Stores the api, or the exception raised
+        while creating it, for _connect_tick().
+        """
+        try:                   self._connect_result = self._open_api(**kwargs)
+        except Exception as e: self._connect_result = e
+
+    def _connect_tick(self):
+        """
+        Called by the connect timer until the connect thread finishes, then
+        finishes connecting (or gives up) in the GUI thread.
+        """
+        if self._connect_thread.is_alive(): return
+        self._timer_connect.stop()
+        self.button_connect.enable()
+        
+        # Failed; go back to the disconnected state.
+        if isinstance(self._connect_result, Exception):
+            self.label_message.set_text('Could not connect: '+str(self._connect_result)).set_colors('red')
+            self.combo_baudrates.enable()
+            self.combo_ports    .enable()
+            self.number_timeout .enable()
+            self.button_connect.set_checked(False, block_signals=True)
+            self.button_connect.set_text('Connect').set_colors(background = '')
+            self._after_button_connect_toggled()
+            return
+        
+        self.api = self._connect_result
+        self.label_message.set_text('')
+
+        # Record the time if it's not already there.
+        if self.t0 is None: self.t0 = _time.time()
+
+        # Enable the grid
+        self.grid_bot.enable()
+        
+        if self.api.simulation_mode:
+            #self.label_status.set_text('*** Simulation Mode ***')
+            #self.label_status.set_colors('pink' if _s.settings['dark_theme_qt'] else 'red')
+            self.combo_ports.set_value(self._ports.index(_simulation_port))
+            self.button_connect.set_text("Simulation").set_colors(background='pink')
+        else:
+            self.button_connect.set_text('Disconnect').set_colors(background = 'blue')
+            self.port_scanner.set_preferred(self.get_selected_port())
 
         # User function
         self._after_button_connect_toggled()
 
+    def _before_open_api(self):
+        """
+        Dummy function called in the GUI thread just before _open_api() is
+        called in the connect thread. Use it to read anything else _open_api()
+        needs from the GUI.
+        """
+        return
+
+    def _open_api(self, port, address, baudrate, timeout):
+        """
+        Creates and returns the api instance. Runs in the connect thread, so
+        it must not touch the GUI. Overload this to connect some other way.
+        """
+        api = self._api_class(port=port, address=address, baudrate=baudrate, timeout=timeout)
+        
+        # Give the Arduino time to run setup, returning early if the api can
+        # tell when it is ready.
+        if hasattr(api, 'wait_ready'): api.wait_ready(2)
+        else:                          _time.sleep(2)
+        
+        return api
+    
+    def _close_api(self):
+        """
+        Disconnects the api instance. Overload this to disconnect some other way.
+        """
+        self.api.disconnect()
+
     def _after_button_connect_toggled(self):
         """
         Dummy function called after connecting.
@@ -238,6 +310,7 @@ class serial_gui_base(_g.BaseObject):
         Disconnects. When you close the window.
         """
         print('Window closed but not destroyed. Use show() to bring it back.')
+        self.settings_cache.flush()
         if self.button_connect():
             print('  Disconnecting...')
             self.button_connect(False)
@@ -246,20 +319,20 @@ class serial_gui_base(_g.BaseObject):
         """
         Returns the actual port string from the combo box.
         """
-        return self._ports[self.combo_ports.get_index()]
+        n = self.combo_ports.get_index()
+        return self._ports[n] if 0 <= n < len(self._ports) else None
     
     def get_com_ports():
         """
         Returns a dictionary of port names as keys and descriptive names as values.
         """
-        if _comports:
-    
-            ports = dict()
-            for p in _comports(): ports[p.device] = p.description
-            return ports
-    
-        else:
+        try: from serial.tools.list_ports import comports
+        except ImportError:
             raise Exception('You need to install pyserial and have Windows to use get_com_ports().')
+        
+        ports = dict()
+        for p in comports(): ports[p.device] = p.description
+        return ports
             
     def list_com_ports():
         """
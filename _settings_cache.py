@@ -0,0 +1,193 @@
+import ast         as _ast
+import atexit      as _atexit
+import os          as _os
+import types       as _types
+import spinmob     as _s
+import spinmob.egg as _egg
+
+_g = _egg.gui
+
+# egg's own methods, and the caches whose scope (see settings_cache.__enter__)
+# is open
+_original_save = _g.BaseObject.save_gui_settings
+_original_load = _g.BaseObject.load_gui_settings
+_active        = []
+
+
+class settings_cache():
+    """
+    In-memory store for the autosettings of every egg object whose
+    autosettings_path is prefix or starts with prefix+'.'. Normally each
+    such object reads its own settings file when created and rewrites it on
+    every change. Instead, they are all loaded from one file when the cache
+    is created, and written back together, flush_interval after the last
+    change (and on exit).
+    
+    Only objects created inside the cache's scope are cached, e.g.
+    
+        with cache: self.button = _g.Button('Go', autosettings_path=name+'.button')
+    
+    Everything else, including other windows' objects, keeps egg's usual
+    behavior.
+    
+    Settings files written by egg before the cache existed are read once
+    and folded in, as are the settings of paths that have been renamed
+    (see aliases).
+    
+    Parameters
+    ----------
+    prefix : str
+        Autosettings path prefix of the objects to cache, normally the name
+        of the window.
+    
+    flush_interval=2 : float
+        Time to wait after a change before writing (s).
+    """
+    def __init__(self, prefix, flush_interval=2):
+        
+        self.prefix = prefix
+        self.path   = _os.path.join(_g.get_egg_settings_path(), prefix+'.settings')
+        self.dirty  = False
+        
+        # New autosettings path: old one, whose settings it starts from if it
+        # has none of its own
+        self.aliases = dict()
+        
+        # Autosettings path: header dictionary
+        self.settings = dict()
+        if _os.path.exists(self.path):
+            try:
+                with open(self.path) as f: self.settings = _ast.literal_eval(f.read())
+            except (ValueError, SyntaxError, OSError) as e: print('Could not read '+self.path+':', e)
+        
+        self._timer_flush = _g.Timer(interval_ms=int(flush_interval*1000), single_shot=True, signal_tick=self.flush)
+        
+        _atexit.register(self.flush)
+    
+    def __enter__(self):
+        """
+        Opens the scope in which new egg objects owned by this cache are
+        adopted (see adopt()). egg's methods are only swapped while a scope
+        is open.
+        """
+        if not _active:
+            _g.BaseObject.save_gui_settings = _save_gui_settings
+            _g.BaseObject.load_gui_settings = _load_gui_settings
+        _active.append(self)
+        return self
+    
+    def __exit__(self, *a):
+        """
+        Closes the scope, restoring egg's methods once no scope is open.
+        """
+        _active.remove(self)
+        if not _active:
+            _g.BaseObject.save_gui_settings = _original_save
+            _g.BaseObject.load_gui_settings = _original_load
+    
+    def adopt(self, obj):
+        """
+        Routes the egg object's settings through this cache from now on.
+        Objects created inside the scope are adopted automatically, as they
+        load their settings.
+        """
+        obj._settings_cache   = self
+        obj.save_gui_settings = _types.MethodType(_save_gui_settings, obj)
+        obj.load_gui_settings = _types.MethodType(_load_gui_settings, obj)
+        return obj
+    
+    def owns(self, path):
+        """
+        Returns True if the autosettings path belongs to this cache.
+        """
+        return path == self.prefix or path.startswith(self.prefix+'.')
+    
+    def get(self, path):
+        """
+        Returns the settings (header dictionary) stored for path, or None.
+        """
+        if path not in self.settings:
+            
+            # Fold in a file written by plain egg
+            legacy = _os.path.join(_g.get_egg_settings_path(), path)
+            if _os.path.exists(legacy):
+                d = _s.data.databox(delimiter=',')
+                d.load_file(legacy, header_only=True, quiet=True)
+                self.set(path, d.headers)
+            
+            # Or start from the settings it had under its old name
+            elif path in self.aliases and self.get(self.aliases[path]) is not None:
+                self.set(path, self.settings[self.aliases[path]])
+            
+            else: return None
+        
+        return self.settings[path]
+    
+    def set(self, path, headers):
+        """
+        Stores the settings for path, to be written on the next flush.
+        """
+        # Plain Python values only, so the file can be read back safely
+        headers = {k: (v.item() if hasattr(v, 'item') else v) for k, v in headers.items()}
+        if self.settings.get(path) == headers: return
+        
+        self.settings[path] = headers
+        self.dirty = True
+        self._timer_flush.start()
+    
+    def flush(self, *a):
+        """
+        Writes the settings, if anything has changed.
+        """
+        if not self.dirty: return
+        
+        _os.makedirs(_os.path.dirname(self.path), exist_ok=True)
+        with open(self.path+'.tmp', 'w') as f: f.write(repr(self.settings))
+        _os.replace(self.path+'.tmp', self.path)
+        self.dirty = False
+
+
+def _find(obj):
+    """
+    Returns the cache of the egg object, adopting it if it belongs to a cache
+    whose scope is open, or None.
+    """
+    cache = obj.__dict__.get('_settings_cache')
+    if cache is not None or not obj._autosettings_path: return cache
+    for cache in _active:
+        if cache.owns(obj._autosettings_path): return cache.adopt(obj)._settings_cache
+    return None
+
+def _save_gui_settings(self, *a):
+    """
+    Replacement for egg's BaseObject.save_gui_settings() that stores the
+    settings in the object's cache.
+    """
+    cache = _find(self)
+    if cache is None: return _original_save(self, *a)
+    
+    # Same contents egg would write
+    d = _s.data.databox(delimiter=',')
+    for x in self._autosettings_controls: self._store_gui_setting(d, x)
+    d.h(_autosettings_standard_items=list(d.hkeys))
+    self._additional_save_gui_settings(d)
+    
+    cache.set(self._autosettings_path, d.headers)
+
+def _load_gui_settings(self, lazy_only=False):
+    """
+    Replacement for egg's BaseObject.load_gui_settings() that reads the
+    settings from the object's cache.
+    """
+    cache = _find(self)
+    if cache is None: return _original_load(self, lazy_only)
+    
+    headers = cache.get(self._autosettings_path)
+    if headers is None: return
+    
+    headers = dict(headers)
+    self._autosettings_standard_items = headers.pop('_autosettings_standard_items', None) or list(headers)
+    self._lazy_load.update(headers)
+    
+    if not lazy_only:
+        for x in self._autosettings_controls: self._load_gui_setting(x)
@@ -0,0 +1,259 @@
+import json      as _json
+import selectors as _selectors
+import socket    as _socket
+import threading as _threading
+
+from collections import deque as _deque
+
+
+class telemetry_client():
+    """
+    One connection to a telemetry_server, with its bounded queue of
+    outgoing lines.
+    """
+    def __init__(self, sock, address, queue_size):
+        
+        self.sock    = sock
+        self.address = address
+        self.lines   = _deque(maxlen=queue_size) # Samples waiting to go out; oldest dropped
+        self.replies = _deque()                  # Replies to requests, sent first
+        self.out     = b''                       # Partly sent data
+        self.incoming = b''                      # Partly received request
+        self.dropped = 0                         # Samples lost to a full queue
+        self.writing = False                     # Whether registered for writing
+
+
+class telemetry_server():
+    """
+    Publishes the sample stream of a controller_engine over TCP, so other
+    machines can watch, and takes parameter changes back.
+    
+    The protocol is one JSON object per line in each direction. Every sample
+    is sent as
+    
+        {"type": "sample", "t": 12.5, "T0": 25.1, "Output0": 3.0, ...}
+    
+    (keys from the engine's schema.fields, null for gaps in the telemetry). Requests are
+    
+        {"cmd": "get"}
+        {"cmd": "set", "parameters": {"setpoint_0": 80, "rate_0": 0.5}}
+    
+    and both are answered with the parameters and the message sent to the
+    Arduino (see channel_schema.encode_parameters()), or with {"type": "error", ...}.
+    A set with any invalid value (see controller_engine.check_parameters())
+    changes nothing.
+    
+    Everything runs in one thread. The acquisition side only queues each
+    block for it (see publish()), so the number or speed of clients never
+    holds acquisition up. Each client has its own queue of queue_size
+    lines; if a client can't keep up, its oldest lines are dropped.
+    
+    Parameters
+    ----------
+    engine : controller_engine
+        Engine whose samples to publish and whose parameters to change.
+    
+    host='127.0.0.1' : str
+        Address to listen on. Use '' for every interface.
+    
+    port=5025 : int
+        Port to listen on.
+    
+    queue_size=10000 : int
+        Lines held for each client before the oldest are dropped.
+    """
+    def __init__(self, engine, host='127.0.0.1', port=5025, queue_size=10000):
+        
+        self.engine     = engine
+        self.host       = host
+        self.port       = port
+        self.queue_size = queue_size
+        
+        self.clients   = []
+        self._inbox    = _deque() # Blocks from publish(), for the server thread
+        self._selector = None
+        self._listener = None
+        self._thread   = None
+        self._running  = False
+    
+    def start(self):
+        """
+        Starts listening, and subscribes to the engine's samples.
+        """
+        if self._running: return
+        
+        self._listener = _socket.create_server((self.host, self.port))
+        self._listener.setblocking(False)
+        
+        # Wakes the server thread when there is something to publish
+        self._wake_r, self._wake_w = _socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        
+        self._selector = _selectors.DefaultSelector()
+        self._selector.register(self._listener, _selectors.EVENT_READ)
+        self._selector.register(self._wake_r,   _selectors.EVENT_READ)
+        
+        self._running = True
+        self._thread  = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        
+        self.engine.listeners.append(self.publish)
+    
+    def stop(self):
+        """
+        Disconnects every client and stops listening.
+        """
+        if not self._running: return
+        
+        if self.publish in self.engine.listeners: self.engine.listeners.remove(self.publish)
+        self._running = False
+        self._wake()
+        self._thread.join()
+        
+        for client in list(self.clients): self._drop(client)
+        self._selector.close()
+        self._listener.close()
+        self._wake_r.close()
+        self._wake_w.close()
+    
+    def publish(self, t, data):
+        """
+        Queues a block of samples for every client. Called by the engine for
+        every block it appends; costs one deque append.
+        """
+        if not self.clients: return
+        self._inbox.append((t, data))
+        self._wake()
+    
+    def _wake(self):
+        """
+        Interrupts the server thread's select().
+        """
+        try: self._wake_w.send(b'x')
+        except (BlockingIOError, OSError): pass # Already awake
+    
+    def _run(self):
+        """
+        Runs in the server thread.
+        """
+        while self._running:
+            for key, events in self._selector.select():
+                
+                if   key.fileobj is self._listener: self._accept()
+                elif key.fileobj is self._wake_r:
+                    try: self._wake_r.recv(4096)
+                    except BlockingIOError: pass
+                
+                else:
+                    client = key.data
+                    if events & _selectors.EVENT_READ:  self._receive(client)
+                    if events & _selectors.EVENT_WRITE and client in self.clients: self._send(client)
+            
+            self._fan_out()
+    
+    def _accept(self):
+        """
+        Takes a new client.
+        """
+        try: sock, address = self._listener.accept()
+        except BlockingIOError: return
+        
+        sock.setblocking(False)
+        client = telemetry_client(sock, address, self.queue_size)
+        self.clients.append(client)
+        self._selector.register(sock, _selectors.EVENT_READ, client)
+    
+    def _drop(self, client):
+        """
+        Forgets a client that left (or is being kicked).
+        """
+        if client in self.clients: self.clients.remove(client)
+        try: self._selector.unregister(client.sock)
+        except (KeyError, ValueError): pass
+        client.sock.close()
+    
+    def _fan_out(self):
+        """
+        Encodes the published blocks once and queues the lines for every client.
+        """
+        if not self._inbox: return
+        
+        keys  = self.engine.schema.fields
+        lines = []
+        while self._inbox:
+            t, data = self._inbox.popleft()
+            for n in range(len(t)):
+                sample = dict(type='sample', t=float(t[n]))
+                for key, x in zip(keys, data[n].tolist()): sample[key] = x if x == x else None
+                lines.append((_json.dumps(sample)+'\n').encode())
+        
+        for client in self.clients:
+            overflow = len(client.lines) + len(lines) - self.queue_size
+            if overflow > 0: client.dropped += overflow
+            client.lines.extend(lines)
+            self._want_write(client)
+    
+    def _want_write(self, client):
+        """
+        Makes sure the selector tells us when the client can take more.
+        """
+        if client.writing: return
+        client.writing = True
+        self._selector.modify(client.sock, _selectors.EVENT_READ | _selectors.EVENT_WRITE, client)
+    
+    def _send(self, client):
+        """
+        Sends as much as the client will take.
+        """
+        if not client.out:
+            chunks = []
+            while client.replies:                      chunks.append(client.replies.popleft())
+            while client.lines and len(chunks) < 1000: chunks.append(client.lines.popleft())
+            client.out = b''.join(chunks)
+        
+        # Nothing left; stop asking
+        if not client.out:
+            client.writing = False
+            self._selector.modify(client.sock, _selectors.EVENT_READ, client)
+            return
+        
+        try: n = client.sock.send(client.out)
+        except BlockingIOError: return
+        except OSError: return self._drop(client)
+        
+        client.out = client.out[n:]
+    
+    def _receive(self, client):
+        """
+        Reads requests from the client and answers complete ones.
+        """
+        try: data = client.sock.recv(4096)
+        except BlockingIOError: return
+        except OSError: data = b''
+        
+        if not data: return self._drop(client)
+        
+        client.incoming += data
+        *requests, client.incoming = client.incoming.split(b'\n')
+        for request in requests:
+            if not request.strip(): continue
+            client.replies.append((_json.dumps(self._handle(request))+'\n').encode())
+        
+        if client.replies: self._want_write(client)
+    
+    def _handle(self, request):
+        """
+        Carries out one request and returns the reply.
+        """
+        try:
+            request = _json.loads(request)
+            cmd     = request.get('cmd')
+            
+            if cmd == 'set': self.engine.set_parameters(**request.get('parameters', {}))
+            elif cmd != 'get': raise Exception('Unknown command '+repr(cmd)+'.')
+            
+            parameters = dict(self.engine.parameters)
+            return dict(type='parameters', parameters=parameters, message=self.engine.schema.encode_parameters(parameters))
+        
+        except Exception as e: return dict(type='error', error=str(e))
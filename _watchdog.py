@@ -0,0 +1,252 @@
+import numpy     as _n
+import os        as _os
+import threading as _threading
+import time      as _time
+
+
+class watchdog():
+    """
+    Host-side safety cutoff. Watches the measured temperatures of every
+    channel and, as soon as a rule trips, sends a safe parameter frame (all
+    setpoints zero) straight from the thread that decoded the offending
+    samples, without waiting for the GUI or poll().
+
+    The rules are
+
+        limit : a temperature is above its limit.
+        rate  : a temperature rose faster than rate_limit, measured over
+                rate_window so the noise does not trip it.
+        stale : no telemetry for stale_timeout while connected.
+
+    The watchdog registers itself in engine.watchers, which the engine
+    hands to its api on connect, so feed() runs on the api's reader thread
+    for every decoded block. check() catches stale data, and is called by
+    the reader thread between reads and by the engine's poll() (the reader
+    thread is busy reconnecting while the link is down).
+
+    Every trip is recorded in self.trips, printed, and written to
+    watchdog.txt in the engine's log directory, with its latency: the time
+    from the offending sample's time stamp (see arduino_api.get_samples(),
+    or the moment the data went stale) to the safe frame being written. The trip latches until reset();
+    while latched, any setpoint raised again is zeroed again.
+
+    Parameters
+    ----------
+    engine : controller_engine
+        Engine to watch and to send the safe frame through.
+
+    limit=None : float or list
+        Highest allowed temperature (C), for every temperature field or one
+        per field (see schema.temperature_fields). None disables the rule.
+
+    rate_limit=None : float or list
+        Fastest allowed rise (C/s), as for limit. None disables the rule.
+
+    rate_window=2 : float
+        Time over which the rise is measured (s).
+
+    stale_timeout=5 : float
+        Longest allowed silence (s). None disables the rule.
+    
+    Functions appended to self.callbacks are called with each trip record,
+    on the thread that tripped, e.g. to stop a running recipe.
+    """
+    def __init__(self, engine, limit=None, rate_limit=None, rate_window=2, stale_timeout=5):
+
+        self.engine        = engine
+        self.rate_window   = rate_window
+        self.stale_timeout = stale_timeout
+
+        # Per-field thresholds, with disabled rules at infinity
+        fields = engine.schema.temperature_fields
+        self._fields     = _n.array(fields)
+        self._names      = [engine.schema.fields[i] for i in fields]
+        self.limit       = _n.broadcast_to(_n.inf if limit      is None else _n.array(limit,      float), len(fields)).copy()
+        self.rate_limit  = _n.broadcast_to(_n.inf if rate_limit is None else _n.array(rate_limit, float), len(fields)).copy()
+
+        # Trip records, and whether one is latched
+        self.trips     = []
+        self.tripped   = False
+        self.callbacks = []
+
+        # feed() and check() run on different threads
+        self._lock = _threading.Lock()
+        self.reset()
+
+        engine.watchers.append(self)
+
+    def reset(self):
+        """
+        Releases a latched trip and forgets the recent samples, e.g. on
+        (re)connecting. Stale data is timed from now.
+        """
+        with self._lock:
+            self.tripped = False
+            self._t_last = _time.monotonic()
+            self._t      = _n.zeros(0)
+            self._T      = _n.zeros((0, len(self._fields)))
+
+    def feed(self, t, data):
+        """
+        Evaluates the limit and rate rules on a block of freshly decoded
+        samples.
+
+        Parameters
+        ----------
+        t : array
+            Time of each sample (s, from time.monotonic()).
+
+        data : array
+            One row of telemetry fields per sample.
+        """
+        t_start = self.engine.perf.start()
+
+        # Gap markers are not telemetry
+        good = _n.isfinite(data[:,0])
+        if not good.any(): return
+        t, T = t[good], data[good][:, self._fields]
+
+        with self._lock:
+            self._t_last = t[-1]
+
+            # Temperatures over their limits
+            over = T > self.limit
+            if over.any():
+                i, j = _n.argwhere(over)[0]
+                self._trip('limit', j, T[i,j], t[i])
+
+            # Rise over the window, against the newest sample at least
+            # rate_window older. Only the history the next block needs is kept.
+            self._t = _n.concatenate((self._t, t))
+            self._T = _n.concatenate((self._T, T))
+            if _n.isfinite(self.rate_limit).any():
+                n    = len(self._t) - len(t)
+                ref  = _n.searchsorted(self._t, self._t[n:] - self.rate_window, 'right') - 1
+                ok   = ref >= 0
+                if ok.any():
+                    rate = (self._T[n:][ok] - self._T[ref[ok]]) / (self._t[n:][ok] - self._t[ref[ok]])[:,None]
+                    fast = rate > self.rate_limit
+                    if fast.any():
+                        i, j = _n.argwhere(fast)[0]
+                        self._trip('rate', j, rate[i,j], self._t[n:][ok][i])
+
+            keep = _n.searchsorted(self._t, self._t[-1] - self.rate_window, 'right') - 1
+            if keep > 0: self._t, self._T = self._t[keep:], self._T[keep:]
+
+        self.engine.perf.stop('watchdog', t_start, len(t))
+
+    def check(self, now=None):
+        """
+        Evaluates the stale data rule. Safe to call from any thread.
+        """
+        if self.stale_timeout is None or self.engine.api is None: return
+        if now is None: now = _time.monotonic()
+
+        with self._lock:
+            if now - self._t_last > self.stale_timeout:
+                self._trip('stale', None, now-self._t_last, self._t_last+self.stale_timeout)
+
+    def _trip(self, rule, field, value, t_cause):
+        """
+        Zeroes the setpoints, sending them right away, and records the trip.
+        Called with the lock held.
+        """
+        # Holding the engine's write lock until the callbacks have run means
+        # nothing (e.g. a profile segment that was already due) can raise the
+        # setpoints between the safe frame and a callback stopping its source.
+        with self.engine._write_lock: self._trip_locked(rule, field, value, t_cause)
+
+    def _trip_locked(self, rule, field, value, t_cause):
+        """
+        Does the work of _trip(), with the engine's write lock held.
+        """
+        engine = self.engine
+        safe   = {key: 0 for key in engine.parameters if key.startswith('setpoint_')}
+
+        # Already latched, and still safe: nothing to do
+        if self.tripped and all(engine.parameters[key] == 0 for key in safe): return
+
+        engine.apply_parameters(**safe)
+        t_sent = _time.monotonic()
+
+        # Only the first trip of a latch is recorded
+        if self.tripped: return
+        self.tripped = True
+
+        trip = dict(t=_time.time(), rule=rule, channel=None if field is None else self._names[field], value=float(value), latency=float(t_sent-t_cause))
+        self.trips.append(trip)
+
+        line = '%s watchdog trip: %s %s %.3f, latency %.1f ms' % (
+            _time.strftime('%Y-%m-%d %H:%M:%S', _time.localtime(trip['t'])), rule, trip['channel'] or '', value, 1e3*trip['latency'])
+        print(line)
+
+        logger = engine.logger
+        if logger is not None and logger.store is not None:
+            with open(_os.path.join(logger.store.path, 'watchdog.txt'), 'a') as f: f.write(line+'\n')
+        
+        for callback in self.callbacks: callback(trip)
+
+
+def self_test(speed=50, rate=50, timeout=10):
+    """
+    Trips each rule against the simulator and checks that the safe frame
+    reaches it.
+
+    Parameters
+    ----------
+    speed=50 : float
+        Simulated seconds per real second.
+
+    rate=50 : float
+        Samples per second of real time.
+
+    timeout=10 : float
+        Longest time to wait for each trip (s).
+
+    Returns
+    -------
+    List of the trip records, one per rule (see watchdog.trips).
+    """
+    from _controller_engine  import controller_engine
+    from _arduino_simulator  import arduino_simulator
+
+    trips = []
+    for rule in ['limit', 'rate', 'stale']:
+
+        engine    = controller_engine(log_path=None)
+        simulator = arduino_simulator(rate=rate, speed=speed, noise=0)
+        w = watchdog(engine,
+                     limit         = 30    if rule == 'limit' else None,
+                     rate_limit    = 0.05  if rule == 'rate'  else None,
+                     stale_timeout = 0.5   if rule == 'stale' else None)
+
+        # Heat toward a setpoint above the limit
+        engine.parameters.update(setpoint_0=100, rate_0=10)
+        engine.connect('Simulation', simulator=simulator)
+        w.reset()
+
+        # Silence the device for the stale rule
+        if rule == 'stale':
+            _time.sleep(0.2)
+            simulator.running = False
+
+        t_give_up = _time.time() + timeout
+        while not w.trips and _time.time() < t_give_up:
+            engine.poll()
+            _time.sleep(0.05)
+
+        # The safe frame should have reached the simulator (once it runs again)
+        simulator.running = True
+        engine.poll()
+        engine.disconnect()
+
+        if not w.trips: raise Exception('The '+rule+' rule did not trip.')
+        if w.trips[0]['rule'] != rule: raise Exception('Expected a '+rule+' trip, got '+repr(w.trips[0])+'.')
+        if simulator.setpoint[0] != 0: raise Exception('The safe frame did not reach the simulator after a '+rule+' trip.')
+        trips.append(w.trips[0])
+
+    return trips
+
+
+if __name__ == '__main__':
+    for trip in self_test(): print('%-6s passed, latency %.2f ms' % (trip['rule'], 1e3*trip['latency']))
@@ -0,0 +1,317 @@
+"""
+Throughput and latency benchmarks for the acquisition pipeline.
+
+A synthetic firmware writes telemetry into one end of a pseudo-terminal
+pair (or a pyserial loop:// port where there are no ptys), and the real
+arduino_api / controller_engine reads the other end. The sample thermocouple
+field carries a sequence number, so every sample can be matched to the time
+it was sent. Latencies end when engine.poll() hands back the stored
+sample; redrawing the plots is not included.
+
+Run "python benchmark.py -h" for the options.
+"""
+import numpy     as _n
+import os        as _os
+import shutil    as _shutil
+import tempfile  as _tempfile
+import threading as _threading
+import time      as _time
+import tracemalloc as _tracemalloc
+
+from _arduino_api       import packet_decoder, binary_decoder, encode_binary_frame, _binary_request, _binary_sync
+from _controller_engine import controller_engine
+
+# Sequence numbers go in the sample thermocouple field
+_seq_field = 8
+
+
+def synthetic_packet(seq, binary=False):
+    """
+    Returns one telemetry packet with the sequence number in the sample field.
+    """
+    fields = [20+seq%50, 50.0, 12.5, 3.25, 21+seq%50, 40.0, 11.5, 2.25, seq%65536]
+    if binary: return encode_binary_frame(seq, fields)
+    return b''.join(b'%.2f\r\n' % x for x in fields)
+
+
+def bench_decoder(count=100000, binary=False, chunk=256):
+    """
+    Measures the CPU time the decoder spends per sample on a prepared
+    stream, written chunk bytes at a time into its receive buffer as the
+    port would, and then the memory it allocates doing so.
+    
+    Returns
+    -------
+    Dictionary with samples, cpu_per_sample (s), samples_per_cpu_second,
+    held_per_sample (bytes of decoded output per sample, which the reader
+    queue holds until the next poll) and transient_per_sample (bytes
+    allocated and freed again while parsing, from the peak of each parse,
+    per sample).
+    """
+    stream  = b''.join(synthetic_packet(n, binary) for n in range(count))
+    chunks  = [stream[i:i+chunk] for i in range(0, len(stream), chunk)]
+    
+    def run(decoder, memory=False):
+        samples   = 0
+        held      = 0
+        transient = 0
+        for data in chunks:
+            decoder.buffer.write(data)
+            if memory:
+                _tracemalloc.reset_peak()
+                before = _tracemalloc.get_traced_memory()[0]
+            t, data = decoder.parse(0.0)
+            samples += len(t)
+            if memory:
+                current, peak = _tracemalloc.get_traced_memory()
+                held      += current - before
+                transient += peak - current
+            del t, data
+        return samples, held, transient
+    
+    t0 = _time.process_time()
+    samples, held, transient = run(binary_decoder() if binary else packet_decoder(frame_gap=None))
+    cpu = _time.process_time() - t0
+    
+    # Again under tracemalloc, which is too slow to time
+    _tracemalloc.start()
+    samples, held, transient = run(binary_decoder() if binary else packet_decoder(frame_gap=None), True)
+    _tracemalloc.stop()
+    
+    return dict(samples=samples, cpu_per_sample=cpu/samples, samples_per_cpu_second=samples/cpu,
+                held_per_sample=held/samples, transient_per_sample=transient/samples)
+
+
+class synthetic_firmware():
+    """
+    Writes synthetic telemetry into a pseudo-terminal (or loop:// port) at a
+    controlled rate, behaving like the firmware: it waits for the 'a' that
+    starts the loop, and answers binary requests.
+    
+    Parameters
+    ----------
+    rate : float
+        Packets per second. 0 means as fast as possible.
+    
+    count : int
+        Number of packets to send.
+    """
+    def __init__(self, rate, count):
+        
+        self.rate  = rate
+        self.count = count
+        
+        # Send time of each packet, by sequence number, and when it was due
+        # (the time the firmware would have measured it). Both from
+        # time.monotonic(), like the api's sample times.
+        self.t_sent = _n.full(count, _n.nan)
+        self.t_due  = _n.full(count, _n.nan)
+        
+        if hasattr(_os, 'openpty'):
+            import tty as _tty
+            self._master, self._slave = _os.openpty()
+            _tty.setraw(self._master)
+            _tty.setraw(self._slave)
+            self.port   = _os.ttyname(self._slave)
+            self._read  = lambda: _os.read(self._master, 4096)
+            self._write = lambda data: _os.write(self._master, data)
+        
+        # loop:// echoes the host's own writes back, so the api's serial
+        # object is shared once it exists (see attach()).
+        else:
+            self.port   = 'loop://'
+            self._read  = None
+            self._write = None
+        
+        self._thread = _threading.Thread(target=self._run, daemon=True)
+        self.done    = False
+    
+    def attach(self, api):
+        """
+        For loop:// only: use the api's own port for both directions.
+        """
+        if self._write is None: self._write = api.serial.write
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def _run(self):
+        
+        # Wait for the loop to be started, switching to binary if asked
+        binary   = False
+        received = b''
+        if self._read is not None:
+            while b'a' not in received:
+                received += self._read()
+                if _binary_request.encode() in received and not binary:
+                    binary = True
+                    self._write(_binary_sync)
+        
+        # Send in batches small enough to keep the rate smooth
+        t_start = _time.monotonic()
+        seq = 0
+        while seq < self.count:
+            
+            # Sleep until the next packet is due
+            if self.rate:
+                t_due = t_start + seq/self.rate
+                dt    = t_due - _time.monotonic()
+                if dt > 0: _time.sleep(dt)
+            
+            # Everything due by now goes out in one write
+            n = self.count-seq if not self.rate else max(1, min(int((_time.monotonic()-t_start)*self.rate)+1-seq, self.count-seq))
+            n = min(n, 256)
+            data = b''.join(synthetic_packet(k, binary) for k in range(seq, seq+n))
+            self.t_sent[seq:seq+n] = _time.monotonic()
+            self.t_due [seq:seq+n] = t_start + _n.arange(seq, seq+n)/self.rate if self.rate else self.t_sent[seq:seq+n]
+            self._write(data)
+            seq += n
+        
+        self.done = True
+    
+    def close(self):
+        if self._read is not None:
+            _os.close(self._master)
+            _os.close(self._slave)
+
+
+def bench_pipeline(rate, duration, binary=False, poll_interval=0.1, log=True, memory=False):
+    """
+    Runs the full headless pipeline (reader thread, decoder, history,
+    envelope and, optionally, the log) against a synthetic firmware.
+    
+    Latencies run up to engine.poll() returning the stored samples, not to
+    the plots being redrawn, which nothing headless can measure: from the
+    bytes arriving (arrival_to_stored) and from the firmware sending them
+    (sent_to_stored).
+    
+    Parameters
+    ----------
+    rate : float
+        Packets per second to send. 0 means as fast as possible.
+    
+    duration : float
+        How long to send for (s).
+    
+    binary=False : bool
+        Whether to use the binary protocol.
+    
+    poll_interval=0.1 : float
+        How often to poll the engine (s), as the GUI timer would.
+    
+    log=True : bool
+        Whether to include the continuous logger.
+    
+    memory=False : bool
+        Whether to trace memory allocations (slows everything down).
+    
+    Returns
+    -------
+    Dictionary of results, with the latencies as (p50, p99) in seconds.
+    """
+    count    = int(rate*duration) if rate else 200000
+    firmware = synthetic_firmware(rate, count)
+    log_path = _tempfile.mkdtemp(prefix='oven_benchmark_') if log else None
+    engine   = controller_engine(log_path=log_path)
+    
+    # Whatever happens, let go of the port and the log
+    try:
+        if memory: _tracemalloc.start()
+        
+        # The firmware has to be listening before we connect, to answer binary
+        # requests, except on loop:// where it needs the api's port.
+        if firmware.port != 'loop://': firmware.start()
+        engine.connect(firmware.port, baudrate=115200, binary=binary, boot_timeout=0)
+        firmware.attach(engine.api)
+        if firmware.port == 'loop://': firmware.start()
+        
+        memory_start = _tracemalloc.get_traced_memory()[0] if memory else 0
+        cpu_start    = _time.process_time()
+        t_start      = _time.monotonic()
+        
+        # Poll like the GUI would, until everything has arrived or stopped arriving
+        arrival_to_stored = [] # Arrival of the bytes to engine.poll() storing the sample
+        sent_to_stored    = [] # Firmware sending it to the same
+        stamp_error       = []
+        seqs              = []
+        t_last_data       = _time.monotonic()
+        while _time.monotonic() - t_last_data < max(1, 5*poll_interval):
+            _time.sleep(poll_interval)
+            t, data = engine.poll()
+            now = _time.monotonic()
+            if not len(t): 
+                if not firmware.done: t_last_data = now
+                continue
+            t_last_data = now
+            
+            seq = data[:, _seq_field].astype(int)
+            seqs             .append(seq)
+            arrival_to_stored.append(now - (t + engine.t0))
+            sent_to_stored   .append(now - firmware.t_sent[seq % count])
+            stamp_error      .append(t + engine.t0 - firmware.t_due[seq % count])
+        
+        t_stop = t_last_data
+        cpu    = _time.process_time() - cpu_start
+        memory_growth = _tracemalloc.get_traced_memory()[0] - memory_start if memory else None
+        if memory: _tracemalloc.stop()
+        
+        decoder = engine.api.decoder
+    
+    finally:
+        engine.disconnect()
+        firmware.close()
+        if log_path: _shutil.rmtree(log_path, True)
+    
+    seqs              = _n.concatenate(seqs)              if seqs else _n.zeros(0, int)
+    arrival_to_stored = _n.concatenate(arrival_to_stored) if seqs.size else _n.zeros(0)
+    sent_to_stored    = _n.concatenate(sent_to_stored)    if seqs.size else _n.zeros(0)
+    stamp_error       = _n.concatenate(stamp_error)       if seqs.size else _n.zeros(0)
+    received          = len(_n.unique(seqs))
+    
+    return dict(
+        rate            = rate,
+        sent            = count,
+        received        = received,
+        loss            = 1 - received/count,
+        samples_per_s   = received/(t_stop-t_start),
+        cpu_per_sample  = cpu/max(received, 1),
+        arrival_to_stored = _n.percentile(arrival_to_stored, [50, 99]) if received else [_n.nan]*2,
+        sent_to_stored    = _n.percentile(sent_to_stored,    [50, 99]) if received else [_n.nan]*2,
+        stamp_jitter    = stamp_error.std() if received else _n.nan,
+        dropped         = decoder.dropped,
+        malformed       = decoder.malformed,
+        memory_per_sample = memory_growth/max(received, 1) if memory else None)
+
+
+def print_pipeline(r):
+    """
+    Prints the results of bench_pipeline() on one line.
+    """
+    line = '%8s Hz: %9.0f samples/s  loss %6.2f%%  cpu %6.1f us/sample  arrival->stored %6.1f / %6.1f ms  sent->stored %6.1f / %6.1f ms (p50 / p99)  stamp jitter %6.2f ms' % (
+        r['rate'] or 'max', r['samples_per_s'], 100*r['loss'], 1e6*r['cpu_per_sample'],
+        1e3*r['arrival_to_stored'][0], 1e3*r['arrival_to_stored'][1], 1e3*r['sent_to_stored'][0], 1e3*r['sent_to_stored'][1], 1e3*r['stamp_jitter'])
+    if r['memory_per_sample'] is not None: line += '  memory %6.1f B/sample' % r['memory_per_sample']
+    print(line)
+
+
+if __name__ == '__main__':
+    import argparse as _argparse
+    
+    parser = _argparse.ArgumentParser(description='Benchmarks the acquisition pipeline against a synthetic firmware.')
+    parser.add_argument('--rates',    type=float, nargs='+', default=[10, 100, 1000, 0], help='Packet rates to test (Hz, 0 = as fast as possible).')
+    parser.add_argument('--duration', type=float, default=5, help='Length of each run (s).')
+    parser.add_argument('--binary',   action='store_true',   help='Use the binary protocol.')
+    parser.add_argument('--poll',     type=float, default=0.1, help='Engine poll interval (s).')
+    parser.add_argument('--no-log',   action='store_true',   help='Leave out the continuous logger.')
+    parser.add_argument('--memory',   action='store_true',   help='Trace memory allocations.')
+    parser.add_argument('--chunk',    type=int,   default=256, help='Bytes per read in the decoder benchmark.')
+    args = parser.parse_args()
+    
+    for binary in sorted({False, args.binary}):
+        r = bench_decoder(binary=binary, chunk=args.chunk)
+        print('Decoder (%s): %.2f us/sample, %.0f samples per CPU second, %.0f B/sample output, %.0f B/sample transient' % (
+            'binary' if binary else 'ascii', 1e6*r['cpu_per_sample'], r['samples_per_cpu_second'], r['held_per_sample'], r['transient_per_sample']))
+    
+    for rate in args.rates:
+        print_pipeline(bench_pipeline(rate, args.duration, args.binary, args.poll, not args.no_log, args.memory))
@@ -0,0 +1,359 @@
+import numpy     as _n
+import os        as _os
+import selectors as _selectors
+import threading as _threading
+import time      as _time
+
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+from _controller_engine import controller_engine
+from _profile           import profile_scheduler, load_recipe
+from _watchdog          import watchdog
+
+class device_state():
+    """
+    One controller managed by an oven_supervisor: its engine plus the
+    statistics reported for it.
+    """
+    def __init__(self, name, engine, port, connect_kwargs):
+        
+        self.name           = name
+        self.engine         = engine
+        self.port           = port
+        self.connect_kwargs = connect_kwargs
+        
+        self.clear_stats()
+    
+    def clear_stats(self):
+        """
+        Starts a new statistics window.
+        """
+        self.t_stats     = _time.time()
+        self.samples     = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+    
+    def get_stats(self):
+        """
+        Returns a dictionary of the statistics since the last clear_stats():
+        samples, rate (Hz), mean and max latency from byte arrival to the
+        sample being stored (s), and the decoder's dropped/malformed counts.
+        """
+        dt = _time.time()-self.t_stats
+        api = self.engine.api
+        return dict(
+            samples      = self.samples,
+            rate         = self.samples/dt if dt else 0,
+            latency_mean = self.latency_sum/self.samples if self.samples else 0,
+            latency_max  = self.latency_max,
+            dropped      = api.decoder.dropped   if api else 0,
+            malformed    = api.decoder.malformed if api else 0)
+
+
+class oven_supervisor():
+    """
+    Runs many temperature controllers in one headless process. Every port
+    is serviced from a single selector loop, with no GUI and no thread per
+    device, and each device logs to its own directory under log_path.
+    
+    On platforms where serial ports cannot be selected on (Windows), the
+    loop falls back to polling every poll_interval.
+    
+    Parameters
+    ----------
+    log_path='logs' : str
+        Directory under which each device gets its own log directory.
+    
+    retention=3600 : float
+        How much history to keep in memory per device (s).
+    
+    poll_interval=0.05 : float
+        Longest time between services of the ports (s).
+    
+    connect_timeout=10 : float
+        Longest time to wait for each device to connect (s). Devices that
+        take longer are skipped.
+    """
+    def __init__(self, log_path='logs', retention=3600, poll_interval=0.05, connect_timeout=10):
+        
+        self.log_path        = log_path
+        self.retention       = retention
+        self.poll_interval   = poll_interval
+        self.connect_timeout = connect_timeout
+        
+        self.devices   = {} # name: device_state
+        self._selector = _selectors.DefaultSelector()
+        self._polled   = [] # Devices that cannot be selected on
+        self._lost     = [] # Devices reconnecting in the background
+        self._running  = False
+        
+        # One scheduler thread runs the ramp/soak recipes of every device
+        self.profiles = profile_scheduler()
+    
+    def add(self, port, name=None, parameters=None, schema=None, limit=None, rate_limit=None, stale_timeout=None, **kwargs):
+        """
+        Adds a device. It is connected by connect_all().
+        
+        Parameters
+        ----------
+        port : str
+            Name of the port.
+        
+        name=None : str
+            Name of the device, used for its log directory. None means the
+            last part of the port name.
+        
+        parameters=None : dict
+            Initial control parameters (see controller_engine.parameters).
+        
+        schema=None : channel_schema
+            Channels of the device. None means the original board.
+        
+        limit=None, rate_limit=None, stale_timeout=None : float
+            Watchdog rules (see _watchdog.watchdog). If any is set, a trip
+            zeroes the device's setpoints and stops its recipes. Setpoints
+            above limit are refused (see controller_engine.check_parameters()).
+        
+        **kwargs are sent to controller_engine.connect().
+        
+        Returns
+        -------
+        The device's controller_engine.
+        """
+        if name is None: name = _os.path.basename(port)
+        if name in self.devices: raise Exception('There is already a device named "'+name+'".')
+        
+        engine = controller_engine(retention=self.retention, schema=schema, temperature_limit=limit,
+                                   log_path=_os.path.join(self.log_path, name) if self.log_path else None)
+        if parameters: engine.parameters.update(engine.check_parameters(parameters))
+        
+        if limit is not None or rate_limit is not None or stale_timeout is not None:
+            w = watchdog(engine, limit, rate_limit, stale_timeout=stale_timeout)
+            w.callbacks.append(lambda trip: self.stop_recipes(engine))
+        
+        self.devices[name] = device_state(name, engine, port, kwargs)
+        return engine
+    
+    def connect_all(self):
+        """
+        Connects every device that is not connected yet, in parallel, and
+        registers it with the event loop. Devices that fail or take longer
+        than connect_timeout are reported and left disconnected.
+        
+        Returns
+        -------
+        List of the names of the devices connected.
+        """
+        new = [d for d in self.devices.values() if d.engine.api is None]
+        if not new: return []
+        
+        # Don't wait for stragglers when leaving the pool
+        pool    = _ThreadPoolExecutor(len(new))
+        futures = [pool.submit(d.engine.connect, d.port, reader=False, **d.connect_kwargs) for d in new]
+        pool.shutdown(wait=False)
+        
+        t_give_up = _time.time() + self.connect_timeout
+        connected = []
+        for d, future in zip(new, futures):
+            try: future.result(max(0, t_give_up-_time.time()))
+            except Exception as e:
+                print('Could not connect to '+d.name+' ('+d.port+'): '+(str(e) or type(e).__name__))
+                
+                # Close it whenever it does finish
+                future.add_done_callback(lambda f, d=d: d.engine.disconnect())
+                continue
+            connected.append(d)
+        
+        for d in connected:
+            self._register(d)
+            d.clear_stats()
+        
+        return [d.name for d in connected]
+    
+    def _register(self, d):
+        """
+        Adds the device's port to the event loop.
+        """
+        try:    self._selector.register(d.engine.api.serial.fileno(), _selectors.EVENT_READ, d)
+        except Exception: self._polled.append(d)
+    
+    def _unregister(self, d):
+        """
+        Removes the device from the event loop.
+        """
+        if d in self._polled: self._polled.remove(d)
+        for key in list(self._selector.get_map().values()):
+            if key.data is d: self._selector.unregister(key.fileobj)
+    
+    def _link_lost(self, d):
+        """
+        Takes a device whose port failed out of the event loop and reconnects
+        it in the background, so the others carry on.
+        """
+        print('Lost '+d.name+' ('+d.port+'), reconnecting...')
+        self._unregister(d)
+        self._lost.append(d)
+        _threading.Thread(target=d.engine.api.handle_link_loss, daemon=True).start()
+    
+    def step(self, timeout=None):
+        """
+        Waits (up to timeout, default poll_interval) for data on any port,
+        decodes what arrived, and moves it into each device's history and log.
+        """
+        if timeout is None: timeout = self.poll_interval
+        
+        # Service the ports with data, or all of them if we can't tell
+        if self._selector.get_map(): ready = [key.data for key, events in self._selector.select(timeout)]
+        else:
+            _time.sleep(timeout)
+            ready = []
+        for d in ready + self._polled: 
+            try:    d.engine.api.service()
+            except Exception: self._link_lost(d)
+        
+        # Put back any device that reconnected
+        for d in list(self._lost):
+            if d.engine.api.link_up:
+                print('Reconnected '+d.name+' ('+d.port+').')
+                self._lost.remove(d)
+                self._register(d)
+        
+        # Store the new samples, including the gap markers of lost devices.
+        # Silent devices are polled too, so their watchdogs still see stale
+        # data and unacknowledged parameters are still re-sent.
+        now = _time.monotonic()
+        for d in self.devices.values():
+            if d.engine.api is None: continue
+            t, data = d.engine.poll()
+            if not len(t): continue
+            
+            latency = now - (t + d.engine.t0)[_n.isfinite(data[:,0])]
+            if not len(latency): continue
+            d.samples     += len(latency)
+            d.latency_sum += latency.sum()
+            d.latency_max  = max(d.latency_max, latency.max())
+    
+    def run_recipe(self, recipe, names=None, delay=0):
+        """
+        Runs a ramp/soak recipe on several devices at once. Every device's
+        segments share the same start time.
+        
+        Parameters
+        ----------
+        recipe : str or dict
+            Path to a recipe file, or a dictionary of channels and their
+            segments (see _profile.load_recipe()).
+        
+        names=None : list
+            Names of the devices to run it on. None means all of them.
+        
+        delay=0 : float
+            Time to wait before starting (s).
+        
+        Returns
+        -------
+        List of the profiles started.
+        """
+        if isinstance(recipe, str): recipe = load_recipe(recipe)
+        if names is None: names = list(self.devices)
+        
+        return self.profiles.start_recipe([self.devices[name].engine for name in names], recipe, delay)
+    
+    def stop_recipes(self, engine):
+        """
+        Stops every recipe running on the supplied device's engine, leaving
+        its parameters where they are. Safe to call from any thread.
+        """
+        for p in list(self.profiles.profiles):
+            if p.engine is engine: self.profiles.stop_profile(p)
+    
+    def run(self, duration=None, report_interval=10, recipe=None):
+        """
+        Connects everything and runs the event loop until stop() is called,
+        KeyboardInterrupt, or duration (s) has passed.
+        
+        Parameters
+        ----------
+        duration=None : float
+            How long to run (s). None means forever.
+        
+        report_interval=10 : float
+            How often to print the per-device statistics (s). None disables
+            the reports.
+        
+        recipe=None : str or dict
+            Ramp/soak recipe to run on every device once connected (see
+            run_recipe()).
+        """
+        self.connect_all()
+        if recipe: self.run_recipe(recipe)
+        
+        self._running = True
+        t_start  = _time.time()
+        t_report = t_start
+        try:
+            while self._running and (duration is None or _time.time()-t_start < duration):
+                self.step()
+                
+                if report_interval and _time.time()-t_report > report_interval:
+                    self.print_stats()
+                    t_report = _time.time()
+        
+        except KeyboardInterrupt: pass
+        
+        finally: self.disconnect_all()
+    
+    def stop(self):
+        """
+        Makes run() return after the current step.
+        """
+        self._running = False
+    
+    def disconnect_all(self):
+        """
+        Disconnects every device, finishing their logs, and stops any
+        recipes.
+        """
+        self.profiles.stop()
+        for d in self.devices.values():
+            if d.engine.api is None: continue
+            self._unregister(d)
+            d.engine.disconnect()
+        self._polled = []
+        self._lost   = []
+    
+    def get_stats(self):
+        """
+        Returns a dictionary of device names and their statistics (see
+        device_state.get_stats()).
+        """
+        return {name: d.get_stats() for name, d in self.devices.items()}
+    
+    def print_stats(self):
+        """
+        Prints the per-device statistics and starts a new window.
+        """
+        for name, s in self.get_stats().items():
+            print('%-16s %8.1f Hz  latency %6.1f ms mean %6.1f ms max  dropped %d  malformed %d' % (
+                name, s['rate'], s['latency_mean']*1e3, s['latency_max']*1e3, s['dropped'], s['malformed']))
+            self.devices[name].clear_stats()
+
+
+if __name__ == '__main__':
+    import argparse as _argparse
+    
+    parser = _argparse.ArgumentParser(description='Runs many Arduino temperature controllers headless in one process.')
+    parser.add_argument('ports', nargs='+', help='Serial ports to connect to.')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--binary',   action='store_true', help='Ask the firmware for binary telemetry.')
+    parser.add_argument('--log-path', default='logs')
+    parser.add_argument('--report',   type=float, default=10, help='Statistics report interval (s).')
+    parser.add_argument('--recipe',   help='Ramp/soak recipe file to run on every device.')
+    parser.add_argument('--limit',    type=float, help='Temperature that trips the watchdog (C).')
+    parser.add_argument('--rate-limit',    type=float, help='Temperature rise that trips the watchdog (C/s).')
+    parser.add_argument('--stale-timeout', type=float, help='Silence that trips the watchdog (s).')
+    args = parser.parse_args()
+    
+    self = oven_supervisor(args.log_path)
+    for port in args.ports: self.add(port, baudrate=args.baudrate, binary=args.binary, 
+                                     limit=args.limit, rate_limit=args.rate_limit, stale_timeout=args.stale_timeout)
+    self.run(report_interval=args.report, recipe=args.recipe)
@@ -0,0 +1,177 @@
+"""
+Browser for runs logged by the temperature controller (see _data_logger).
+Runs open instantly at any length: the view only ever loads the summary
+level (see _run_store) that matches the visible time range, and loads the
+next one as you zoom. Several runs can be overlaid for comparison.
+
+    python run_browser.py logs/run_2024-01-01_09.00.00 logs/run_2024-01-02_09.00.00
+"""
+import os            as _os
+import pyqtgraph     as _pg
+import spinmob       as _s
+import spinmob.egg   as _egg
+
+_g = _egg.gui
+
+from _run_store      import run_store
+from _channel_schema import default_schema as _default_schema
+
+
+class run_browser():
+    """
+    Window for browsing and overlaying logged runs.
+    
+    Parameters
+    ----------
+    paths=[] : list
+        Run directories to open.
+    
+    name='run_browser' : str
+        Unique name to give this instance, so that its settings will not
+        collide with other egg objects.
+    
+    show=True : bool
+        Whether to show the window after creating.
+    
+    block=False : bool
+        Whether to block the console when showing the window.
+    """
+    def __init__(self, paths=[], name='run_browser', show=True, block=False):
+        
+        self.runs = [] # (run_store, offset, fill, mean curve)
+        
+        self.window = _g.Window('Run Browser', size=[1000,600], autosettings_path=name+'.window')
+        
+        # Controls
+        self.grid_top = self.window.place_object(_g.GridLayout(margins=False), alignment=1)
+        self.button_add   = self.grid_top.add(_g.Button('Add Run...', signal_clicked=self._button_add_clicked))
+        self.button_clear = self.grid_top.add(_g.Button('Clear',      signal_clicked=self._button_clear_clicked))
+        self.grid_top.add(_g.Label('Column:'))
+        self.combo_column = self.grid_top.add(_g.ComboBox(
+            _default_schema.fields, autosettings_path=name+'.combo_column',
+            signal_changed=self._reload))
+        self.button_align = self.grid_top.add(_g.Button(
+            'Align Starts', checkable=True, checked=True,
+            signal_toggled=self._button_align_toggled,
+            tip='Plot each run against the time since it started, so runs line up.\nOtherwise runs are plotted against the date and time.'))
+        self.label_status = self.grid_top.add(_g.Label(''))
+        
+        # Plot. Zooming or panning reloads at the matching resolution once the view settles.
+        self.window.new_autorow()
+        self.plot = _pg.PlotWidget()
+        self.plot.addLegend()
+        self.plot.setLabel('bottom', 'Time (s)')
+        self.window.place_object(self.plot, alignment=0)
+        self.window.set_row_stretch(1)
+        
+        self._timer_reload = _g.Timer(interval_ms=100, single_shot=True, signal_tick=self._reload)
+        self.plot.sigXRangeChanged.connect(self._timer_reload.start)
+        
+        for path in paths: self.add_run(path)
+        
+        if show: self.window.show(block)
+    
+    def add_run(self, path):
+        """
+        Opens a run and overlays it on the plot.
+        """
+        store = run_store(path)
+        
+        # The first run sets the columns on offer
+        if not self.runs: self._set_columns(store.ckeys[1:])
+        
+        color = _pg.intColor(len(self.runs), hues=8)
+        
+        # Min/max band, with the mean on top
+        lo   = _pg.PlotDataItem(pen=color)
+        hi   = _pg.PlotDataItem(pen=color)
+        fill = _pg.FillBetweenItem(lo, hi, brush=_pg.mkBrush(color.red(), color.green(), color.blue(), 60))
+        mean = self.plot.plot(pen=color, name=_os.path.basename(path.rstrip('/\\')))
+        self.plot.addItem(fill)
+        
+        self.runs.append([store, lo, hi, fill, mean])
+        
+        # Show everything
+        self.plot.enableAutoRange(x=True)
+        self._reload()
+        self.plot.enableAutoRange(x=False)
+        
+        return store
+    
+    def _set_columns(self, names):
+        """
+        Offers the supplied columns, keeping the selection where possible.
+        """
+        index = self.combo_column.get_index()
+        self.combo_column.block_signals()
+        self.combo_column.clear()
+        for x in names: self.combo_column.add_item(x)
+        self.combo_column.set_index(min(index, len(names)-1))
+        self.combo_column.unblock_signals()
+    
+    def _get_offset(self, store):
+        """
+        Returns the time subtracted from the run for plotting: its start when
+        aligning starts, otherwise minus the Unix time of its zero (see
+        run_store.t_zero). Runs that didn't record it stay where they are.
+        """
+        if self.button_align.is_checked(): return store.get_span()[0]
+        return 0 if store.t_zero is None else -store.t_zero
+    
+    def _reload(self, *a):
+        """
+        Loads every run at the resolution that suits the visible range.
+        """
+        if not self.runs: return
+        
+        column = self.combo_column.get_index()+1
+        width  = max(self.plot.width(), 100)
+        
+        # Visible range, or everything if the view is still autoranging
+        if self.plot.getViewBox().autoRangeEnabled()[0]: x0, x1 = None, None
+        else: x0, x1 = self.plot.getViewBox().viewRange()[0]
+        
+        levels = []
+        for store, lo, hi, fill, mean in self.runs:
+            offset = self._get_offset(store)
+            t, l, h, m, level = store.get(column, 
+                None if x0 is None else x0+offset, None if x1 is None else x1+offset, points=width)
+            lo  .setData(t-offset, l)
+            hi  .setData(t-offset, h)
+            mean.setData(t-offset, m)
+            levels.append(level)
+        
+        self.label_status.set_text('Summary levels: '+', '.join([str(n) for n in levels]))
+    
+    def _button_add_clicked(self, *a):
+        """
+        Asks for a run directory and opens it.
+        """
+        path = _s.dialogs.select_directory(text='Select a run directory')
+        if path: self.add_run(path)
+    
+    def _button_clear_clicked(self, *a):
+        """
+        Removes every run.
+        """
+        self.plot.clear()
+        self.runs = []
+        self.label_status.set_text('')
+    
+    def _button_align_toggled(self, *a):
+        """
+        Switches between absolute times and times since each run started.
+        """
+        if self.button_align.is_checked(): 
+            self.plot.setAxisItems({'bottom': _pg.AxisItem('bottom')})
+            self.plot.setLabel('bottom', 'Time (s)')
+        else: self.plot.setAxisItems({'bottom': _pg.DateAxisItem()})
+        
+        self.plot.enableAutoRange(x=True)
+        self._reload()
+        self.plot.enableAutoRange(x=False)
+
+
+if __name__ == '__main__':
+    import sys as _sys
+    self = run_browser(_sys.argv[1:], block=True)
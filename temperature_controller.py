@@ -1,25 +1,61 @@
+import numpy         as _n
 import spinmob.egg   as _egg
 import spinmob       as _s
 import time          as _time
-import serial        as _serial
 
 _g            = _egg.gui
 
-from serial.tools.list_ports import comports as _comports
 from _serial_gui_base  import serial_gui_base
 from _arduino_api      import arduino_api
+from _controller_engine import controller_engine
+from _channel_schema   import parameter_bounds
+from _profile           import profile_scheduler, load_recipe
+from _telemetry_server  import telemetry_server
+from _watchdog          import watchdog
 
 # GUI settings
 _s.settings['dark_theme_qt'] = True
 
-# Print data to terminal for debugging
-_debug = True
+# Title colours of the control channels, in turn
+_channel_colors = ['royalblue', 'fuchsia', 'limegreen', 'orange', 'gold', 'tomato']
+
+def _get_channel_layout(schema):
+    """
+    Returns the layout of the channel tabs for the supplied channel_schema,
+    one entry per tab, built by _add_channel_tab(). Each tab shows the
+    temperature from history column 'temperature' and plots 'columns' (time
+    first) as 'ckeys' (see channel_schema.get_channel_columns()). Tabs of
+    control channels ('control' is the channel number) also get its
+    parameters, its status and its running metrics. Widgets are named after
+    'key', e.g. plot_0.
+    """
+    channels = schema.get_channel_columns()
+    layout   = [dict(key=str(n), title='Channel %d' % n, color=_channel_colors[n % len(_channel_colors)], control=n,
+                     temperature=columns[1], ckeys=ckeys, columns=columns)
+                for n, (ckeys, columns) in enumerate(channels[:schema.controls])]
+    
+    # A lone sample is 'sample', as on the original board
+    for n, (ckeys, columns) in enumerate(channels[schema.controls:]):
+        layout.append(dict(key='sample' if schema.samples == 1 else 'sample_%d' % n,
+                           title='Sample' if schema.samples == 1 else 'Sample %d' % n, color=None, control=None,
+                           temperature=columns[1], ckeys=ckeys, columns=columns))
+    return layout
+
+# Number boxes of the control parameters: label, parameter, suffix and
+# colour. Their bounds are the engine's (see parameter_bounds). The first
+# goes next to the temperature, the rest in the next column.
+_parameter_layout = [
+    ('Setpoint:',      'setpoint', '°C',  'cyan'),
+    ('Band:',          'band',     '°C',  'paleturquoise'),
+    ('Integral time:', 'integral', 's',   'gold'),
+    ('Ramp rate:',     'rate',     's⁻¹', 'pink')]
 
 
 class temperature_controller(serial_gui_base):
     """
     Graphical interface for the Dominic Ryan's Arduino based
-    temperature controller.
+    temperature controller. All the work is done by a controller_engine
+    (self.engine); this class only displays it.
     
     Parameters
     ----------
@@ -28,7 +64,8 @@ class temperature_controller(serial_gui_base):
         collide with other egg objects.
         
     temperature_limit=1000 : float
-        Upper limit on the temperature setpoint (C).
+        Upper limit on the temperature setpoint (C). A measured temperature
+        above it trips the watchdog, which zeroes every setpoint.
     
     show=True : bool
         Whether to show the window after creating.
@@ -38,126 +75,363 @@ class temperature_controller(serial_gui_base):
         
     window_size=[1,300] : list
         Dimensions of the window.
+        
+    redraw_interval=0.5 : float
+        Minimum time between plot redraws (s). Data is still collected in
+        between.
+    
+    retention=21600 : float
+        How much history to keep in memory at full resolution (s). Older
+        samples are moved to disk (see get_history()), and the plots show
+        them only through the min/max envelope. None keeps everything.
+    
+    history_path=None : str
+        Directory for the on-disk history. None means a temporary directory.
+    
+    log_path='logs' : str
+        Directory in which every connection logs its samples continuously
+        (see _data_logger.export_csv() to convert a run to CSV). None disables
+        logging.
+    
+    server_port=None : int
+        TCP port on which to publish the samples and take parameter changes
+        from other machines (see _telemetry_server). None means no server.
+        The server stops when the window is closed.
+    
+    server_host='127.0.0.1' : str
+        Address for the server to listen on. Use '' for every interface.
+    
+    schema=None : channel_schema
+        Channels of the board, one tab each. None means the original board
+        (two control channels and a sample).
+    
+    rate_limit=None : float
+        Fastest allowed temperature rise before the watchdog trips (C/s).
+        None means no limit.
+    
+    stale_timeout=10 : float
+        Longest silence from a connected board before the watchdog trips
+        (s). None means no limit.
     """
-    def __init__(self, name='test', temperature_limit=1000, show=True, block=False, window_size=[1,300]):
+    def __init__(self, name='test', temperature_limit=1000, show=True, block=False, window_size=[1,300], redraw_interval=0.5, retention=21600, history_path=None, log_path='logs', server_port=None, server_host='127.0.0.1', schema=None, rate_limit=None, stale_timeout=10):
 
         # Remember the limit
         self._temperature_limit = temperature_limit
+        
+        # The engine doing the actual work, and shortcuts to its history
+        self.engine   = controller_engine(retention=retention, history_path=history_path, log_path=log_path, schema=schema, temperature_limit=temperature_limit)
+        self.samples  = self.engine.samples
+        self.envelope = self.engine.envelope
+        self.logger   = self.engine.logger
+        
+        # Runs ramp/soak recipes in its own thread (see run_recipe())
+        self.profiles = profile_scheduler()
+        
+        # Safety cutoff on the acquisition thread. A trip also stops any recipe,
+        # so it can't raise the setpoints again.
+        self.watchdog = watchdog(self.engine, limit=temperature_limit, rate_limit=rate_limit, stale_timeout=stale_timeout)
+        self.watchdog.callbacks.append(lambda trip: self.stop_recipe())
+        self._trips   = 0
+        
+        # Optional server for remote viewers
+        self.server = None
+        if server_port is not None:
+            self.server = telemetry_server(self.engine, server_host, server_port)
+            self.server.start()
+        
+        # Plot redraw throttling
+        self._redraw_interval = redraw_interval
+        self._t_redraw        = 0
 
         # Run the base class stuff, which shows the window at the end.
         serial_gui_base.__init__(self, api_class=arduino_api, name=name, show=False, window_size=window_size)
         
-        # Populate the GUI with all the goods
-        self.setup_gui_components(name, temperature_limit)
+        # Populate the GUI with all the goods, caching their settings with the rest
+        with self.settings_cache: self.setup_gui_components(name, temperature_limit)
         
         # Finally show it.
         self.window.show(block)
     
+    def _before_open_api(self):
+        """
+        Hands the engine the parameters and protocol shown in the GUI before
+        connecting.
+        """
+        self.engine.parameters.update(self.engine.check_parameters(self._get_parameters()))
+        self._binary = self.combo_protocol.get_text() == 'Binary'
+        self.combo_protocol.disable()
+    
+    def _open_api(self, port, address, baudrate, timeout):
+        """
+        Connects through the engine, which also sends the parameters and
+        starts acquiring. Runs in the connect thread.
+        """
+        return self.engine.connect(port, address, baudrate, timeout, binary=self._binary)
+    
+    def _close_api(self):
+        """
+        Disconnects through the engine, which also finishes the log.
+        """
+        self.engine.disconnect()
+    
+    def _window_close(self):
+        """
+        Disconnects and stops the server, so its port and thread are freed.
+        """
+        serial_gui_base._window_close(self)
+        if self.server: self.server.stop()
+    
     def _after_button_connect_toggled(self):
         
         if self.button_connect.is_checked():
             
             # Indicate channel status in the GUI            
             self._set_channel_status('Connected')
+            self._link_up = True
             
-            # Send the PID parameters to the arduino
-            self._send_parameters()
-
             # Start the GUI timer
             self.timer.start()
         
         else:
             # Indicate channel status in the GUI  
             self._set_channel_status('Disconnected')
+            self.combo_protocol.enable()
             
             # Stop GUI timer
             self.timer.stop()       
-            
-    def _send_parameters(self):
+    
+    def _get_parameters(self):
         """
-        Sends the temperature control parameters to the arduino controller.
-
+        Returns a dictionary of the control parameters shown in the GUI.
+        """
+        return {key: box.get_value() for key, box in self._parameter_boxes.items()}
+    
+    def _send_parameter(self, key):
+        """
+        Hands the one edited control parameter to the engine, which sends it
+        to the arduino controller once the edits settle. Only that key is
+        changed, so it can't undo changes made meanwhile by a profile, a
+        remote client or the watchdog.
+        """
+        try: self.engine.set_parameters(**{key: self._parameter_boxes[key].get_value()})
+        except Exception as e: self.label_message.set_text(str(e)).set_colors('red')
+    
+    def _show_parameters(self):
+        """
+        Updates the parameter number boxes to match the engine (e.g. after a
+        profile segment starts), without sending anything back.
+        """
+        for key, box in self._parameter_boxes.items():
+            if box.get_value() != self.engine.parameters[key]: box.set_value(self.engine.parameters[key], block_signals=True)
+        
+        # Profile progress
+        running = [p for p in self.profiles.profiles if p.engine is self.engine]
+        if running: self.label_profile.set_text(', '.join(['Channel %d: segment %d of %d, %.0f s left' % (
+            p.channel, p.index+1, len(p.segments), p.get_remaining()) for p in running]))
+        elif self.label_profile.get_text(): self.label_profile.set_text('')
+    
+    def _show_metrics(self):
+        """
+        Updates the running statistics shown on each channel tab.
         """
-        delim = ','
+        for label, m in zip(self._metrics_labels, self.engine.metrics):
+            label.set_text(
+                'Mean: %.2f ± %.2f °C\n'   % (m.mean, m.get_std()) +
+                'Error: %+.2f °C\n'        %  m.error +
+                'Rate: %+.3f °C/s\n'       %  m.rate +
+                'Overshoot: %.2f °C\n'     %  m.overshoot +
+                'Settling time: %s\n'      % ('%.0f s' % m.settling_time if m.is_settled() else 'not settled') +
+                'Output: %.0f %% (%.0f %% saturated)' % (m.output, 100*m.saturated))
+    
+    def run_recipe(self, recipe, delay=0):
+        """
+        Runs a ramp/soak recipe on this controller, stopping any recipe
+        already running.
         
-        # Build up the message to send to the controller
-        msg = ''
-        msg += str(int(self.number_setpoint_0      .get_value()*4))       + delim
-        msg += str(int(round(self.number_band_0    .get_value()*4)))      + delim
-        msg += str(int(round(self.number_integral_0.get_value()*1000*4))) + delim
-        msg += str(int(round(self.number_rate_0    .get_value()*100)))    + delim
+        Parameters
+        ----------
+        recipe : str or dict
+            Path to a recipe file, or a dictionary of channels and their
+            segments (see _profile.load_recipe()).
         
-        msg += str(int(self.number_setpoint_1      .get_value()*4))       + delim
-        msg += str(int(round(self.number_band_1    .get_value()*4)))      + delim
-        msg += str(int(round(self.number_integral_1.get_value()*1000*4))) + delim
-        msg += str(int(round(self.number_rate_1    .get_value()*100)))    
+        delay=0 : float
+            Time to wait before starting (s).
         
-        # Write the message to the arduino
-        if(_debug): print('msg: %s' %msg)
-        self.api.write(msg)
+        Returns
+        -------
+        List of the profiles started, one per channel.
+        """
+        if isinstance(recipe, str): recipe = load_recipe(recipe)
         
-        # Write a single char to start the arduino's loop
-        self.api.write('a')
+        self.stop_recipe()
+        return self.profiles.start_recipe(self.engine, recipe, delay)
+    
+    def stop_recipe(self):
+        """
+        Stops any recipe running on this controller, leaving the parameters
+        where they are.
+        """
+        for p in list(self.profiles.profiles):
+            if p.engine is self.engine: self.profiles.stop_profile(p)
+    
+    def _button_profile_clicked(self, *a):
+        """
+        Asks for a recipe file and runs it.
+        """
+        path = _s.dialogs.load('*.txt', text='Select a ramp/soak recipe')
+        if path: self.run_recipe(path)
+    
+    def _button_profile_stop_clicked(self, *a):
+        """
+        Stops the running recipe.
+        """
+        self.stop_recipe()
+        self.label_profile.set_text('')
     
     def _set_channel_status(self, _status):
         """
         Updates the channel status (Connected or Disconnected) in the GUI.
         
         """
-        
-        if _status == 'Connected':
-            self.channel_0_status.set_text('(Connected)').set_style('font-size: 20pt; color: mediumspringgreen')
-            self.channel_1_status.set_text('(Connected)').set_style('font-size: 20pt; color: mediumspringgreen')
-        else:
-            self.channel_0_status.set_text('(Disconnected)').set_style('font-size: 20pt; color: coral')
-            self.channel_0_status.set_text('(Disconnected)').set_style('font-size: 20pt; color: coral')
-            
+        for label in self._status_labels:
+            if _status == 'Connected': label.set_text('(Connected)')   .set_style('font-size: 20pt; color: mediumspringgreen')
+            else:                      label.set_text('(Disconnected)').set_style('font-size: 20pt; color: coral')
     
     def _timer_tick(self):
         """
-        Called every time the timer ticks. Used for grabbing serial data and updating the GUI.
+        Called every time the timer ticks. Drains the samples collected by the
+        api's reader thread and updates the GUI.
         """
         
-        # Get the time
-        t = _time.time()-self.t0
+        # Move everything the reader thread has parsed since the last tick into the history
+        times, data = self.engine.poll()
         
-        # Grab data packet fromt he serial line
-        packet = self.api.read_all()
+        # Live timings, if the Performance tab is recording
+        self._update_performance()
         
-        # Split by the Serial.println() delimiter
-        data = packet.split('\r\n')[:-1] 
+        # Show parameters changed by a running profile
+        self._show_parameters()
         
-        # Print to console for debugging
-        if(_debug): 
-            print("Recovered Data: ")
-            print(data)
+        # Let the user know if the link dropped out
+        if self.api.link_up != self._link_up:
+            self._link_up = self.api.link_up
+            if self._link_up: self.label_message.set_text('')
+            else:             self.label_message.set_text('Serial link lost, reconnecting...').set_colors('red')
         
-        try:
-            # Try to seperate the data
-            T0, output0, proportional0, integral0, T1, output1, proportional1, integral1, Tsample = data
-            
-            # Update temperature number boxes
-            self.number_temperature_0     .set_value(float(T0))
-            self.number_temperature_1     .set_value(float(T1))
-            self.number_temperature_sample.set_value(float(Tsample))
-        
-            # Update data plots
-            self.plot_0.append_row([t, float(T0), float(output0), float(proportional0), float(integral0)], ckeys=['Time (s)', 'Temperature (C)', 'Output (%)', 'Proportional', 'Integral'])
-            self.plot_0.plot()
-            
-            self.plot_1.append_row([t, float(T1), float(output1), float(proportional1), float(integral1)], ckeys=['Time (s)', 'Temperature (C)', 'Output (%)', 'Proportional', 'Integral'])
-            self.plot_1.plot()
-            
-            self.plot_sample.append_row([t, float(Tsample)], ckeys=['Time (s)', 'Temperature (C)'])
-            self.plot_sample.plot()
-            
-            # Print data packet status to console
-            if(_debug): print("Packet accepted!")
-        except:
-            
-            # Print data packet status to console
-            if(_debug): print("Packet NOT accepted.")
-            return
+        # Let the user know if the watchdog zeroed the setpoints
+        if len(self.watchdog.trips) != self._trips:
+            self._trips = len(self.watchdog.trips)
+            trip = self.watchdog.trips[-1]
+            self.label_message.set_text('Watchdog tripped (%s %s), setpoints zeroed.' % (trip['rule'], trip['channel'] or '')).set_colors('red')
+        
+        # Nothing new; just catch up on any redraw we skipped
+        if not len(data): return self._redraw()
+        
+        # Point the plots at the grown history
+        self._update_plot_columns()
+        
+        # Update temperature number boxes with the latest sample (skipping gap markers)
+        real = data[_n.isfinite(data[:,0])]
+        if len(real):
+            for box, column in self._temperature_boxes: box.set_value(real[-1,column-1])
+            self._show_metrics()
+        
+        # Redraw the visible plot, if it is time to
+        self._plots_dirty = [True]*len(self._plots)
+        self._redraw()
+    
+    def append_samples(self, t, data):
+        """
+        Appends a block of samples to the history and points every plot at
+        the result. No per-sample work is done in Python.
+        
+        Parameters
+        ----------
+        t : array
+            Time of each of the N samples (s).
+        
+        data : array
+            N x fields array of telemetry (see engine.schema.fields; T0,
+            output0, proportional0, integral0, T1, ..., Tsample on the
+            original board).
+        """
+        self.engine.append_samples(t, data)
+        self._update_plot_columns()
+    
+    def _update_plot_columns(self):
+        """
+        Hands the plots views of the history rather than copies.
+        """
+        for plot, ckeys, columns in self._plots: self._set_plot_columns(plot, ckeys, columns)
+    
+    def get_history(self, t_start=None, t_stop=None):
+        """
+        Returns every sample with t_start <= time <= t_stop (s, None means no
+        limit) as an N x columns array (time then the telemetry fields, see
+        engine.schema.ckeys), reading back from disk anything older than the
+        retention.
+        """
+        return self.samples.get_range(t_start, t_stop)
+    
+    def _set_plot_columns(self, plot, ckeys, columns):
+        """
+        Replaces the plot's columns with views of the specified history columns.
+        Bypasses databox.insert_column(), which copies.
+        """
+        plot.ckeys   = list(ckeys)
+        plot.columns = dict(zip(ckeys, self.samples.get_columns(columns)))
+    
+    def _redraw(self):
+        """
+        Redraws the plot on the visible tab if it has new data and the last
+        redraw was at least redraw_interval ago. The plot is drawn from the
+        min/max envelope, decimated to its width in pixels, and then handed
+        back the full-resolution columns so saving still gets everything.
+        """
+        n = self.tabs.get_current_tab()
+        if n >= len(self._plots) or not self._plots_dirty[n] or _time.monotonic() - self._t_redraw < self._redraw_interval: return
+        
+        t_start = self.engine.perf.start()
+        plot, ckeys, columns = self._plots[n]
+        
+        # Envelope columns exclude the time
+        t, y = self.envelope.get(max(plot._widget.width(), 100), [c-1 for c in columns[1:]])
+        plot.columns = dict(zip(ckeys, [t]+list(y.T)))
+        plot.plot()
+        
+        self._set_plot_columns(plot, ckeys, columns)
+        self._plots_dirty[n] = False
+        self._t_redraw       = _time.monotonic()
+        
+        self.engine.perf.stop('redraw', t_start, len(t))
+    
+    def _update_performance(self):
+        """
+        Shows the engine's timings on the Performance tab, once a second.
+        """
+        if not self.engine.perf.enabled or _time.monotonic() - self._t_performance < 1: return
+        
+        self.label_performance.set_text(self.engine.perf.get_report())
+        self._t_performance = _time.monotonic()
+    
+    def _button_performance_toggled(self, *a):
+        """
+        Starts or stops recording timings.
+        """
+        self.engine.perf.enabled = self.button_performance.is_checked()
+    
+    def _button_performance_clear_clicked(self, *a):
+        """
+        Starts the timings over.
+        """
+        self.engine.perf.clear()
+        self.label_performance.set_text('')
+    
+    def _clear_samples(self, *a):
+        """
+        Clears the sample history when any plot's Clear button is pressed.
+        """
+        self.engine.clear()
     
     def setup_gui_components(self, name, temperature_limit):
         """
@@ -169,135 +443,120 @@ class temperature_controller(serial_gui_base):
         
         self.window.set_size([0,0])
         
+        # Telemetry protocol, next to the other serial controls
+        self.grid_top.add(_g.Label('Protocol:'), 10, 0)
+        self.combo_protocol = self.grid_top.add(_g.ComboBox(
+            ['ASCII', 'Binary'],
+            autosettings_path=name+'.combo_protocol',
+            tip='Telemetry format. Binary is used only if the firmware supports it.'), 11, 0)
+        
         self.grid_bot.new_autorow()
         
         # Add tabs to the bottom grid
         self.tabs = self.grid_bot.add(_g.TabArea(self.name+'.tabs'), alignment=0,column_span=10)
         
-        # Create main tab
-        self.tab_channel_0       = self.tabs.add_tab('Channel 0')
-        self.tab_channel_1       = self.tabs.add_tab('Channel 1')
-        self.tab_channel_sample  = self.tabs.add_tab('Sample')
-        
-        # Channel 0 tab segmentation
-        t01 = self.tab_channel_0.place_object(_g.GridLayout(margins=False), alignment=0, row=1,column=0)
-        t02 = self.tab_channel_0.place_object(_g.GridLayout(margins=False), alignment=0, row=1,column=1)
-        t03 = self.tab_channel_0.place_object(_g.GridLayout(margins=False), alignment=0, row=1,column=2)
-        t04 = self.tab_channel_0.place_object(_g.GridLayout(margins=False), alignment=0, row=2, column = 0,column_span=10)
-        
-        # Add relevant numberboxes for realtime channel 0 data
-        t01.add(_g.Label('Temperature:'), alignment=2).set_style('font-size: 15pt; font-weight: bold; color: white')
-        self.number_temperature_0 = t01.add(_g.NumberBox(
-            -273.16, bounds=(-273.16, temperature_limit), suffix='°C')).set_width(200).set_style('font-size: 15pt; font-weight: bold; color: white' ).disable()
-        t01.new_autorow()
-        
-        t01.add(_g.Label('Setpoint:'), alignment=2).set_style('font-size: 15pt; font-weight: bold; color: cyan' )
-        self.number_setpoint_0 = t01.add(_g.NumberBox(
-            25.4, bounds=(0, temperature_limit), suffix='°C',
-            signal_changed=self._send_parameters
-            )).set_width(200).set_style('font-size: 15pt; color: cyan').enable()
-        
-        t02.new_autorow()
-        t02.add(_g.Label('Band:'), alignment=2).set_style('font-size: 15pt; color: paleturquoise')
-        self.number_band_0 = t02.add(_g.NumberBox(
-            5, bounds=(0, 1000), suffix='°C',
-            signal_changed=self._send_parameters
-            )).set_width(200).set_style('font-size: 15pt; color: paleturquoise').enable()
-
-        t02.new_autorow()
-        t02.add(_g.Label('Integral time:'), alignment=2).set_style('font-size: 15pt; color: gold')
-        self.number_integral_0 = t02.add(_g.NumberBox(
-            30, bounds=(0, 1000), suffix='s',
-            signal_changed=self._send_parameters
-            )).set_width(200).set_style('font-size: 15pt; color: gold').enable()
-        
-        t02.new_autorow()
-        t02.add(_g.Label('Ramp rate:'), alignment=2).set_style('font-size: 15pt; color: pink')
-        self.number_rate_0 = t02.add(_g.NumberBox(
-            0.1, bounds=(0, 1000), suffix='s⁻¹',
-            signal_changed=self._send_parameters
-            )).set_width(200).set_style('font-size: 15pt; color: pink').enable()
-        
-        t03.add(_g.Label('Channel 0'), alignment=0, column=0, row=0).set_style('font-size: 20pt; color: royalblue')
-        self.channel_0_status = t03.add(_g.Label('(Disconnected)'), alignment=0, column=0, row=1).set_style('font-size: 20pt; color: coral')
-
-        # Make the Channel 0 plotter.
-        self.plot_0 = t04.add(_g.DataboxPlot(
-            file_type='*.csv',
-            autosettings_path=name+'.plot',
-            delimiter=',', show_logger=True), alignment=0, column_span=10)
-        
-        # Channel 1 tab segmentation
-        t11 = self.tab_channel_1.place_object(_g.GridLayout(margins=False), alignment=0, row=1,column=0)
-        t12 = self.tab_channel_1.place_object(_g.GridLayout(margins=False), alignment=0, row=1,column=1)
-        t13 = self.tab_channel_1.place_object(_g.GridLayout(margins=False), alignment=0, row=1,column=2)
-        t14 = self.tab_channel_1.place_object(_g.GridLayout(margins=False), alignment=0, row=2, column = 0,column_span=10)
-        
-        # Add relevant numberboxes for realtime channel 1 data
-        t11.add(_g.Label('Temperature:'), alignment=2).set_style('font-size: 15pt; font-weight: bold; color: white')
-        self.number_temperature_1 = t11.add(_g.NumberBox(
-            -273.16, bounds=(-273.16, temperature_limit), suffix='°C')).set_width(200).set_style('font-size: 15pt; font-weight: bold; color: white' ).disable()
-        t11.new_autorow()
-        
-        t11.add(_g.Label('Setpoint:'), alignment=2).set_style('font-size: 15pt; font-weight: bold; color: cyan' )
-        self.number_setpoint_1 = t11.add(_g.NumberBox(
-            25.4, bounds=(0, temperature_limit), suffix='°C',
-            signal_changed=self._send_parameters
-            )).set_width(200).set_style('font-size: 15pt; color: cyan').enable()
-        
-        t12.new_autorow()
-        t12.add(_g.Label('Band:'), alignment=2).set_style('font-size: 15pt; color: paleturquoise')
-        self.number_band_1 = t12.add(_g.NumberBox(
-            5, bounds=(0, 1000), suffix='°C',
-            signal_changed=self._send_parameters
-            )).set_width(200).set_style('font-size: 15pt; color: paleturquoise').enable()
-
-        t12.new_autorow()
-        t12.add(_g.Label('Integral time:'), alignment=2).set_style('font-size: 15pt; color: gold')
-        self.number_integral_1 = t12.add(_g.NumberBox(
-            30, bounds=(0, 1000), suffix='s',
-            signal_changed=self._send_parameters
-            )).set_width(200).set_style('font-size: 15pt; color: gold').enable()
-        
-        t12.new_autorow()
-        t12.add(_g.Label('Ramp rate:'), alignment=2).set_style('font-size: 15pt; color: pink')
-        self.number_rate_1 = t12.add(_g.NumberBox(
-            0.1, bounds=(0, 1000), suffix='s⁻¹',
-            signal_changed=self._send_parameters
-            )).set_width(200).set_style('font-size: 15pt; color: pink').enable()
-        
-        t13.add(_g.Label('Channel 1'), alignment=0, column=0, row=0).set_style('font-size: 20pt; color: fuchsia')
-        self.channel_1_status = t13.add(_g.Label('(Disconnected)')   , alignment=0, column=0, row=1).set_style('font-size: 20pt; color: coral')
-
-        # Make the Channel 1 plotter.
-        self.plot_1 = t14.add(_g.DataboxPlot(
-            file_type='*.csv',
-            autosettings_path=name+'.plot',
-            delimiter=',', show_logger=True), alignment=0, column_span=10)
-        
-        # Sample channel tab segmentation
-        tS1 = self.tab_channel_sample.place_object(_g.GridLayout(margins=False), alignment=0, row=0, column =0)
-        tS2 = self.tab_channel_sample.place_object(_g.GridLayout(margins=False), alignment=0, row=1, column = 0,column_span=10)
-        
-        # Add relevant numberboxe for realtime sample channel data
-        tS1.add(_g.Label('Sample Temperature:'), alignment=1).set_style('font-size: 15pt; font-weight: bold; color: white')
-        self.number_temperature_sample = tS1.add(_g.NumberBox(
-            -273.16, bounds=(-273.16, temperature_limit), suffix='°C')).set_width(200).set_style('font-size: 15pt; font-weight: bold; color: white' ).disable()
-        
-        # Make the Sample Channel plotter.
-        self.plot_sample = tS2.add(_g.DataboxPlot(
-            file_type='*.csv',
-            autosettings_path=name+'.plot',
-            delimiter=',', show_logger=True), alignment=0, column_span=10)
-
-        # Timer for collecting data
-        self.timer = _g.Timer(interval_ms=500, single_shot=False)
+        # Channel tabs, as described by the engine's schema
+        self._plots            = [] # (plot, ckeys, history columns), one per tab
+        self._temperature_boxes = [] # (number box, history column)
+        self._parameter_boxes  = dict()
+        self._status_labels    = []
+        self._metrics_labels   = []
+        for layout in _get_channel_layout(self.engine.schema): self._add_channel_tab(layout, name, temperature_limit)
+        
+        self.tab_performance = self.tabs.add_tab('Performance')
+        
+        # Performance tab: timings of each stage of the pipeline. Recording
+        # is off unless the button is checked.
+        tP1 = self.tab_performance.place_object(_g.GridLayout(margins=False), alignment=1, row=0, column=0)
+        self.button_performance = tP1.add(_g.Button(
+            'Record', checkable=True,
+            signal_toggled=self._button_performance_toggled,
+            tip='Record how long each stage of acquisition and drawing takes.'))
+        self.button_performance_clear = tP1.add(_g.Button(
+            'Clear', signal_clicked=self._button_performance_clear_clicked))
+        self.label_performance = self.tab_performance.place_object(_g.Label(''), alignment=1, row=1, column=0).set_style('font-family: monospace')
+        self._t_performance = 0
+        
+        # Plots of the engine's history. Each entry of _plots matches a tab.
+        self._plots_dirty = [False]*len(self._plots)
+        for plot, ckeys, columns in self._plots:
+            plot.button_clear.signal_clicked.connect(self._clear_samples)
+        
+        # Timer for collecting data. Redraws are throttled separately.
+        self.timer = _g.Timer(interval_ms=100, single_shot=False)
         self.timer.signal_tick.connect(self._timer_tick)
 
         # Bottom log file controls
         self.grid_bot.new_autorow()
+        
+        # Ramp/soak recipe controls
+        gP = self.grid_bot.add(_g.GridLayout(margins=False), alignment=1)
+        self.button_profile = gP.add(_g.Button(
+            'Run Recipe', signal_clicked=self._button_profile_clicked,
+            tip='Run a ramp/soak recipe file (lines of "channel, setpoint, rate, hold").'))
+        self.button_profile_stop = gP.add(_g.Button(
+            'Stop Recipe', signal_clicked=self._button_profile_stop_clicked))
+        self.label_profile = gP.add(_g.Label(''))
 
         return    
+    
+    def _add_channel_tab(self, layout, name, temperature_limit):
+        """
+        Adds a channel tab described by an entry of _get_channel_layout().
+        """
+        key = layout['key']
+        tab = self.tabs.add_tab(layout['title'])
+        setattr(self, 'tab_channel_'+key, tab)
+        
+        # Tab segmentation: readings, more parameters, status, metrics, plot
+        t1 = tab.place_object(_g.GridLayout(margins=False), alignment=0, row=1, column=0)
+        t2 = tab.place_object(_g.GridLayout(margins=False), alignment=0, row=1, column=1)
+        t3 = tab.place_object(_g.GridLayout(margins=False), alignment=0, row=1, column=2)
+        t5 = tab.place_object(_g.GridLayout(margins=False), alignment=0, row=1, column=3)
+        t4 = tab.place_object(_g.GridLayout(margins=False), alignment=0, row=2, column=0, column_span=10)
+        
+        # Realtime temperature
+        n = layout['control']
+        t1.add(_g.Label('Temperature:' if n is not None else layout['title']+' Temperature:'), alignment=2).set_style('font-size: 15pt; font-weight: bold; color: white')
+        number = t1.add(_g.NumberBox(
+            -273.16, bounds=(-273.16, temperature_limit), suffix='°C')).set_width(200).set_style('font-size: 15pt; font-weight: bold; color: white' ).disable()
+        setattr(self, 'number_temperature_'+key, number)
+        self._temperature_boxes.append((number, layout['temperature']))
+        
+        # Control parameters, status and metrics
+        if n is not None:
+            for i, (label, kind, suffix, color) in enumerate(_parameter_layout):
+                grid = t1 if i == 0 else t2
+                grid.new_autorow()
+                grid.add(_g.Label(label), alignment=2).set_style('font-size: 15pt; color: '+color)
+                bounds = parameter_bounds[kind]
+                name   = '%s_%d' % (kind, n)
+                number = grid.add(_g.NumberBox(
+                    self.engine.parameters[name], bounds=(bounds[0], temperature_limit if bounds[1] is None else bounds[1]), suffix=suffix,
+                    signal_changed=lambda *a, name=name: self._send_parameter(name)
+                    )).set_width(200).set_style('font-size: 15pt; color: '+color).enable()
+                setattr(self, 'number_%s_%s' % (kind, key), number)
+                self._parameter_boxes[name] = number
+            
+            t3.add(_g.Label(layout['title']), alignment=0, column=0, row=0).set_style('font-size: 20pt; color: '+layout['color'])
+            status = t3.add(_g.Label('(Disconnected)'), alignment=0, column=0, row=1).set_style('font-size: 20pt; color: coral')
+            setattr(self, 'channel_%s_status' % key, status)
+            self._status_labels.append(status)
+            
+            # Running statistics
+            metrics = t5.add(_g.Label('')).set_style('font-size: 12pt; color: lightgray')
+            setattr(self, 'label_metrics_'+key, metrics)
+            self._metrics_labels.append(metrics)
+        
+        # Plot of the history, with its own settings. They used to be shared
+        # by all the plots, as name+'.plot'.
+        self.settings_cache.aliases[name+'.plot_'+key] = name+'.plot'
+        plot = t4.add(_g.DataboxPlot(
+            file_type='*.csv',
+            autosettings_path=name+'.plot_'+key,
+            delimiter=',', show_logger=True), alignment=0, column_span=10)
+        setattr(self, 'plot_'+key, plot)
+        self._plots.append((plot, layout['ckeys'], layout['columns']))
 
 # Create an instance of the controller
 if __name__ == '__main__':
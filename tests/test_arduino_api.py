@@ -0,0 +1,51 @@
+import numpy  as _n
+import time   as _time
+import pytest
+
+from _arduino_api import arduino_api, encode_binary_frame, _binary_sync
+
+# loop:// hands back whatever is written to it, so it stands in for firmware
+# that has already sent something.
+
+def _ascii(rows):
+    return b''.join(b'%.2f\r\n' % x for x in _n.ravel(rows))
+
+def test_wait_ready_keeps_packets():
+    api = arduino_api('loop://')
+    rows = _n.arange(18.).reshape(2, 9)
+    api.serial.write(_ascii(rows))
+    assert api.wait_ready(1)
+
+    t, data = api.get_samples()
+    assert _n.allclose(data, rows)
+    api.disconnect()
+
+def test_negotiate_protocol_keeps_frames():
+    api = arduino_api('loop://')
+    rows = _n.arange(27.).reshape(3, 9)
+    api.serial.write(_binary_sync + b''.join(encode_binary_frame(k, row) for k, row in enumerate(rows)))
+    assert api.negotiate_protocol() == 'binary'
+
+    t, data = api.get_samples()
+    assert _n.allclose(data, rows)
+    assert _n.isfinite(t).all()
+    api.disconnect()
+
+def test_bad_port_is_not_simulated():
+    with pytest.raises(Exception): arduino_api('/dev/ttyNOPE')
+    assert arduino_api('Simulation').simulation_mode
+
+def test_stop_reader_while_reconnecting():
+    api = arduino_api('loop://')
+    api._port = '/dev/ttyNOPE' # Never comes back
+    api.start_reader()
+    api.serial.close()
+    
+    t0 = _time.monotonic()
+    while api.link_up and _time.monotonic()-t0 < 2: _time.sleep(0.01)
+    assert not api.link_up
+    
+    # Returns without waiting out the backoff
+    t0 = _time.monotonic()
+    api.stop_reader()
+    assert _time.monotonic()-t0 < 0.4 and api._reader is None
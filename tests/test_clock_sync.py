@@ -0,0 +1,44 @@
+import numpy as _n
+
+from _clock_sync import clock_sync
+
+def _reads(sync, count0, t0, period, reads, per_read=10, rng=None):
+    """
+    Feeds reads of per_read frames taken every period s from t0, each
+    arriving late by up to 20 ms, and returns the true and assigned times.
+    """
+    if rng is None: rng = _n.random.default_rng(0)
+    truth, times = [], []
+    for k in range(reads):
+        counts = count0 + k*per_read + _n.arange(per_read)
+        t_true = t0 + period*(counts-count0)
+        times.append(sync.update(counts % 65536, t_true[-1] + rng.uniform(0, 0.02)))
+        truth.append(t_true)
+    return _n.concatenate(truth), _n.concatenate(times)
+
+
+def test_drift_is_fitted():
+    
+    # The device's clock runs 1% slow, and the counter wraps along the way
+    sync = clock_sync()
+    truth, times = _reads(sync, 60000, 100.0, 0.0101, 200)
+    
+    assert abs(sync.period/0.0101 - 1) < 1e-3
+    error = (times - truth)[-500:]
+    assert error.min() >= -1e-3 and error.max() < 5e-3
+    assert _n.all(_n.diff(times) >= 0)
+
+def test_arrival_times_until_fitted():
+    sync  = clock_sync(min_points=16)
+    times = sync.update([0, 1, 2], 5.0)
+    assert sync.period is None and _n.all(times == 5.0)
+
+def test_restart():
+    sync = clock_sync()
+    truth, times = _reads(sync, 0, 0.0, 0.01, 100)
+    
+    # The device restarts its count a few seconds later
+    truth2, times2 = _reads(sync, 0, truth[-1]+5, 0.01, 100)
+    assert sync.resets == 1
+    assert times2[0] >= times[-1]
+    assert _n.abs(times2 - truth2)[-500:].max() < 0.03
@@ -0,0 +1,45 @@
+import json   as _json
+import math   as _math
+import socket as _socket
+
+import pytest
+
+from _controller_engine import controller_engine
+from _telemetry_server  import telemetry_server
+
+def test_invalid_parameters_change_nothing():
+    engine = controller_engine(log_path=None, temperature_limit=300)
+    before = dict(engine.parameters)
+    
+    for bad in [dict(setpoint_0='80'), dict(setpoint_0=_math.nan), dict(setpoint_0=_math.inf),
+                dict(setpoint_0=True), dict(setpoint_0=301), dict(band_1=-1), dict(rate_0=1e6),
+                dict(setpoint_1=50, integral_0=None), dict(bogus_0=1)]:
+        with pytest.raises(Exception): engine.set_parameters(**bad)
+        with pytest.raises(Exception): engine.apply_parameters(**bad)
+        assert engine.parameters == before
+    
+    engine.set_parameters(setpoint_0=300, band_1=1000)
+    assert engine.parameters['setpoint_0'] == 300.0
+    assert engine.schema.encode_parameters(engine.parameters).startswith('1200,')
+
+def test_server_rejects_invalid_set():
+    engine = controller_engine(log_path=None, temperature_limit=300)
+    server = telemetry_server(engine, port=0)
+    server.start()
+    try:
+        sock = _socket.create_connection(server._listener.getsockname())
+        f    = sock.makefile('rwb')
+        def ask(request):
+            f.write(request.encode()+b'\n')
+            f.flush()
+            return _json.loads(f.readline())
+        
+        for parameters in ['{"setpoint_0": "80"}', '{"setpoint_0": 99999}', '{"setpoint_0": NaN}']:
+            assert ask('{"cmd": "set", "parameters": %s}' % parameters)['type'] == 'error'
+        
+        reply = ask('{"cmd": "get"}')
+        assert reply['type'] == 'parameters' and reply['parameters'] == engine.parameters
+        assert ask('{"cmd": "set", "parameters": {"setpoint_0": 80}}')['parameters']['setpoint_0'] == 80
+        sock.close()
+    
+    finally: server.stop()
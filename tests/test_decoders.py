@@ -0,0 +1,114 @@
+import numpy as _n
+
+from _arduino_api import packet_decoder, binary_decoder, encode_binary_frame
+
+def _packets(count, length=9):
+    """
+    Returns count packets of distinct fields: packet k holds k+0.01*i.
+    """
+    return _n.arange(count)[:,None] + 0.01*_n.arange(length)
+
+def _ascii(rows):
+    return b''.join(b'%.2f\r\n' % x for x in _n.ravel(rows))
+
+def _binary(rows, seq0=0):
+    return b''.join(encode_binary_frame(seq0+k, row) for k, row in enumerate(rows))
+
+def _feed(decoder, stream, size):
+    """
+    Feeds the stream size bytes at a time, and returns all the rows.
+    """
+    blocks = [decoder.feed(stream[i:i+size], 0.0)[1] for i in range(0, len(stream), size)]
+    return _n.concatenate(blocks)
+
+
+def test_ascii_split_and_concatenated():
+    rows   = _packets(50)
+    stream = _ascii(rows)
+    for size in [1, 3, 7, 64, len(stream)]:
+        d = packet_decoder(frame_gap=None)
+        assert _n.allclose(_feed(d, stream, size), rows)
+        assert (d.frames, d.dropped, d.malformed) == (50, 0, 0)
+
+def test_ascii_corrupt_first_field_realigns():
+    rows  = _packets(20)
+    lines = _ascii(rows).split(b'\n')
+    lines[9*5] = b'2#.\xff0\r'
+    d   = packet_decoder(frame_gap=None)
+    out = _feed(d, b'\n'.join(lines), 16)
+    assert _n.allclose(out, _n.delete(rows, 5, axis=0))
+    assert (d.malformed, d.dropped) == (1, 1)
+
+def test_ascii_corrupt_middle_field_realigns():
+    rows  = _packets(20)
+    lines = _ascii(rows).split(b'\n')
+    lines[9*7+4] = b'junk\r'
+    d   = packet_decoder(frame_gap=None)
+    out = _feed(d, b'\n'.join(lines), 5)
+    assert _n.allclose(out, _n.delete(rows, 7, axis=0))
+    assert (d.malformed, d.dropped) == (1, 1)
+
+def test_ascii_lost_newline_realigns():
+    rows   = _packets(20)
+    stream = _ascii(rows)
+
+    # Merge the last field of packet 3 with the first of packet 4
+    i      = len(_ascii(rows[:3])) + len(_ascii(rows[3,:8])) + len(b'%.2f\r' % rows[3,8])
+    stream = stream[:i] + stream[i+1:]
+    d   = packet_decoder(frame_gap=None)
+    out = _feed(d, stream, 32)
+    assert _n.allclose(out, _n.delete(rows, [3, 4], axis=0))
+    assert (d.malformed, d.dropped) == (1, 2)
+
+def test_ascii_gap_resynchronizes():
+    rows   = _packets(3)
+    stream = _ascii(rows)
+    d = packet_decoder(frame_gap=0.1)
+
+    # Half a packet, then silence, then whole packets
+    t, out = d.feed(stream[:30], 0.0)
+    t, out = d.feed(stream[len(_ascii(rows[:1])):], 1.0)
+    assert _n.allclose(out, rows[1:])
+    assert d.dropped == 1
+
+
+def test_binary_split_and_concatenated():
+    rows   = _packets(50)
+    stream = _binary(rows)
+    for size in [1, 5, 33, len(stream)]:
+        d = binary_decoder()
+        assert _n.allclose(_feed(d, stream, size), rows.astype(_n.float32))
+        assert (d.frames, d.dropped, d.malformed) == (50, 0, 0)
+
+def test_binary_corrupt_and_junk():
+    rows   = _packets(20)
+    frames = [_binary(rows[k:k+1], k) for k in range(20)]
+    frames[4] = frames[4][:10] + bytes([frames[4][10] ^ 0xff]) + frames[4][11:] # Fails the CRC
+    frames[9] = b'\x00\xa5junk' + frames[9]                                       # Junk before a frame
+    d   = binary_decoder()
+    out = _feed(d, b''.join(frames), 17)
+    assert _n.allclose(out, _n.delete(rows, 4, axis=0).astype(_n.float32))
+    assert d.frames  == 19
+    assert d.dropped == 1
+    assert d.malformed >= 2
+
+def test_binary_sequence_gap_counted():
+    rows   = _packets(10)
+    stream = _binary(rows[:5]) + _binary(rows[5:], 8)
+    d = binary_decoder()
+    assert len(_feed(d, stream, 64)) == 10
+    assert d.dropped == 3
+
+def test_binary_bulk_crc():
+    
+    # Long runs have their CRCs checked all at once; corrupt a few, and
+    # wrap the sequence numbers along the way
+    rows   = _packets(1000)
+    frames = [_binary(rows[k:k+1], 65000+k) for k in range(1000)]
+    bad    = [3, 500, 999]
+    for k in bad: frames[k] = frames[k][:20] + bytes([frames[k][20] ^ 0x01]) + frames[k][21:]
+    
+    d   = binary_decoder()
+    out = _feed(d, b''.join(frames), 1000*len(frames[0]))
+    assert _n.allclose(out, _n.delete(rows, bad, axis=0).astype(_n.float32))
+    assert (d.frames, d.dropped, d.malformed) == (997, 2, 3)
@@ -0,0 +1,56 @@
+import numpy as _n
+
+from _envelope import minmax_envelope
+
+def _check(envelope, t, data, points=None):
+    """
+    Checks every bucket of the envelope against the samples it spans.
+    """
+    te, y = envelope.get(points)
+    assert _n.all(_n.diff(te) >= 0)
+    for k in range(len(te)//2):
+        span = (t >= te[2*k]) & (t <= te[2*k+1])
+        assert span.any()
+        assert _n.array_equal(y[2*k],   _n.nanmin(data[span], 0))
+        assert _n.array_equal(y[2*k+1], _n.nanmax(data[span], 0))
+    
+    # Every sample is in a bucket
+    assert te[0] == t[0] and te[-1] == t[-1]
+
+
+def test_full_resolution():
+    t    = _n.arange(10.)
+    data = _n.random.default_rng(0).normal(size=(10, 2))
+    e    = minmax_envelope(2, width=8).append(t, data)
+    te, y = e.get()
+    assert _n.array_equal(te, t) and _n.array_equal(y, data)
+
+def test_merging_keeps_extremes():
+    rng  = _n.random.default_rng(1)
+    t    = _n.arange(5000.)
+    data = rng.normal(size=(5000, 3))
+    data[1234, 1] = 100
+    data[4321, 2] = -100
+    
+    # Any block sizes give the same envelope
+    whole = minmax_envelope(3, width=16).append(t, data)
+    parts = minmax_envelope(3, width=16)
+    for i in _n.split(_n.arange(5000), [1, 7, 100, 101, 2000, 4999]): parts.append(t[i], data[i])
+    
+    assert _n.array_equal(whole.get()[1], parts.get()[1])
+    assert len(whole) <= 2*16
+    _check(whole, t, data)
+    _check(whole, t, data, points=5)
+    assert whole.get()[1][:,1].max() == 100 and whole.get()[1][:,2].min() == -100
+
+def test_gaps_and_clear():
+    t    = _n.arange(100.)
+    data = _n.ones((100, 1))
+    data[10:20] = _n.nan
+    data[50]    = 7
+    e = minmax_envelope(1, width=4).append(t, data)
+    _check(e, t, data)
+    
+    assert len(e.clear()) == 0
+    e.append(t[:3], data[:3])
+    assert _n.array_equal(e.get()[0], t[:3])
@@ -0,0 +1,46 @@
+import numpy as _n
+
+from _metrics import channel_metrics
+
+def _run(t, x, u, setpoints, sizes):
+    """
+    Feeds the samples in blocks of the given sizes (cycled), returning the
+    metrics after each block boundary that every split shares.
+    """
+    m, i, k = channel_metrics(settle_hold=5), 0, 0
+    while i < len(t):
+        n = sizes[k % len(sizes)]
+        m.append(t[i:i+n], x[i:i+n], u[i:i+n], setpoints[i])
+        i, k = i+n, k+1
+    return m.get()
+
+
+def test_block_size_does_not_matter():
+    rng = _n.random.default_rng(0)
+    N   = 6000
+    dt  = rng.exponential(0.1, N)
+    dt[::97] = 0
+    t = _n.cumsum(dt)
+    x = 25 + 0.01*t + rng.normal(0, 0.3, N)
+    x[::53] = _n.nan
+    u = rng.uniform(0, 100, N)
+    setpoints = _n.where(_n.arange(N) < 3000, 25.0, 40.0)
+    
+    # Setpoints change on a boundary shared by every split
+    reference = _run(t, x, u, setpoints, [1])
+    for sizes in [[3000], [7, 1, 250, 42], [1000]]:
+        result = _run(t, x, u, setpoints, sizes)
+        for key, value in reference.items(): 
+            assert _n.isclose(result[key], value, rtol=1e-9, atol=1e-12, equal_nan=True), key
+
+def test_ramp_and_settling():
+    t = _n.arange(0, 200, 0.1)
+    x = _n.minimum(20 + 0.5*t, 50)
+    m = channel_metrics(window=10, band=0.5, settle_hold=30)
+    m.append(t[:500], x[:500], _n.full(500, 100.0), 50)
+    assert _n.isclose(m.rate, 0.5) and m.saturated == 1
+    assert not m.is_settled()
+    
+    m.append(t[500:], x[500:], _n.full(len(t)-500, 10.0), 50)
+    assert m.is_settled() and _n.isclose(m.settling_time, 59.0)
+    assert m.overshoot == 0 and abs(m.mean-50) < 1e-3 and m.get_std() < 0.05
@@ -0,0 +1,60 @@
+from _controller_engine import parameter_sync
+
+def _send_due(sync, now):
+    """
+    Sends whatever is due at now, returning it.
+    """
+    msg = sync.get_due(now)
+    if msg is not None: sync.mark_sent(msg, now)
+    return msg
+
+
+def test_debounce():
+    sync = parameter_sync(delay=0.2, max_delay=1)
+    sync.request('a', 0.0)
+    sync.request('b', 0.1)
+    assert _send_due(sync, 0.25) is None
+    assert _send_due(sync, 0.35) == 'b'
+    assert sync.frames == 1 and sync.requests == 2
+
+def test_max_delay():
+    sync = parameter_sync(delay=0.2, max_delay=1)
+    
+    # Changes every 0.125 s never go quiet, but a frame goes out a second
+    # after the first change held
+    sent = []
+    for n in range(25):
+        sync.request(str(n), 0.125*n)
+        sent.append(_send_due(sync, 0.125*n))
+    assert [x for x in sent if x is not None] == ['8', '17']
+
+def test_duplicates_not_sent():
+    sync = parameter_sync(delay=0.2)
+    sync.request('a', 0.0)
+    assert _send_due(sync, 0.2) == 'a'
+    sync.request('a', 1.0)
+    assert sync.pending is None and _send_due(sync, 2.0) is None
+    
+    # Back to the frame already sent before a different one went out
+    sync.acknowledge(0.5)
+    sync.request('b', 3.0)
+    sync.request('a', 3.1)
+    assert _send_due(sync, 3.5) is None
+
+def test_retries_until_acknowledged():
+    sync = parameter_sync(delay=0, ack_timeout=3, retries=2)
+    sync.request('a', 0.0)
+    assert _send_due(sync, 0.0) == 'a'
+    
+    # Telemetry from before the frame went out doesn't count
+    sync.acknowledge(-1.0)
+    assert _send_due(sync, 3.5) == 'a'
+    assert _send_due(sync, 7.0) == 'a'
+    assert _send_due(sync, 20.0) is None
+    assert sync.frames == 3
+    
+    # Acknowledged frames are left alone
+    sync.request('b', 21.0)
+    assert _send_due(sync, 21.0) == 'b'
+    sync.acknowledge(21.5)
+    assert sync.acked == 'b' and _send_due(sync, 30.0) is None
@@ -0,0 +1,62 @@
+import threading as _threading
+import time      as _time
+
+import pytest
+
+from _controller_engine import controller_engine
+from _profile           import profile_scheduler
+
+class _engine():
+    """
+    Just enough of a controller_engine to record what a profile sends.
+    """
+    def __init__(self):
+        self.parameters  = dict(setpoint_0=20.0, rate_0=1.0)
+        self.sent        = []
+        self._write_lock = _threading.RLock()
+    
+    def apply_parameters(self, **kwargs):
+        with self._write_lock:
+            self.parameters.update(kwargs)
+            self.sent.append(kwargs)
+    
+    def check_parameters(self, parameters): return parameters
+
+
+def test_segments_are_sent_on_time():
+    engine    = _engine()
+    scheduler = profile_scheduler()
+    p = scheduler.start_profile(engine, [(30, 100, 0.05), (40, 100, 0)])
+    
+    t0 = _time.monotonic()
+    while not p.done and _time.monotonic()-t0 < 2: _time.sleep(0.01)
+    scheduler.stop()
+    
+    assert p.done
+    assert [x['setpoint_0'] for x in engine.sent] == [30, 40]
+    assert p.lateness < 0.1
+
+def test_stop_while_segment_due():
+    engine    = _engine()
+    scheduler = profile_scheduler()
+    
+    # Stop the profile (as a watchdog trip would, under the write lock)
+    # after the scheduler has taken its first segment but before it sends it
+    with engine._write_lock:
+        p  = scheduler.start_profile(engine, [(300, 1, 10)])
+        t0 = _time.monotonic()
+        while p.index < 0 and _time.monotonic()-t0 < 2: _time.sleep(0.001)
+        assert p.index == 0
+        scheduler.stop_profile(p)
+    
+    _time.sleep(0.1)
+    scheduler.stop()
+    assert engine.sent == []
+
+def test_recipe_beyond_limit_is_rejected():
+    engine    = controller_engine(log_path=None, temperature_limit=300)
+    scheduler = profile_scheduler()
+    
+    with pytest.raises(ValueError): scheduler.start_recipe(engine, {0: [(100, 1, 0)], 1: [(400, 1, 0)]})
+    with pytest.raises(ValueError): scheduler.start_profile(engine, [(100, -1, 0)])
+    assert scheduler.profiles == [] and scheduler._thread is None
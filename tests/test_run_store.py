@@ -0,0 +1,40 @@
+import numpy as _n
+
+from _history   import chunk_store
+from _run_store import summary_pyramid, run_store
+
+def _write_run(path, count, close):
+    """
+    Logs count samples of two columns, as the data logger would.
+    """
+    store   = chunk_store(path, ['Time (s)', 'a', 'b'])
+    pyramid = summary_pyramid(store.path, 2)
+    t = _n.arange(count)*0.5
+    x = _n.c_[t, _n.sin(t), _n.cos(t)]
+    for i in range(0, count, 1000): 
+        store  .append(x[i:i+1000])
+        pyramid.append(x[i:i+1000])
+    if close: pyramid.close()
+    return store.path, x
+
+
+def test_unclosed_run_reaches_the_end(tmp_path):
+    
+    # A run that never closed has only complete groups written
+    path, x = _write_run(str(tmp_path), 100000, close=False)
+    r = run_store(path)
+    
+    for level, tail in zip(r.levels, r.tails):
+        rows = _n.concatenate([level, tail])
+        assert rows[-1,1] == x[-1,0]
+        assert _n.array_equal(rows[:,-2:].sum(0), [len(x)]*2)
+        assert _n.isclose(_n.min(rows[:,2]), x[:,1].min()) and _n.isclose(_n.max(rows[:,4]), x[:,1].max())
+    
+    t, lo, hi, mean, level = r.get(1, points=100)
+    assert level > 1 and t[-1] > x[-2000,0]
+
+def test_closed_run_has_no_tails(tmp_path):
+    path, x = _write_run(str(tmp_path), 100000, close=True)
+    r = run_store(path)
+    assert all(len(tail) == 0 for tail in r.tails)
+    assert r.levels[-1][-1,1] == x[-1,0]